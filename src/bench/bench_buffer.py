@@ -0,0 +1,137 @@
+# Copyright 2017 Simon Kennedy <sffjunkie+code@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compare JSONBuffer against the original per-character implementation.
+
+Run with ``python src/bench/bench_buffer.py``
+"""
+
+import sys
+import os.path
+p = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, p)
+
+import json
+import timeit
+
+from jsonrpc.buffer import JSONBuffer
+
+
+class LegacyJSONBuffer(object):
+    """The per-character JSONBuffer implementation from jsonrpc 0.1"""
+    def __init__(self, result_handler=None, encoding='UTF-8'):
+        self.messsages = []
+
+        self._result_handler = result_handler
+        self._encoding = encoding
+        self._in_quote = False
+        self._quote_char = ''
+        self._bracket_count = 0
+        self._data = ''
+
+    def append(self, data):
+        if not isinstance(data, str):
+            data = data.decode(self._encoding)
+
+        pos = start = 0
+        end = len(data)
+
+        prev_ch = ''
+
+        while 1:
+            ch = data[pos]
+            if (ch == '"' or ch == "'") and prev_ch != '\\':
+                if not self._in_quote:
+                    self._in_quote = True
+                    self._quote_char = ch
+                elif ch == self._quote_char:
+                    self._in_quote = False
+
+            elif ch == '{':
+                if not self._in_quote:
+                    self._bracket_count += 1
+
+            elif ch == '}':
+                if not self._in_quote:
+                    self._bracket_count -= 1
+
+                    if self._bracket_count == 0:
+                        _data = self._data
+                        _data += data[start:pos+1]
+                        self._data = ''
+                        data = data[pos+1:]
+                        start = 0
+                        end = len(data)
+                        pos = -1
+
+                        self.messsages.append(_data)
+                        if self._result_handler:
+                            self._result_handler(_data)
+
+                    elif self._bracket_count < 0:
+                        start = pos + 1
+                        self._bracket_count = 0
+
+            prev_ch = ch
+            pos += 1
+
+            if pos == end:
+                break
+
+        self._data += data[start:end]
+
+
+def artists(count):
+    """A Kodi style AudioLibrary.GetArtists response"""
+    result = {'artists': [{'artistid': idx,
+                           'label': 'Artist \\"%d\\"' % idx,
+                           'genre': ['Rock', 'Pop'],
+                           'thumbnail': 'image://music/%d.jpg/' % idx}
+                          for idx in range(count)],
+              'limits': {'start': 0, 'end': count, 'total': count}}
+    return json.dumps({'jsonrpc': '2.0', 'id': 1, 'result': result}).encode()
+
+
+def chunked(data, size):
+    return [data[idx:idx + size] for idx in range(0, len(data), size)]
+
+
+def run(cls, chunks):
+    b = cls()
+    for chunk in chunks:
+        b.append(chunk)
+    return b
+
+
+def scenarios():
+    small = b'{"jsonrpc": "2.0", "id": 1, "result": "OK"}'
+    yield 'many small messages, one chunk', [small * 2000]
+    yield '2000 small messages, 1 per chunk', [small] * 2000
+    yield '1 MB message, 64 KB chunks', chunked(artists(8000), 65536)
+    yield '8 MB message, 64 KB chunks', chunked(artists(64000), 65536)
+
+
+def main(number=3):
+    for name, chunks in scenarios():
+        size = sum(len(chunk) for chunk in chunks)
+        print(name)
+        for cls in (LegacyJSONBuffer, JSONBuffer):
+            elapsed = min(timeit.repeat(lambda: run(cls, chunks),
+                                        repeat=number, number=1))
+            print('    %-18s %8.2f ms %8.1f MB/s' % (
+                cls.__name__, elapsed * 1000, size / elapsed / 1e6))
+
+
+if __name__ == '__main__':
+    main()
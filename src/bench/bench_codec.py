@@ -0,0 +1,76 @@
+# Copyright 2017 Simon Kennedy <sffjunkie+code@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compare the installed JSON codecs marshalling and unmarshalling messages.
+
+Run with ``python src/bench/bench_codec.py``
+"""
+
+import sys
+import os.path
+p = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, p)
+
+import timeit
+
+from jsonrpc.codec import available_codecs, get_codec
+from jsonrpc.message import RPCRequest, RPCResponse
+
+from bench_buffer import artists
+
+
+def request():
+    return RPCRequest('Player.GetProperties', uid=1, playerid=1,
+                      properties=['time', 'totaltime', 'percentage',
+                                  'speed', 'position'])
+
+
+def properties():
+    return (b'{"id": 1, "jsonrpc": "2.0", "result": {"percentage": 12.5,'
+            b' "position": 3, "speed": 1, "time": {"hours": 0, "milliseconds":'
+            b' 512, "minutes": 3, "seconds": 21}, "totaltime": {"hours": 0,'
+            b' "milliseconds": 0, "minutes": 26, "seconds": 50}}}')
+
+
+def unmarshal(data, codec):
+    response = RPCResponse()
+    response.unmarshal(data, codec)
+    return response
+
+
+def scenarios():
+    r = request()
+    small = properties()
+    large = artists(8000)
+    yield 'marshal Player.GetProperties request', \
+        lambda codec: r.marshal(codec), 10000
+    yield 'unmarshal Player.GetProperties response', \
+        lambda codec: unmarshal(small, codec), 10000
+    yield 'unmarshal %.1f MB AudioLibrary.GetArtists response' % (
+        len(large) / 1e6), lambda codec: unmarshal(large, codec), 5
+
+
+def main(repeat=3):
+    codecs = [get_codec(name) for name in available_codecs()]
+    for name, func, number in scenarios():
+        print(name)
+        for codec in codecs:
+            elapsed = min(timeit.repeat(lambda: func(codec),
+                                        repeat=repeat, number=number))
+            print('    %-10s %10.2f us/op' % (codec.name,
+                                             elapsed / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
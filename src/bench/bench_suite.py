@@ -0,0 +1,270 @@
+# Copyright 2017 Simon Kennedy <sffjunkie+code@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark the buffer, the message classes and end to end calls over HTTP,
+TCP and a Unix domain socket against an in-process server on the same
+host.
+
+Results are written as JSON so that runs on different commits can be
+compared::
+
+    python src/bench/bench_suite.py --output before.json
+    git checkout ...
+    python src/bench/bench_suite.py --output after.json --compare before.json
+"""
+
+import sys
+import os.path
+p = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, p)
+
+import argparse
+import asyncio
+import json
+import platform
+import socket
+import subprocess
+import tempfile
+import time
+import timeit
+
+from jsonrpc.buffer import JSONBuffer
+from jsonrpc.client import RPCClient
+from jsonrpc.message import RPCRequest, RPCPreparedRequest, RPCResponse
+from jsonrpc.server import RPCServer
+
+from bench_buffer import artists, chunked
+from bench_codec import request, properties
+
+SMALL = b'{"jsonrpc": "2.0", "id": 1, "result": "OK"}'
+
+
+def best(func, number, repeat):
+    """Return the fastest time in seconds for one call of func"""
+    return min(timeit.repeat(func, repeat=repeat, number=number)) / number
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    last = len(samples) - 1
+
+    def pick(fraction):
+        return samples[int(round(last * fraction))] * 1e6
+
+    return {'p50_us': pick(0.5), 'p90_us': pick(0.9), 'p99_us': pick(0.99),
+            'max_us': samples[-1] * 1e6}
+
+
+def bench_buffer(repeat, large_count):
+    def append_all(chunks):
+        b = JSONBuffer()
+        for chunk in chunks:
+            b.append(chunk)
+
+    large = artists(large_count)
+    cases = [
+        ('small messages, 64 KB chunks', chunked(SMALL * 2000, 65536)),
+        ('small messages, 1 per chunk', [SMALL] * 2000),
+        ('small messages, 7 byte chunks', chunked(SMALL * 200, 7)),
+    ]
+    for size in (512, 16384, 65536):
+        cases.append(('%.1f MB message, %d byte chunks' % (
+            len(large) / 1e6, size), chunked(large, size)))
+
+    results = {}
+    for name, chunks in cases:
+        size = sum(len(chunk) for chunk in chunks)
+        elapsed = best(lambda: append_all(chunks), 1, repeat)
+        results[name] = {'ms': elapsed * 1e3, 'mb_per_s': size / elapsed / 1e6}
+    return results
+
+
+def bench_message(repeat, large_count):
+    def unmarshal(data, lazy=False):
+        response = RPCResponse()
+        response.unmarshal(data, lazy=lazy)
+
+    r = request()
+    prepared = RPCPreparedRequest(r.method, ['playerid'],
+                                  {'properties': r.params['properties']})
+    small = properties()
+    large = artists(large_count)
+    cases = [
+        ('marshal Player.GetProperties request', lambda: r.marshal(), 10000),
+        ('build and marshal Player.GetProperties request',
+         lambda: RPCRequest(r.method, 1, '2.0', False, playerid=1,
+                            properties=r.params['properties']).marshal(),
+         10000),
+        ('build and marshal prepared Player.GetProperties request',
+         lambda: prepared.request(1, 1).marshal(), 10000),
+        ('unmarshal Player.GetProperties response',
+         lambda: unmarshal(small), 10000),
+        ('unmarshal %.1f MB AudioLibrary.GetArtists response' % (
+            len(large) / 1e6), lambda: unmarshal(large), 3),
+        ('unmarshal %.1f MB AudioLibrary.GetArtists response lazily' % (
+            len(large) / 1e6), lambda: unmarshal(large, True), 100),
+    ]
+
+    results = {}
+    for name, func, number in cases:
+        results[name] = {'us_per_op': best(func, number, repeat) * 1e6}
+    return results
+
+
+def make_server(large_count):
+    server = RPCServer()
+    library = json.loads(artists(large_count).decode('UTF-8'))['result']
+
+    @server.register('JSONRPC.Ping')
+    def ping():
+        return 'pong'
+
+    @server.register('AudioLibrary.GetArtists')
+    def get_artists():
+        return library
+
+    return server
+
+
+async def bench_calls(conn, calls, concurrency):
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        await conn.request(RPCRequest('JSONRPC.Ping'))
+        latencies.append(time.perf_counter() - start)
+
+    results = {'sequential': percentiles(latencies)}
+
+    async def worker(count):
+        for _ in range(count):
+            await conn.request(RPCRequest('JSONRPC.Ping'))
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(calls // concurrency)
+                           for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    results['concurrent'] = {
+        'concurrency': concurrency,
+        'calls_per_s': (calls // concurrency) * concurrency / elapsed,
+    }
+
+    latencies = []
+    for _ in range(3):
+        start = time.perf_counter()
+        await conn.request(RPCRequest('AudioLibrary.GetArtists'))
+        latencies.append(time.perf_counter() - start)
+    results['large result'] = {'ms': min(latencies) * 1e3}
+
+    return results
+
+
+async def bench_end_to_end(calls, concurrency, large_count):
+    server = make_server(large_count)
+    runner = await server.start_http('127.0.0.1', 0)
+    http_port = runner.addresses[0][1]
+    tcp = await server.start_tcp('127.0.0.1', 0)
+    tcp_port = tcp.sockets[0].getsockname()[1]
+
+    results = {}
+    try:
+        async with RPCClient('127.0.0.1', http_port) as conn:
+            results['http'] = await bench_calls(conn, calls, concurrency)
+
+        async with RPCClient('127.0.0.1', tcp_port, method='tcp') as conn:
+            results['tcp'] = await bench_calls(conn, calls, concurrency)
+
+        if hasattr(socket, 'AF_UNIX'):
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'jsonrpc.sock')
+                await server.start_unix(path)
+                async with RPCClient(path, method='unix') as conn:
+                    results['unix'] = await bench_calls(conn, calls,
+                                                        concurrency)
+    finally:
+        await server.close()
+
+    return results
+
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(__file__),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results, prefix=''):
+    """Flatten nested results to {'group / case / metric': value}"""
+    flat = {}
+    for key, value in results.items():
+        name = prefix + key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + ' / '))
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+
+def compare(current, previous):
+    """Print the change in each metric from a previous run"""
+    old = flatten(previous['results'])
+    new = flatten(current['results'])
+    print('compared with %s' % (previous.get('revision') or 'previous run'))
+    for name in sorted(new):
+        if name in old and old[name]:
+            change = (new[name] - old[name]) / old[name] * 100
+            print('    %-80s %+7.1f%%' % (name, change))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', help='File to write the results to')
+    parser.add_argument('--compare', help='Results of a previous run')
+    parser.add_argument('--quick', action='store_true',
+                        help='Fewer iterations and smaller payloads')
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        repeat, calls, large_count = 1, 200, 2000
+    else:
+        repeat, calls, large_count = 3, 2000, 16000
+
+    results = {
+        'buffer': bench_buffer(repeat, large_count * 4),
+        'message': bench_message(repeat, large_count * 4),
+        'end to end': asyncio.run(bench_end_to_end(calls, 10, large_count)),
+    }
+    report = {
+        'revision': revision(),
+        'python': platform.python_version(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            fp.write(text + '\n')
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            compare(report, json.load(fp))
+
+
+if __name__ == '__main__':
+    main()
@@ -11,12 +11,35 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import re
+import struct
+
+from jsonrpc import RPCError
+
+__all__ = ['JSONBuffer', 'LineBuffer', 'LengthPrefixBuffer', 'get_framing']
+
+# Bytes which can start a message
+_OPEN = re.compile(rb'[{\[]')
+# Skips complete strings and other bytes up to the next bracket or the
+# opening quote of an unterminated string
+_STRUCTURAL = re.compile(rb'''
+    [^"{}\[\]]*
+    (?:"[^"\\]*(?:\\.[^"\\]*)*"[^"{}\[\]]*)*
+    [{}\[\]"]
+''', re.DOTALL | re.VERBOSE)
+# Bytes which affect framing inside a string
+_STRING = re.compile(rb'["\\]')
+
 
 class JSONBuffer(object):
     """A buffer for JSON messages.
 
     If a result handler is provided then it will be called with the list
     of messages whenever a complete message is received.
+
+    Incoming data is kept as bytes and scanned once from a cursor, jumping
+    directly between the bytes which affect framing. Only complete messages
+    are decoded; if ``encoding`` is None messages are passed on as bytes.
     """
     def __init__(self, result_handler=None, encoding='UTF-8'):
         self.messsages = []
@@ -24,59 +47,176 @@ class JSONBuffer(object):
         self._result_handler = result_handler
         self._encoding = encoding
         self._in_quote = False
-        self._quote_char = ''
         self._bracket_count = 0
-        self._data = ''
+        self._data = bytearray()
+        self._start = 0
+        self._pos = 0
 
     def append(self, data):
         """Append a string or a UTF-8 encoded string"""
 
-        if not isinstance(data, str):
-            data = data.decode(self._encoding)
-
-        pos = start = 0
-        end = len(data)
+        if isinstance(data, str):
+            data = data.encode(self._encoding or 'UTF-8')
+
+        buf = self._data
+        buf += data
+        pos = self._pos
+        start = self._start
+        end = len(buf)
+
+        while pos < end:
+            if self._bracket_count == 0:
+                # Skip anything between messages
+                match = _OPEN.search(buf, pos)
+                if match is None:
+                    pos = start = end
+                    break
+
+                start = match.start()
+                pos = start + 1
+                self._bracket_count = 1
+
+            elif self._in_quote:
+                match = _STRING.search(buf, pos)
+                if match is None:
+                    pos = end
+                    break
+
+                pos = match.start()
+                if buf[pos] == 0x5c:  # backslash
+                    if pos + 1 == end:
+                        # Wait for the escaped character
+                        break
+                    pos += 2
+                else:
+                    self._in_quote = False
+                    pos += 1
 
-        prev_ch = ''
+            else:
+                match = _STRUCTURAL.match(buf, pos)
+                if match is None:
+                    pos = end
+                    break
 
-        while 1:
-            ch = data[pos]
-            if (ch == '"' or ch == "'") and prev_ch != '\\':
-                if not self._in_quote:
+                pos = match.end()
+                ch = buf[pos - 1]
+                if ch == 0x22:  # double quote
                     self._in_quote = True
-                    self._quote_char = ch
-                elif ch == self._quote_char:
-                    self._in_quote = False
-
-            elif ch == '{':
-                if not self._in_quote:
+                elif ch == 0x7b or ch == 0x5b:  # { or [
                     self._bracket_count += 1
-
-            elif ch == '}':
-                if not self._in_quote:
+                else:
                     self._bracket_count -= 1
-
                     if self._bracket_count == 0:
-                        _data = self._data
-                        _data += data[start:pos+1]
-                        self._data = ''
-                        data = data[pos+1:]
-                        start = 0
-                        end = len(data)
-                        pos = -1
-
-                        self.messsages.append(_data)
-                        if self._result_handler:
-                            self._result_handler(_data)
-
-                    elif self._bracket_count < 0:
-                        start = pos + 1
-                        self._bracket_count = 0
-
-            prev_ch = ch
-            pos += 1
-
-            if pos == end:
+                        self._message_complete(buf[start:pos])
+                        start = pos
+
+        # Drop consumed data once per call so the cost stays linear
+        if start:
+            del buf[:start]
+            pos -= start
+            start = 0
+
+        self._pos = pos
+        self._start = start
+
+    @staticmethod
+    def frame(data):
+        """Frame an encoded message to be sent to a peer using this buffer"""
+        return data
+
+    def _message_complete(self, data):
+        if self._encoding is None:
+            message = bytes(data)
+        else:
+            message = data.decode(self._encoding)
+        self.messsages.append(message)
+        if self._result_handler:
+            self._result_handler(message)
+
+
+class LineBuffer(JSONBuffer):
+    """A buffer for newline delimited JSON messages.
+
+    Each message is a single line so a message is found with one search
+    for the next newline, without inspecting its content. Blank lines are
+    ignored.
+    """
+    def append(self, data):
+        """Append a string or a UTF-8 encoded string"""
+
+        if isinstance(data, str):
+            data = data.encode(self._encoding or 'UTF-8')
+
+        buf = self._data
+        buf += data
+        start = 0
+
+        while True:
+            pos = buf.find(b'\n', self._pos)
+            if pos == -1:
+                break
+
+            line = buf[start:pos].strip()
+            start = self._pos = pos + 1
+            if line:
+                self._message_complete(line)
+
+        del buf[:start]
+        self._pos = len(buf)
+
+    @staticmethod
+    def frame(data):
+        return data + b'\n'
+
+
+class LengthPrefixBuffer(JSONBuffer):
+    """A buffer for JSON messages preceded by their length in bytes as a 4
+    byte big endian integer."""
+
+    _header = struct.Struct('>I')
+
+    def append(self, data):
+        """Append a string or a UTF-8 encoded string"""
+
+        if isinstance(data, str):
+            data = data.encode(self._encoding or 'UTF-8')
+
+        buf = self._data
+        buf += data
+        start = 0
+        end = len(buf)
+
+        while end - start >= 4:
+            (length,) = self._header.unpack_from(buf, start)
+            if end - start - 4 < length:
                 break
 
-        self._data += data[start:end]
+            self._message_complete(buf[start + 4:start + 4 + length])
+            start += 4 + length
+
+        del buf[:start]
+
+    @classmethod
+    def frame(cls, data):
+        return cls._header.pack(len(data)) + data
+
+
+_FRAMINGS = {
+    'json': JSONBuffer,
+    'line': LineBuffer,
+    'length': LengthPrefixBuffer,
+}
+
+
+def get_framing(framing):
+    """Return the buffer class for a framing mode.
+
+    Args:
+        framing (str): 'json' to find messages by counting brackets, 'line'
+            for newline delimited messages or 'length' for messages
+            preceded by a 4 byte length.
+    """
+    try:
+        return _FRAMINGS[framing]
+    except KeyError:
+        raise RPCError('Unrecognised framing %s specified' % framing)
@@ -0,0 +1,191 @@
+# Copyright 2017 Simon Kennedy <sffjunkie+code@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import time
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+
+from jsonrpc.message import RPCResponse
+
+__all__ = ['RPCCache']
+
+
+class RPCCache(object):
+    """A cache of the results of idempotent methods for :class:`~jsonrpc.client.RPCClient`
+
+    Only methods matching a pattern added with :meth:`add` are cached.
+    Results are keyed on the method name and the parameters, with the
+    parameters encoded with sorted keys so that equal parameters always
+    give the same key. Cached results are returned as is so they should be
+    treated as read only.
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+        self._rules = []
+        self._method_rules = {}
+
+    def add(self, pattern, ttl=None, max_entries=128, max_bytes=None,
+            invalidated_by=()):
+        """Cache the results of the methods matching a pattern.
+
+        Args:
+            pattern (str): A method name or a glob e.g. 'AudioLibrary.Get*'
+            ttl (float): Seconds a result stays valid; None for no expiry
+            max_entries (int): The number of results to keep for the
+                matching methods before the least recently used is dropped
+            max_bytes (int): The maximum total encoded size of the results
+                to keep; None for no limit
+            invalidated_by (list of str): Notification names or globs which
+                clear the cached results e.g. ['AudioLibrary.On*']
+        """
+        self._rules.append(_CacheRule(pattern, ttl, max_entries, max_bytes,
+                                      invalidated_by))
+        self._method_rules.clear()
+
+    def lookup(self, method, params):
+        """Find a cached result
+
+        Returns:
+            tuple: (True, result) if a valid result is cached otherwise
+            (False, None)
+        """
+        rule = self._rule(method)
+        if rule is None:
+            return False, None
+
+        key = _key(method, params)
+        entry = rule.entries.get(key, None)
+        if entry is not None:
+            expires, _size, value = entry
+            if expires is None or expires > time.monotonic():
+                rule.entries.move_to_end(key)
+                self.hits += 1
+                return True, value
+
+            rule.remove(key)
+
+        self.misses += 1
+        return False, None
+
+    def store(self, method, params, value):
+        """Cache the result of a method if it matches a pattern"""
+        rule = self._rule(method)
+        if rule is not None:
+            rule.store(_key(method, params), value)
+
+    def invalidate(self, pattern='*', params=None):
+        """Remove cached results
+
+        Args:
+            pattern (str): A method name or glob; all methods by default
+            params (list or dict): Only remove the result for these
+                parameters; all parameters by default
+        """
+        for rule in self._rules:
+            for key in list(rule.entries):
+                method = key[0]
+                if not fnmatchcase(method, pattern):
+                    continue
+                if params is not None and key != _key(method, params):
+                    continue
+                rule.remove(key)
+
+    def notification(self, method):
+        """Clear the results invalidated by a notification from the host"""
+        for rule in self._rules:
+            for pattern in rule.invalidated_by:
+                if fnmatchcase(method, pattern):
+                    rule.clear()
+                    break
+
+    def stats(self):
+        """Return the hit and miss counts and the size of the cache"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': sum(len(rule.entries) for rule in self._rules),
+            'bytes': sum(rule.size for rule in self._rules),
+        }
+
+    def _rule(self, method):
+        try:
+            return self._method_rules[method]
+        except KeyError:
+            pass
+
+        for rule in self._rules:
+            if fnmatchcase(method, rule.pattern):
+                break
+        else:
+            rule = None
+
+        self._method_rules[method] = rule
+        return rule
+
+
+class _CacheRule(object):
+    __slots__ = ('pattern', 'ttl', 'max_entries', 'max_bytes',
+                 'invalidated_by', 'entries', 'size')
+
+    def __init__(self, pattern, ttl, max_entries, max_bytes, invalidated_by):
+        self.pattern = pattern
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.invalidated_by = list(invalidated_by)
+
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def store(self, key, value):
+        size = 0
+        if self.max_bytes is not None:
+            size = _size(value)
+            if size > self.max_bytes:
+                return
+
+        expires = None
+        if self.ttl is not None:
+            expires = time.monotonic() + self.ttl
+
+        self.remove(key)
+        self.entries[key] = (expires, size, value)
+        self.size += size
+
+        while len(self.entries) > self.max_entries or \
+              (self.max_bytes is not None and self.size > self.max_bytes):
+            _old, (_expires, size, _value) = self.entries.popitem(last=False)
+            self.size -= size
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+
+def _key(method, params):
+    return method, json.dumps(params, sort_keys=True, separators=(',', ':'))
+
+
+def _size(value):
+    if isinstance(value, RPCResponse):
+        value = value.result
+    return len(json.dumps(value, separators=(',', ':')))
@@ -13,11 +13,25 @@
 # limitations under the License.
 
 import asyncio
+import base64
+import collections
+import itertools
+import os
+import struct
 import aiohttp
+from fnmatch import fnmatchcase
 from functools import partial
 
-from jsonrpc import buffer
-from jsonrpc.message import RPCRequest, RPCResponse, RPCMessageError
+from jsonrpc import RPCError, buffer
+from jsonrpc.codec import get_codec
+from jsonrpc.compression import (available_encodings, compress, decompress,
+                                 decompressor)
+from jsonrpc.hosts import Host, HostSet, BALANCE_POLICIES
+from jsonrpc.introspect import RPCSchema, version_string
+from jsonrpc.message import (RPCRequest, RPCPreparedRequest, RPCResponse,
+                             RPCBatch, RPCMessageError, RPCRequestError)
+from jsonrpc.retry import CONNECTION_ERRORS
+from jsonrpc.stream import ResultStream
 
 __all__ = ['RPCClient']
 
@@ -26,16 +40,131 @@ class RPCClient():
     """An asyncio JSON RPC client.
 
     Args:
-        host (str): Host name to send requests to
+        host (str): Host name to send requests to or the path of the
+                    socket for 'unix'. A list of host names, ``(host, port)``
+                    tuples or socket paths spreads the calls over several
+                    hosts serving the same API.
         port (int): Port number on the host to communicate with.
         timeout (float): Timeout in seconds for connection to the host
         method (str): The method to use to send the requests either
-                      'http' (default) or 'tcp'
-        path (str): The path to send the request to; (http only)
+                      'http' (default), 'tcp', 'unix' for a Unix domain
+                      socket or 'ws' for a WebSocket at ``path`` on the
+                      host. 'unix' and 'ws' keep connections open like
+                      'tcp' and the options marked tcp only apply to them
+                      as well, except for framing and write_buffer_limit
+                      which do not apply to 'ws'.
+        path (str): The path to send the request to; (http and ws only)
         username (str): User name to authenticate with; (http only)
         password (str): Password to authenticate with; (http only)
-        notification_handler (coroutine): A coroutine which receives RPCResponse
-            notifications (tcp only)
+        notification_handler (coroutine): A coroutine which receives every
+            :class:`RPCRequest` notification sent by the host; see
+            :meth:`subscribe` to receive the notifications for particular
+            methods (tcp only)
+        notification_queue_size (int): The number of notifications held
+            waiting for the handlers to process them (tcp only)
+        notification_overflow (str): What to do with a notification when
+            the queue is full; 'drop-oldest' (default) discards the oldest
+            queued notification, 'drop-newest' discards the notification
+            received and 'block' stops reading from the connection until
+            the handlers have caught up, which also delays responses
+            (tcp only)
+        batch_window (float): When set, calls made through a namespace
+            (e.g. ``client.Player.GetItem()``) within this many seconds of
+            each other are sent as a single batch. 0 batches the calls made
+            in the same event loop iteration. None (default) disables
+            automatic batching.
+        batch_size (int): The maximum number of calls to send in an
+            automatic batch; a full batch is sent without waiting for the
+            window to close.
+        pool_size (int): The maximum number of HTTP connections to keep
+            open to the host; (http only)
+        keepalive_timeout (float): Seconds an idle HTTP connection is kept
+            open for reuse; (http only)
+        dns_cache_ttl (float): Seconds to cache the host's address for; 0
+            disables caching and None caches forever; (http only)
+        codec (str): The JSON codec used to encode and decode messages;
+            'json' (default), 'orjson', 'ujson', 'rapidjson' or 'auto' for
+            the fastest one installed. A codec instance may also be passed.
+        id_generator (iterator): Yields the ids for requests made through a
+            namespace. Defaults to a counter starting at 1; pass
+            :func:`~jsonrpc.message.uuid_ids` for UUIDs.
+        cache (:class:`~jsonrpc.cache.RPCCache`): A cache for the results of
+            idempotent methods. Notifications received over tcp invalidate
+            the results configured to be cleared by them.
+        tcp_connections (int): The number of connections to open to the
+            host. Each request is sent on the connection with the fewest
+            requests awaiting a response; (tcp only)
+        max_in_flight (int): The maximum number of requests awaiting a
+            response on each connection; further requests wait for a slot.
+            None (default) for no limit; (tcp only)
+        max_undelivered (int): Reading from a connection is paused while
+            this many responses have been received but not yet picked up
+            by their callers; (tcp only)
+        write_buffer_limit (int): The number of bytes buffered by a
+            connection's transport at which requests wait for the buffer to
+            drain before writing. None uses the transport default; (tcp only)
+        framing (str): How messages are delimited on a connection; 'json'
+            (default) finds the end of each message by counting brackets,
+            'line' for newline delimited messages or 'length' for messages
+            preceded by a 4 byte length. The host must use the same
+            framing; (tcp only)
+        compression (str): The content encoding used to compress request
+            bodies of at least ``compression_threshold`` bytes; 'gzip',
+            'deflate', 'br', 'zstd' or 'auto' for the encoding with the
+            smallest output installed. The host is also told which
+            encodings can be used for responses. None (default) sends
+            requests uncompressed; (http only)
+        compression_threshold (int): The size in bytes from which request
+            bodies are compressed; (http only)
+        lazy_results (bool): Route each response using only its id and
+            decode the result when :attr:`RPCResponse.result` is first
+            read; :attr:`RPCResponse.raw_result` gives the bytes received
+            without decoding them. Responses which cannot be read this
+            way, such as those with an object after the result, are
+            decoded in full as are batches; (tcp only)
+        ws_heartbeat (float): Seconds between the pings sent on an idle
+            WebSocket. A connection which does not answer is closed and
+            reopened. None disables the pings; (ws only)
+        metrics (:class:`~jsonrpc.metrics.RPCMetrics`): Records the calls
+            made to each method, their latencies and the bytes sent and
+            received.
+        request_timeout (float): Seconds a call may take, including any
+            retries, before it is cancelled and :class:`asyncio.TimeoutError`
+            is raised. The request is forgotten so a late response is
+            ignored. None (default) waits indefinitely; :meth:`request`
+            and :meth:`batch` accept a ``timeout`` for a single call.
+        retry (:class:`~jsonrpc.retry.RetryPolicy`): Retries the calls to
+            the methods it matches which fail with a connection error or
+            time out.
+        hedge (:class:`~jsonrpc.retry.HedgePolicy`): Sends a second copy
+            of a slow call to the methods it matches, on another
+            host, or on another connection when there is no other host,
+            and returns the first response.
+        balance (str): How the host for each call is chosen when there
+            are several; 'round-robin' (default) or 'latency' for the host
+            with the lowest moving average latency weighted by its calls
+            in flight.
+        health_interval (float): Seconds between the ``health_method``
+            calls made to check each host. A host which fails to answer
+            within ``health_timeout``, or whose answer cannot be read, is
+            not sent calls until it answers again. None (default) disables
+            the checks.
+        health_method (str): The method called to check a host.
+        health_timeout (float): Seconds to wait for a host to answer a
+            check.
+        breaker_threshold (int): The consecutive connection failures, or
+            HTTP 5xx replies which are not JSON-RPC responses, after which a
+            host is not sent calls for ``breaker_timeout`` seconds.
+            A single call is then let through and the host is used again
+            if it is answered. None (default) never ejects a host.
+        breaker_timeout (float): Seconds an ejected host is skipped for.
+        schema (:class:`~jsonrpc.introspect.RPCSchema`): The host's API.
+            Calls through namespaces to methods it does not list, or with
+            parameters which do not match, raise :class:`RPCRequestError`
+            without being sent. See :meth:`introspect`.
+
+    When no host is available calls raise
+    :class:`~jsonrpc.hosts.RPCUnavailableError`.
     """
     def __init__(self, host,
                  port=8080,
@@ -43,9 +172,21 @@ class RPCClient():
                  method='http',
                  path='/jsonrpc',
                  username='', password='',
-                 notification_handler=None):
+                 notification_handler=None,
+                 batch_window=None, batch_size=100,
+                 pool_size=10, keepalive_timeout=15, dns_cache_ttl=10,
+                 codec='json', id_generator=None, cache=None,
+                 tcp_connections=1, max_in_flight=None, max_undelivered=1000,
+                 write_buffer_limit=None, framing='json', metrics=None,
+                 notification_queue_size=1000,
+                 notification_overflow='drop-oldest', ws_heartbeat=30,
+                 compression=None, compression_threshold=1024,
+                 lazy_results=False, request_timeout=None, retry=None,
+                 hedge=None, balance='round-robin', health_interval=None,
+                 health_method='JSONRPC.Ping', health_timeout=5,
+                 breaker_threshold=None, breaker_timeout=30, schema=None):
 
-        if method not in ['tcp', 'http']:
+        if method not in ['tcp', 'http', 'unix', 'ws']:
             raise RPCMessageError('Unrecognised method %s specified', method)
 
         self.host = host
@@ -56,114 +197,859 @@ class RPCClient():
         self.username = username
         self.password = password
         self.notification_handler = notification_handler
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.codec = get_codec(codec)
+        self.id_generator = id_generator or itertools.count(1)
+        self.cache = cache
+        self.tcp_connections = tcp_connections
+        self.max_in_flight = max_in_flight
+        self.max_undelivered = max_undelivered
+        self.write_buffer_limit = write_buffer_limit
+        self.framing = framing
+        buffer.get_framing(framing)
+        self.metrics = metrics
+        self.ws_heartbeat = ws_heartbeat
+
+        if compression == 'auto':
+            compression = available_encodings()[0]
+        if compression is not None:
+            # Raises RPCError for an unknown encoding
+            compress(b'', compression)
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+        self.lazy_results = lazy_results
+        self.request_timeout = request_timeout
+        self.retry = retry
+        self.hedge = hedge
+        self.health_interval = health_interval
+        self.health_method = health_method
+        self.health_timeout = health_timeout
+        self.schema = schema
+
+        self.breaker_threshold = breaker_threshold
+        self.breaker_timeout = breaker_timeout
+
+        if balance not in BALANCE_POLICIES:
+            raise RPCError('Unrecognised balance policy %s specified' % balance)
+        self.balance = balance
+        self._hosts = None
+        self._health_task = None
+
+        if notification_overflow not in _OVERFLOW_POLICIES:
+            raise RPCError('Unrecognised notification overflow policy %s specified' % \
+                           notification_overflow)
+        self._notifications = _Notifications(notification_queue_size,
+                                             notification_overflow)
+        if notification_handler is not None:
+            self.subscribe('*', notification_handler)
+
+        self._headers = {'Content-Type': 'application/json'}
+        if username != '':
+            credentials = '%s:%s' % (username, password)
+            self._headers['Authorization'] = 'Basic %s' % \
+                base64.b64encode(credentials.encode('latin1')).decode('ascii')
 
-        self._tcp_protocol = None
+        self._http_session = None
         self._namespace_cache = {}
+        self._batch_queue = []
+        self._batch_handle = None
+        self._batch_tasks = set()
 
         self.loop = asyncio.get_event_loop()
 
-    @asyncio.coroutine
-    def request(self, request, method=None, *args, **kwargs):
+    async def request(self, request, method=None, *args, timeout=None,
+                      **kwargs):
         """Send an RPC request.
 
         Args:
             request (:class:`RPCRequest`): The request to send.
+            timeout (float): Seconds to wait for the response, including
+                any retries; defaults to ``request_timeout``
 
         Returns:
             None: No response received.
             :class:`RPCResponse`: The response from the host
         """
+        cache = self.cache
+        if cache is not None and not request.notification:
+            hit, response = cache.lookup(request.method, request.params)
+            if hit:
+                return response
+
+        response = await self._request(request, method, *args,
+                                       timeout=timeout, **kwargs)
+
+        if cache is not None and not request.notification:
+            cache.store(request.method, request.params, response)
+
+        return response
+
+    async def _request(self, request, method=None, *args, timeout=None,
+                       **kwargs):
+        if timeout is None:
+            timeout = self.request_timeout
+
+        coro = self._send_with_retries(request, method, timeout,
+                                       *args, **kwargs)
+        if timeout is not None:
+            # Cancelling the send forgets the request's pending state
+            coro = asyncio.wait_for(coro, timeout)
+
+        if self.metrics is not None:
+            with self.metrics.call(request.method):
+                return await coro
+
+        return await coro
+
+    async def _send_with_retries(self, request, method, timeout,
+                                 *args, **kwargs):
+        """Send a request, retrying it as the retry policy allows while
+        there is time before the call's deadline"""
+        retry = self.retry
+        if retry is None or request.notification or \
+           not retry.applies(request.method):
+            return await self._send_hedged(request, method, *args, **kwargs)
+
+        deadline = None
+        if timeout is not None:
+            deadline = self.loop.time() + timeout
+
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                coro = self._send_hedged(request, method, *args, **kwargs)
+                if retry.attempt_timeout is None:
+                    return await coro
+                return await asyncio.wait_for(coro, retry.attempt_timeout)
+            except Exception as exc:
+                delay = retry.delay(attempt, exc)
+                if delay is None or (deadline is not None and
+                                     self.loop.time() + delay >= deadline):
+                    raise
+
+            retry.retries += 1
+            await asyncio.sleep(delay)
+
+    async def _send_hedged(self, request, method=None, *args, **kwargs):
+        """Send a request and, if it has not been answered within the hedge
+        policy's delay, send it again and return the first response"""
+        hedge = self.hedge
+        if hedge is None or request.notification or \
+           not hedge.applies(request.method):
+            return await self._send_request(request, method, *args, **kwargs)
+
         method = method or self.method
-        if method == 'http':
-            response = yield from self._send_http_request(request, *args, **kwargs)
-        elif method == 'tcp':
-            response = yield from self._send_tcp_request(request, *args, **kwargs)
+        host = self._choose_host()
+        protocol = None
+        if method in _CONNECTION_METHODS:
+            try:
+                protocol = await self._pool(host).get()
+            except CONNECTION_ERRORS:
+                host.failed()
+                raise
+        first = self._send_request(request, method, *args, host=host,
+                                   protocol=protocol, **kwargs)
+
+        start = self.loop.time()
+        tasks = [self.loop.create_task(first)]
+        pending = set(tasks)
+        delay = hedge.delay(request.method)
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    delay = None
+                    second = self._hedge_request(request, method, host,
+                                                 protocol, *args, **kwargs)
+                    if second is None:
+                        continue
+
+                    hedge.hedged += 1
+                    tasks.append(self.loop.create_task(second))
+                    pending.add(tasks[-1])
+                    continue
+
+                for task in done:
+                    if task.exception() is None:
+                        hedge.record(request.method, self.loop.time() - start,
+                                     task is not tasks[0])
+                        return task.result()
+                    if error is None:
+                        error = task.exception()
+
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+
+    def _hedge_request(self, request, method, host, protocol, *args, **kwargs):
+        """Return a coroutine which sends a copy of a request to another
+        host, or to another connection to the same host, or None if there
+        is nowhere else to send it"""
+        other = self._host_set().alternative(host)
+        if other is not None:
+            return self._send_request(request, method, *args, host=other,
+                                      **kwargs)
+
+        if protocol is not None:
+            protocol = host.pool.other(protocol)
+            if protocol is None:
+                return None
+
+        return self._send_request(request, method, *args, host=host,
+                                  protocol=protocol, **kwargs)
+
+    async def _send_request(self, request, method=None, *args, host=None,
+                            protocol=None, **kwargs):
+        method = method or self.method
+        if host is None:
+            host = self._choose_host()
+
+        with host.call():
+            if method == 'http':
+                response = await self._send_http_request(request, *args,
+                                                         host=host, **kwargs)
+            elif method in _CONNECTION_METHODS:
+                response = await self._send_tcp_request(request, *args,
+                                                        host=host,
+                                                        protocol=protocol,
+                                                        **kwargs)
 
         return response
 
-    def close(self):
-        if self._tcp_protocol:
-            self._tcp_protocol._transport.close()
+    def _host_set(self):
+        """Return the hosts, created on first use from host and port"""
+        if self._hosts is None:
+            hosts = self.host if isinstance(self.host, list) else [self.host]
+            hosts = [h if isinstance(h, tuple) else (h, self.port)
+                     for h in hosts]
+            self._hosts = HostSet([Host(h, p, self.path,
+                                        self.breaker_threshold,
+                                        self.breaker_timeout)
+                                   for h, p in hosts], self.balance)
+        return self._hosts
 
-    @asyncio.coroutine
-    def _send_http_request(self, request, *args, **kwargs):
-        """Send a request using HTTP
+    def _choose_host(self):
+        if self.health_interval is not None and self._health_task is None:
+            self._health_task = self.loop.create_task(self._check_health())
+
+        return self._host_set().choose()
+
+    async def _check_health(self):
+        """Call health_method on every host each health_interval"""
+        while True:
+            await asyncio.gather(*[self._probe(host)
+                                   for host in self._host_set().hosts])
+            await asyncio.sleep(self.health_interval)
+
+    async def _probe(self, host):
+        request = RPCRequest(self.health_method, next(self.id_generator))
+        try:
+            await asyncio.wait_for(self._send_request(request, host=host),
+                                   self.health_timeout)
+        except RPCRequestError:
+            # The host answered
+            pass
+        except asyncio.TimeoutError:
+            # The call was cancelled so it has not been recorded
+            host.failed()
+            host.healthy = False
+            return
+        except Exception:
+            # A connection error has been recorded by the call. Anything
+            # else, such as a reply which is not JSON, also means the host
+            # cannot be used and must not stop the other hosts being probed.
+            host.healthy = False
+            return
+
+        host.healthy = True
+
+    def host_stats(self):
+        """Return the state, latency and call counts of each host"""
+        return [host.stats() for host in self._host_set().hosts]
+
+    async def close(self):
+        """Close the connections to the host"""
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+
+        for host in self._host_set().hosts:
+            if host.pool is not None:
+                host.pool.close()
+                host.pool = None
+
+        if self._http_session:
+            await self._http_session.close()
+            self._http_session = None
+
+        await self._notifications.close()
+
+    async def introspect(self, cache_dir=None):
+        """Fetch the host's API with ``JSONRPC.Introspect`` and check the
+        calls made through namespaces against it from now on.
+
+        With a cache directory the description is saved there under the
+        version the host reports for ``JSONRPC.Version``, and is loaded
+        from the file instead of being fetched while the version is
+        unchanged.
+
+        Args:
+            cache_dir (str): The directory to cache descriptions in
+
+        Returns:
+            :class:`~jsonrpc.introspect.RPCSchema`: The host's API, also
+            set as :attr:`schema`
+        """
+        schema = None
+        path = None
+        if cache_dir is not None:
+            version = await self._call('JSONRPC.Version')
+            path = RPCSchema.cache_path(cache_dir, version_string(version))
+            if os.path.exists(path):
+                schema = RPCSchema.load(path)
+
+        if schema is None:
+            schema = RPCSchema(await self._call('JSONRPC.Introspect'))
+            if path is not None:
+                schema.save(path)
+
+        self.schema = schema
+        self._namespace_cache.clear()
+        return schema
+
+    async def _call(self, method):
+        """Call a method without parameters and return its result"""
+        response = await self.request(RPCRequest(method,
+                                                 next(self.id_generator)))
+        if isinstance(response, RPCResponse):
+            return response.result
+        return response
+
+    def prepare(self, method, params=(), constants=None):
+        """Prepare a frequently called method.
+
+        The version, method name and constant parameters are encoded once
+        so each call encodes only its id and the parameters passed::
+
+            get_time = client.prepare('Player.GetProperties', ['playerid'],
+                                      {'properties': ['time', 'totaltime']})
+            result = await get_time(1)
+
+        When :attr:`schema` is set the parameters of each call are checked
+        against it before the request is sent.
+
+        Args:
+            method (str): The method to call
+            params (list of str): The names of the parameters passed with
+                each call, by position in this order or by name
+            constants (dict): Named parameters sent with every call
+
+        Returns:
+            coroutine function: Calls the method and returns what a call
+            through a namespace, e.g. ``client.Player.GetProperties()``,
+            would return.
+
+        Raises:
+            RPCRequestError: The method is not in :attr:`schema`
+        """
+        check = None
+        if self.schema is not None:
+            check = self.schema.checker(method)
+
+        template = RPCPreparedRequest(method, params, constants,
+                                      codec=self.codec)
+        return _PreparedMethod(self, template, check)
+
+    def subscribe(self, method, handler=None):
+        """Call a handler with each notification for a method sent by the
+        host. May be used as a decorator::
+
+            @client.subscribe('Player.OnPlay')
+            async def on_play(notification):
+                ...
+
+        Handlers are called one at a time, in the order the notifications
+        were received, by a task separate from the one delivering
+        responses, so a slow handler delays only later notifications.
+
+        Args:
+            method (str): The notification's method or a glob such as
+                'Player.*'
+            handler (coroutine): A coroutine function or function which is
+                passed the :class:`RPCRequest` notification
+        """
+        if handler is None:
+            return partial(self.subscribe, method)
+
+        self._notifications.subscriptions.append((method, handler))
+        return handler
+
+    def unsubscribe(self, method, handler):
+        """Remove a handler added with :meth:`subscribe`"""
+        self._notifications.subscriptions.remove((method, handler))
+
+    def notification_stats(self):
+        """Return the number of notifications queued and dropped"""
+        return {
+            'queued': len(self._notifications.queue),
+            'dropped': self._notifications.dropped,
+        }
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def batch(self, requests, method=None, *args, timeout=None,
+                    **kwargs):
+        """Send several requests as a single JSON RPC 2.0 batch.
+
+        Args:
+            requests (list of :class:`RPCRequest`): The requests to send;
+                notifications may be included.
+            timeout (float): Seconds to wait for the responses; defaults to
+                ``request_timeout``
+
+        Returns:
+            list: One entry per request in the same order. Each entry is the
+            :class:`RPCResponse` for the request, the :class:`RPCRequestError`
+            returned by the host or None for a notification.
+        """
+        batch = RPCBatch(requests)
+
+        metrics = self.metrics
+        if metrics is not None:
+            starts = [metrics.started(request.method) for request in batch]
+
+        coro = self._send_batch(batch, method or self.method, *args, **kwargs)
+        if timeout is None:
+            timeout = self.request_timeout
+        if timeout is not None:
+            coro = asyncio.wait_for(coro, timeout)
+
+        try:
+            responses = await coro
+        except BaseException as exc:
+            if metrics is not None:
+                for request, start in zip(batch, starts):
+                    metrics.finished(request.method, start, exc)
+            raise
+
+        if metrics is not None:
+            for request, start, response in zip(batch, starts, responses):
+                error = response if isinstance(response, Exception) else None
+                metrics.finished(request.method, start, error)
+
+        return responses
+
+    async def _send_batch(self, batch, method, *args, **kwargs):
+        host = self._choose_host()
+        with host.call():
+            if method == 'http':
+                responses = await self._send_http_batch(batch, *args,
+                                                        host=host, **kwargs)
+            elif method in _CONNECTION_METHODS:
+                responses = await self._send_tcp_batch(batch, *args,
+                                                       host=host, **kwargs)
+
+        return responses
+
+    def stream(self, request, path='', method=None, window=100):
+        """Send a request and iterate over the elements of an array in the
+        result while the response is still being received.
+
+        The elements are decoded one at a time so a huge result such as a
+        whole library listing never needs to be held in memory at once::
+
+            request = RPCRequest('AudioLibrary.GetArtists')
+            async with client.stream(request, 'artists') as artists:
+                async for artist in artists:
+                    ...
+
+        Over tcp, unix and ws the request is sent on a connection of its
+        own which is closed once the array has been received. A WebSocket
+        delivers each message whole, so over ws only the decoding is
+        incremental.
 
         Args:
             request (:class:`RPCRequest`): The request to send.
+            path (str): The dotted path to the array within the result e.g.
+                'artists' for ``result.artists``; by default the result
+                itself.
+            method (str): The transport to stream the response over; by
+                default the client's method.
+            window (int): The maximum number of decoded elements held
+                waiting to be consumed; reading from the host pauses while
+                the window is full.
 
         Returns:
-            None: No response received.
-            :class:`RPCResponse`: The response from the host.
+            :class:`~jsonrpc.stream.ResultStream`: An async iterator over the
+            elements of the array
         """
-        request_data = request.marshal()
+        method = method or self.method
+        if method == 'http':
+            source = self._stream_http
+        elif method == 'ws':
+            source = self._stream_ws
+        elif method in _CONNECTION_METHODS:
+            source = partial(self._stream_tcp, method=method)
+        else:
+            raise RPCMessageError('Unrecognised method %s specified' % method)
 
-        path = kwargs.get('path', self.path)
+        data = request.marshal(self.codec)
+        return ResultStream(partial(self._stream_from_host, source, data),
+                            path, self.codec, window)
 
-        url = 'http://{}:{}{}'.format(self.host, self.port, path)
+    async def _stream_from_host(self, source, data, feed):
+        # The host is chosen once the stream is read from so that a stream
+        # which is never read does not hold a half-open host's trial call
+        host = self._choose_host()
+        with host.call():
+            await source(host, data, feed)
 
-        auth = None
-        if self.username != '':
+    async def _stream_http(self, host, data, feed):
+        session = self._session()
 
-            if self.password == '':
-                auth = aiohttp.BasicAuth(self.username)
+        headers = None
+        if self.compression is not None and \
+           len(data) >= self.compression_threshold:
+            data = compress(data, self.compression)
+            headers = {'Content-Encoding': self.compression}
+
+        async with session.post(host.url, data=data,
+                                headers=headers) as http_response:
+            encoding = 'identity'
+            if self.compression is not None:
+                encoding = http_response.headers.get('Content-Encoding',
+                                                     'identity')
+
+            if http_response.status >= 500:
+                body = await http_response.read()
+                if encoding != 'identity':
+                    body = decompress(body, encoding)
+                if not _is_reply(body, self.codec):
+                    # The host is failing rather than answering the request
+                    http_response.raise_for_status()
+                await feed(body)
+                return
+            elif http_response.status != 200:
+                raise RPCMessageError('HTTP status %d received' % \
+                                      http_response.status)
+
+            if encoding != 'identity':
+                d = decompressor(encoding)
+
+            async for chunk in http_response.content.iter_any():
+                if encoding != 'identity':
+                    chunk = d.decompress(chunk)
+                if await feed(chunk):
+                    return
+
+    async def _stream_ws(self, host, data, feed):
+        async with self._session().ws_connect(host.ws_url,
+                                              max_msg_size=0) as ws:
+            await ws.send_str(data.decode('UTF-8'))
+            async for msg in ws:
+                if msg.type == aiohttp.WSMsgType.TEXT:
+                    chunk = msg.data.encode('UTF-8')
+                elif msg.type == aiohttp.WSMsgType.BINARY:
+                    chunk = msg.data
+                else:
+                    continue
+
+                if await feed(chunk):
+                    return
+
+    async def _stream_tcp(self, host, data, feed, method='tcp'):
+        if method == 'unix':
+            reader, writer = await asyncio.open_unix_connection(host.host)
+        else:
+            reader, writer = await asyncio.open_connection(host.host, host.port)
+        try:
+            writer.write(buffer.get_framing(self.framing).frame(data))
+
+            if self.framing == 'length':
+                # Strip the length from each message, the parser finds the
+                # end of each one itself
+                while True:
+                    header = await reader.readexactly(4)
+                    (remaining,) = struct.unpack('>I', header)
+                    while remaining:
+                        chunk = await reader.read(min(remaining, 65536))
+                        if not chunk:
+                            return
+                        remaining -= len(chunk)
+                        if await feed(chunk):
+                            return
             else:
-                auth = aiohttp.BasicAuth(self.username, self.password)
+                while True:
+                    chunk = await reader.read(65536)
+                    if not chunk:
+                        return
+                    if await feed(chunk):
+                        return
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            writer.close()
+
+    async def _post(self, data, *args, host=None, **kwargs):
+        """POST data to the host
+
+        Returns:
+            tuple: The HTTP status and the body of the response
+
+        Raises:
+            aiohttp.ClientResponseError: The host answered with a 5xx status
+                and a body which is not a JSON-RPC response, which counts as
+                a failure of the host
+        """
+        if host is None:
+            host = self._choose_host()
+
+        if 'path' in kwargs:
+            url = 'http://{}:{}{}'.format(host.host, host.port, kwargs['path'])
+        else:
+            url = host.url
+
+        session = self._session()
+
+        headers = None
+        if self.compression is not None and \
+           len(data) >= self.compression_threshold:
+            data = compress(data, self.compression)
+            headers = {'Content-Encoding': self.compression}
+
+        async with session.post(url, data=data, headers=headers) as http_response:
+            body = await http_response.read()
+
+        if self.metrics is not None:
+            self.metrics.sent(len(data))
+            self.metrics.received(len(body))
 
-        headers = {'Content-Type': 'application/json'}
+        if self.compression is not None:
+            encoding = http_response.headers.get('Content-Encoding', 'identity')
+            if encoding != 'identity':
+                body = decompress(body, encoding)
 
-        http_request = aiohttp.request('POST', url,
-                                       data=request_data,
-                                       headers=headers,
-                                       auth=auth,
-                                       loop=self.loop)
+        if http_response.status >= 500 and not _is_reply(body, self.codec):
+            # The host is failing rather than answering the request
+            http_response.raise_for_status()
+
+        return http_response.status, body
+
+    def _session(self):
+        session = self._http_session
+        if session is None or session.closed:
+            session = self._create_session()
+        return session
+
+    def _create_session(self):
+        """Create the session which HTTP requests share so that connections
+        are kept alive and reused."""
+        connector = aiohttp.TCPConnector(limit=self.pool_size,
+                                         limit_per_host=self.pool_size,
+                                         keepalive_timeout=self.keepalive_timeout,
+                                         use_dns_cache=self.dns_cache_ttl != 0,
+                                         ttl_dns_cache=self.dns_cache_ttl)
+
+        timeout = aiohttp.ClientTimeout(total=None)
+        if self.timeout != -1:
+            timeout = aiohttp.ClientTimeout(total=self.timeout)
+
+        # With compression enabled the responses are decompressed here
+        # rather than by aiohttp so that every encoding offered can be read
+        headers = dict(self._headers)
+        if self.compression is not None:
+            headers['Accept-Encoding'] = ', '.join(available_encodings())
+
+        self._http_session = aiohttp.ClientSession(
+            connector=connector, headers=headers, timeout=timeout,
+            auto_decompress=self.compression is None)
+        return self._http_session
+
+    async def _send_http_request(self, request, *args, **kwargs):
+        """Send a request using HTTP
+
+        Args:
+            request (:class:`RPCRequest`): The request to send.
+
+        Returns:
+            None: No response received.
+            :class:`RPCResponse`: The response from the host.
+        """
+        status, body = await self._post(request.marshal(self.codec), *args, **kwargs)
 
         if request.notification:
             return None
+
+        # A 5xx status which gets this far carries a JSON-RPC error
+        if status == 200 or status >= 500:
+            response = RPCResponse()
+            response.unmarshal(body, self.codec)
+            result = response.result
         else:
-            if self.timeout == -1:
-                http_response = yield from http_request
-            else:
-                http_response = yield from asyncio.wait_for(http_request,
-                                                            self.timeout)
+            result = None
 
-            if http_response.status == 200:
-                body = yield from http_response.read()
+        return result
 
-                response = RPCResponse()
-                response.unmarshal(body)
-                result = response.result
-            else:
-                result = None
+    async def _send_http_batch(self, batch, *args, **kwargs):
+        """Send a batch of requests using HTTP
+
+        Args:
+            batch (:class:`RPCBatch`): The requests to send.
+        """
+        status, body = await self._post(batch.marshal(self.codec), *args, **kwargs)
+
+        responses = RPCBatch()
+        if (status == 200 or status >= 500) and body.strip():
+            responses.unmarshal(body, self.codec)
 
-            return result
+        return _batch_results(batch, responses)
 
-    @asyncio.coroutine
-    def _send_tcp_request(self, request, *args, **kwargs):
+    async def _send_tcp_request(self, request, *args, host=None,
+                                protocol=None, **kwargs):
         """Send a request using TCP
 
         Args:
             request (:class:`RPCRequest`): The request to send.
+            protocol (:class:`_TCPProtocol`): The connection to send the
+                request on; by default the least busy connection to the host
+        """
+        if protocol is None:
+            protocol = await self._pool(host).get()
+        response = await protocol.send(request)
+        return response
+
+    async def _send_tcp_batch(self, batch, *args, host=None, **kwargs):
+        """Send a batch of requests using TCP
+
+        Args:
+            batch (:class:`RPCBatch`): The requests to send.
+        """
+        protocol = await self._pool(host).get()
+        responses = await protocol.send_batch(batch)
+        return responses
+
+    def _pool(self, host=None):
+        if host is None:
+            host = self._host_set().hosts[0]
+        if host.pool is None:
+            host.pool = _TCPPool(self, host, self.tcp_connections)
+        return host.pool
+
+    def pool_stats(self):
+        """Return statistics for the TCP connection pool
+
+        Returns:
+            None: No TCP requests have been made.
+            dict: The pool size, the number of connected members, the
+            requests awaiting a response, the requests sent and the bytes
+            sent and received on each connection and the number of
+            reconnections made. With several hosts the connections to
+            every host are included.
+        """
+        pools = [host.pool for host in self._host_set().hosts
+                 if host.pool is not None]
+        if not pools:
+            return None
+
+        stats = pools[0].stats()
+        for pool in pools[1:]:
+            for key, value in pool.stats().items():
+                stats[key] += value
+        return stats
+
+    def _queue_request(self, request):
+        """Queue a request to be sent in the next automatic batch.
+
+        Returns:
+            :class:`asyncio.Future`: Resolved with the same value
+            :meth:`request` would return for the request.
         """
-        if not self._tcp_protocol:
-            factory = lambda: _TCPProtocol(self.timeout,
-                                           self.notification_handler)
+        future = self.loop.create_future()
+
+        if self.cache is not None:
+            hit, response = self.cache.lookup(request.method, request.params)
+            if hit:
+                future.set_result(response)
+                return future
 
-            coro = self.loop.create_connection(factory,
-                self.host, self.port)
+        self._batch_queue.append((request, future))
 
-            if self.timeout == -1:
-                (_t, protocol) = yield from coro
+        if len(self._batch_queue) >= self.batch_size:
+            self._flush_batch()
+        elif self._batch_handle is None:
+            self._batch_handle = self.loop.call_later(self.batch_window,
+                                                      self._flush_batch)
+
+        return future
+
+    def _flush_batch(self):
+        if self._batch_handle is not None:
+            self._batch_handle.cancel()
+            self._batch_handle = None
+
+        queued = self._batch_queue
+        self._batch_queue = []
+
+        if queued:
+            task = self.loop.create_task(self._send_queued(queued))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _send_queued(self, queued):
+        requests = [request for request, _future in queued]
+        try:
+            if len(requests) == 1:
+                results = [await self._request(requests[0])]
             else:
-                (_t, protocol) = yield from asyncio.wait_for(coro,
-                                                             self.timeout)
+                results = await self.batch(requests)
+                results = [self._batch_value(result) for result in results]
+        except Exception as exc:
+            results = [exc] * len(queued)
+
+        for (request, future), result in zip(queued, results):
+            if isinstance(result, Exception):
+                if not future.done():
+                    future.set_exception(result)
+                continue
 
-            self._tcp_protocol = protocol
+            if self.cache is not None:
+                self.cache.store(request.method, request.params, result)
+
+            if not future.done():
+                future.set_result(result)
+
+    def _batch_value(self, response):
+        """Convert a batch entry to the value :meth:`request` returns"""
+        if self.method == 'http' and isinstance(response, RPCResponse):
+            return response.result
 
-        response = yield from protocol.send(request)
         return response
 
+    def _notification_received(self, notification, protocol=None):
+        if self.cache is not None:
+            self.cache.notification(notification.method)
+
+        self._notifications.put(notification, protocol)
+
     def __getattr__(self, namespace):
+        if namespace.startswith('_'):
+            raise AttributeError(namespace)
+
         if namespace in self._namespace_cache:
             return self._namespace_cache[namespace]
 
@@ -176,87 +1062,675 @@ class RPCClient():
         def __init__(self, name, protocol):
             self.name = name
             self.protocol = protocol
-            self._id = 1
             self._handler_cache = {}
 
         def __getattr__(self, method):
             if method in self._handler_cache:
                 return self._handler_cache[method]
 
-            @asyncio.coroutine
-            def handler(method, *args, **kwargs):
-                method = '{}.{}'.format(self.name, method)
-                request = RPCRequest(method, *args, **kwargs)
-                response = yield from self.protocol.request(request)
+            async def handler(method, *args, **kwargs):
+                uid = next(self.protocol.id_generator)
+                request = RPCRequest(method, uid, '2.0', False, *args, **kwargs)
+                if self.protocol.batch_window is None:
+                    response = await self.protocol.request(request)
+                else:
+                    response = await self.protocol._queue_request(request)
                 return response
 
-            h = partial(handler, method)
+            name = '{}.{}'.format(self.name, method)
+            h = partial(handler, name)
+            if self.protocol.schema is not None:
+                h = self.protocol.schema.stub(name, h)
+
             self._handler_cache[method] = h
             return h
 
+        def __dir__(self):
+            names = list(object.__dir__(self))
+            if self.protocol.schema is not None:
+                names.extend(self.protocol.schema.namespace_methods(self.name))
+            return names
+
+
+class _PreparedMethod(object):
+    """Call a prepared request with ids from the client's id generator"""
+
+    __slots__ = ('client', 'template', 'check')
+
+    def __init__(self, client, template, check=None):
+        self.client = client
+        self.template = template
+        self.check = check
+
+    def __repr__(self):
+        return 'Prepared method: %s' % self.template.method
+
+    async def __call__(self, *args, **kwargs):
+        client = self.client
+        request = self.template.request(next(client.id_generator),
+                                        *args, **kwargs)
+        if self.check is not None:
+            self.check((), request.params or {})
+
+        if client.batch_window is None:
+            return await client.request(request)
+        return await client._queue_request(request)
+
+
+_OVERFLOW_POLICIES = ('drop-oldest', 'drop-newest', 'block')
+
+# Methods which keep connections open to the host in a _TCPPool
+_CONNECTION_METHODS = ('tcp', 'unix', 'ws')
+
+
+class _Notifications(object):
+    """A bounded queue of notifications drained by a dispatcher task which
+    calls the subscribed handlers"""
+
+    def __init__(self, size, overflow):
+        self.size = size
+        self.overflow = overflow
+        self.queue = collections.deque()
+        self.subscriptions = []
+        self.dropped = 0
+
+        self._blocked = set()
+        self._event = None
+        self._task = None
+
+    def put(self, notification, protocol=None):
+        if not self.subscriptions:
+            return
+
+        if len(self.queue) >= self.size:
+            if self.overflow == 'drop-newest':
+                self.dropped += 1
+                return
+            elif self.overflow == 'drop-oldest':
+                self.queue.popleft()
+                self.dropped += 1
+            elif protocol is not None:
+                # The notification has already been read so it is queued
+                # anyway; reading stops until the queue drains.
+                self._blocked.add(protocol)
+                protocol._pause_reading('notifications')
+
+        self.queue.append(notification)
+
+        if self._task is None:
+            self._event = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+        self._event.set()
+
+    async def close(self):
+        self._unblock()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        queue = self.queue
+        while True:
+            while not queue:
+                self._event.clear()
+                await self._event.wait()
+
+            notification = queue.popleft()
+            if self._blocked and len(queue) <= self.size // 2:
+                self._unblock()
+
+            for pattern, handler in list(self.subscriptions):
+                if not fnmatchcase(notification.method, pattern):
+                    continue
+
+                try:
+                    result = handler(notification)
+                    if asyncio.iscoroutine(result):
+                        await result
+                except Exception as exc:
+                    asyncio.get_event_loop().call_exception_handler({
+                        'message': 'Notification handler for %s failed' % \
+                                   notification.method,
+                        'exception': exc,
+                    })
+
+    def _unblock(self):
+        for protocol in self._blocked:
+            protocol._resume_reading('notifications')
+        self._blocked.clear()
+
+
+class _TCPPool(object):
+    """A pool of TCP connections to a host
+
+    Connections are opened together on first use. A connection which is
+    lost is reopened in the background, with an increasing delay between
+    attempts, while the remaining connections carry the requests.
+    """
+
+    def __init__(self, client, host, size):
+        self.protocols = [None] * size
+        self.reconnects = 0
+
+        self._client = client
+        self._host = host
+        self._lock = asyncio.Lock()
+        self._tasks = {}
+        self._closed = False
+
+    async def get(self):
+        """Return the connected protocol with the fewest requests in flight"""
+        connected = [p for p in self.protocols if p is not None]
+        if not connected:
+            async with self._lock:
+                connected = [p for p in self.protocols if p is not None]
+                if not connected:
+                    await self._connect_all()
+                    connected = [p for p in self.protocols if p is not None]
+
+        if len(connected) == 1:
+            return connected[0]
+
+        return min(connected, key=_in_flight)
+
+    def other(self, protocol):
+        """Return the connected protocol, other than the one given, with the
+        fewest requests in flight or None if there is no other"""
+        connected = [p for p in self.protocols
+                     if p is not None and p is not protocol]
+        if not connected:
+            return None
+
+        return min(connected, key=_in_flight)
+
+    def stats(self):
+        return {
+            'size': len(self.protocols),
+            'connected': len([p for p in self.protocols if p is not None]),
+            'in_flight': [_in_flight(p) if p else 0 for p in self.protocols],
+            'requests': [p.requests if p else 0 for p in self.protocols],
+            'bytes_sent': [p.bytes_sent if p else 0 for p in self.protocols],
+            'bytes_received': [p.bytes_received if p else 0
+                               for p in self.protocols],
+            'reconnects': self.reconnects,
+        }
+
+    def close(self):
+        self._closed = True
+
+        for task in list(self._tasks.values()):
+            task.cancel()
+
+        for protocol in self.protocols:
+            if protocol is not None:
+                protocol._transport.close()
+
+        self.protocols = [None] * len(self.protocols)
+
+    async def _connect_all(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
+
+        slots = range(len(self.protocols))
+        results = await asyncio.gather(*[self._connect(slot) for slot in slots],
+                                       return_exceptions=True)
+
+        errors = [r for r in results if isinstance(r, Exception)]
+        if len(errors) == len(results):
+            raise errors[0]
+
+        for slot, result in zip(slots, results):
+            if isinstance(result, Exception):
+                self._schedule_reconnect(slot)
+
+    async def _connect(self, slot):
+        client = self._client
+        cls = _WSProtocol if client.method == 'ws' else _TCPProtocol
+        factory = lambda: cls(client.timeout,
+                              client.codec,
+                              client._notification_received,
+                              partial(self._connection_lost, slot),
+                              client.max_in_flight,
+                              client.max_undelivered,
+                              client.write_buffer_limit,
+                              client.framing,
+                              client.metrics,
+                              client.lazy_results)
+
+        host = self._host
+        if client.method == 'ws':
+            coro = self._connect_ws(factory)
+        elif client.method == 'unix':
+            coro = client.loop.create_unix_connection(factory, host.host)
+        else:
+            coro = client.loop.create_connection(factory, host.host, host.port)
+
+        if client.timeout == -1:
+            (_t, protocol) = await coro
+        else:
+            (_t, protocol) = await asyncio.wait_for(coro, client.timeout)
+
+        self.protocols[slot] = protocol
+
+    async def _connect_ws(self, factory):
+        client = self._client
+        ws = await client._session().ws_connect(self._host.ws_url,
+                                                heartbeat=client.ws_heartbeat,
+                                                max_msg_size=0)
+        protocol = factory()
+        transport = _WSTransport(ws, protocol)
+        return transport, protocol
+
+    def _connection_lost(self, slot, protocol):
+        if self.protocols[slot] is protocol:
+            self.protocols[slot] = None
+
+        if not self._closed:
+            self._schedule_reconnect(slot)
+
+    def _schedule_reconnect(self, slot):
+        if slot in self._tasks:
+            return
+
+        task = self._client.loop.create_task(self._reconnect(slot))
+        self._tasks[slot] = task
+        task.add_done_callback(lambda _t: self._tasks.pop(slot, None))
+
+    async def _reconnect(self, slot, delay=0.1, max_delay=5.0):
+        while not self._closed:
+            await asyncio.sleep(delay)
+            try:
+                await self._connect(slot)
+            except (OSError, asyncio.TimeoutError, aiohttp.ClientError):
+                delay = min(delay * 2, max_delay)
+            else:
+                self.reconnects += 1
+                return
+
+
+def _in_flight(protocol):
+    return len(protocol._pending)
+
 
 class _TCPProtocol(asyncio.Protocol):
-    """Send JSONRPC messages using the TCP _transport"""
+    """Send JSONRPC messages using the TCP _transport
 
-    def __init__(self, timeout=-1, notification_handler=None):
-        self.responses = None
-        self.notifications = None
+    Each request that expects a response registers a future keyed on its
+    id. Complete messages are parsed as soon as :class:`~jsonrpc.buffer.JSONBuffer`
+    frames them and the matching future is resolved directly, so a waiter is
+    woken only when its own response arrives.
+    """
 
+    def __init__(self, timeout=-1, codec=None, notification_callback=None,
+                 lost_callback=None, max_in_flight=None, max_undelivered=1000,
+                 write_buffer_limit=None, framing='json', metrics=None,
+                 lazy=False):
         self._timeout = timeout
-        self._notification_handler = notification_handler
+        self._codec = get_codec(codec)
+        self._notification_callback = notification_callback
+        self._lost_callback = lost_callback
+        self._framing = buffer.get_framing(framing)
+        self._metrics = metrics
+        self._lazy = lazy
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._transport = None
+        self._pending = {}
+
+        # Flow control
+        self._window = None
+        if max_in_flight is not None:
+            self._window = asyncio.Semaphore(max_in_flight)
+        self._max_undelivered = max_undelivered
+        self._write_buffer_limit = write_buffer_limit
+        self._undelivered = set()
+        self._write_paused = False
+        self._paused_for = set()
+        self._drain_waiters = []
 
-    @asyncio.coroutine
-    def send(self, request):
+    async def send(self, request):
         """Send a request
 
         Args:
             request (:class:`RPCRequest`): The request to send.
         """
-        request_data = request.marshal()
-
-        self._transport.write(request_data)
+        request_data = request.marshal(self._codec)
+        self.requests += 1
 
         if request.notification:
+            await self._write(request_data)
             return None
-        else:
-            response = yield from self._wait_for_response(request.uid)
-            return response
 
-    def connection_made(self, transport):
-        self.responses = {}
-        self.notifications = []
+        future = asyncio.get_event_loop().create_future()
+        futures = {request.uid: future}
 
-        self._buffer = buffer.JSONBuffer()
+        await self._acquire()
+        try:
+            self._pending.update(futures)
+            await self._write(request_data)
+            return await future
+        finally:
+            self._release(futures)
+
+    async def send_batch(self, batch):
+        """Send a batch of requests
+
+        A batch counts as a single request against ``max_in_flight``.
+
+        Args:
+            batch (:class:`RPCBatch`): The requests to send.
+
+        Returns:
+            list: The response, error or None for each request in the batch
+        """
+        request_data = batch.marshal(self._codec)
+        self.requests += 1
+
+        loop = asyncio.get_event_loop()
+        futures = {}
+        for request in batch:
+            if not request.notification:
+                futures[request.uid] = loop.create_future()
+
+        await self._acquire()
+        try:
+            self._pending.update(futures)
+            await self._write(request_data)
+            if futures:
+                await asyncio.wait(futures.values())
+        finally:
+            self._release(futures)
+
+        results = []
+        for request in batch:
+            if request.notification:
+                results.append(None)
+                continue
+
+            future = futures[request.uid]
+            exc = future.exception()
+            if exc is None:
+                results.append(future.result())
+            elif isinstance(exc, RPCRequestError):
+                results.append(exc)
+            else:
+                raise exc
+
+        return results
+
+    async def _acquire(self):
+        """Wait for room in the in flight window"""
+        if self._window is not None:
+            await self._window.acquire()
+
+    def _release(self, futures):
+        """Forget the futures for requests which have completed and resume
+        reading once enough responses have been delivered"""
+        for uid, future in futures.items():
+            self._pending.pop(uid, None)
+            self._undelivered.discard(future)
+
+        if self._window is not None:
+            self._window.release()
+
+        if 'undelivered' in self._paused_for and \
+           len(self._undelivered) <= self._max_undelivered // 2:
+            self._resume_reading('undelivered')
+
+    def _pause_reading(self, reason):
+        """Stop reading from the transport until resumed for every reason
+        it was paused"""
+        if not self._paused_for:
+            self._transport.pause_reading()
+        self._paused_for.add(reason)
+
+    def _resume_reading(self, reason):
+        if reason in self._paused_for:
+            self._paused_for.discard(reason)
+            if not self._paused_for:
+                self._transport.resume_reading()
+
+    async def _write(self, data):
+        """Write data once the transport's buffer has drained"""
+        if self._write_paused:
+            waiter = asyncio.get_event_loop().create_future()
+            self._drain_waiters.append(waiter)
+            await waiter
+
+        self._check_open()
+        data = self._buffer.frame(data)
+        self._transport.write(data)
+
+        self.bytes_sent += len(data)
+        if self._metrics is not None:
+            self._metrics.sent(len(data))
+
+    def _check_open(self):
+        """Raise if the connection was lost while a request waited for room
+        in the window or for the buffer to drain, as a write to a closed
+        transport is dropped and the request would never be answered"""
+        if self._transport is None or self._transport.is_closing():
+            raise ConnectionResetError('Connection closed')
+
+    def pause_writing(self):
+        self._write_paused = True
+
+    def resume_writing(self):
+        self._write_paused = False
+        self._wake_writers()
+
+    def _wake_writers(self, exc=None):
+        for waiter in self._drain_waiters:
+            if not waiter.done():
+                if exc is None:
+                    waiter.set_result(None)
+                else:
+                    waiter.set_exception(exc)
+
+        self._drain_waiters = []
+
+    def connection_made(self, transport):
+        self._buffer = self._framing(result_handler=self._message_received,
+                                     encoding=None)
         self._transport = transport
 
+        if self._write_buffer_limit is not None:
+            transport.set_write_buffer_limits(high=self._write_buffer_limit)
+
+    def connection_lost(self, exc):
+        if exc is None:
+            exc = ConnectionResetError('Connection closed')
+
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(exc)
+
+        self._pending.clear()
+        self._wake_writers(exc)
+
+        if self._lost_callback is not None:
+            self._lost_callback(self)
+
     def data_received(self, data):
+        self.bytes_received += len(data)
+        if self._metrics is not None:
+            self._metrics.received(len(data))
+
         self._buffer.append(data)
 
-    @asyncio.coroutine
-    def _wait_for_data(self, uid):
-        while True:
-            for data in self._buffer.messsages:
-                try:
-                    message = RPCResponse()
-                    message.unmarshal(data)
+    def _message_received(self, data):
+        """Route a complete message to the request waiting for it."""
+        del self._buffer.messsages[:]
 
-                    self.responses[message.uid] = message
+        if data.startswith(b'['):
+            messages = RPCBatch()
+            try:
+                messages.unmarshal(data, self._codec)
+            except RPCMessageError:
+                return
 
-                # If there's an error unmarshaling a Response then we
-                # need to try to unmarshall as a notification Request
-                except RPCMessageError:
-                    message = RPCRequest()
-                    message.unmarshal(message)
-                    self.notifications.append(message)
+            for message in messages:
+                self._dispatch(message)
+            return
 
-            del self._buffer.messages[:]
-            yield from asyncio.sleep(0.1)
+        message = RPCResponse()
+        try:
+            message.unmarshal(data, self._codec, self._lazy)
+        except RPCRequestError:
+            pass
+        # If there's an error unmarshaling a Response then we
+        # need to try to unmarshal as a notification Request
+        except RPCMessageError:
+            message = RPCRequest()
+            try:
+                message.unmarshal(data, self._codec)
+            except RPCMessageError:
+                return
 
-    @asyncio.coroutine
-    def _wait_for_response(self, uid):
-        while True:
-            response = self.responses.pop(uid, None)
-            if response:
-                return response
-            else:
-                yield from asyncio.sleep(0.1)
+        self._dispatch(message)
+
+    def _dispatch(self, message):
+        if isinstance(message, RPCRequest):
+            if self._notification_callback is not None:
+                self._notification_callback(message, self)
+            return
+
+        future = self._pending.get(message.uid)
+        if future is None or future.done():
+            return
+
+        if message.error is not None:
+            future.set_exception(message.exception())
+        else:
+            future.set_result(message)
+
+        # Stop reading while too many responses are waiting to be picked up
+        self._undelivered.add(future)
+        if len(self._undelivered) >= self._max_undelivered and \
+           'undelivered' not in self._paused_for:
+            self._pause_reading('undelivered')
+
+
+class _WSProtocol(_TCPProtocol):
+    """Send JSONRPC messages over a WebSocket
+
+    Each WebSocket message holds a single JSON RPC message or batch so no
+    framing is needed; responses and notifications are routed in the same
+    way as for TCP.
+    """
+
+    async def _write(self, data):
+        self._check_open()
+        await self._transport.send(data)
+
+        self.bytes_sent += len(data)
+        if self._metrics is not None:
+            self._metrics.sent(len(data))
+
+    def message_received(self, data):
+        self.bytes_received += len(data)
+        if self._metrics is not None:
+            self._metrics.received(len(data))
+
+        self._message_received(data)
+
+
+class _WSTransport(object):
+    """Adapts an aiohttp WebSocket to the transport interface used by
+    :class:`_WSProtocol` and reads messages from it in a task"""
+
+    def __init__(self, ws, protocol):
+        self._ws = ws
+        self._protocol = protocol
+        self._reading = asyncio.Event()
+        self._reading.set()
+
+        protocol.connection_made(self)
+        self._task = asyncio.ensure_future(self._read())
+
+    async def send(self, data):
+        await self._ws.send_str(data.decode('UTF-8'))
+
+    def pause_reading(self):
+        self._reading.clear()
+
+    def resume_reading(self):
+        self._reading.set()
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        pass
+
+    def is_closing(self):
+        return self._ws.closed
+
+    def close(self):
+        self._task.cancel()
+
+    async def _read(self):
+        ws = self._ws
+        exc = None
+        try:
+            async for msg in ws:
+                if msg.type == aiohttp.WSMsgType.TEXT:
+                    self._protocol.message_received(msg.data.encode('UTF-8'))
+                elif msg.type == aiohttp.WSMsgType.BINARY:
+                    self._protocol.message_received(msg.data)
+
+                await self._reading.wait()
+
+            exc = ws.exception()
+        except Exception as e:
+            exc = e
+        finally:
+            if not ws.closed:
+                await ws.close()
+            self._protocol.connection_lost(exc)
+
+
+def _is_reply(body, codec):
+    """Whether the body of an HTTP response holds JSON-RPC responses"""
+
+    try:
+        data = get_codec(codec).decode(body)
+    except ValueError:
+        return False
+
+    if isinstance(data, dict):
+        data = [data]
+    elif not isinstance(data, list) or len(data) == 0:
+        return False
+
+    return all(isinstance(message, dict) and \
+               ('result' in message or 'error' in message)
+               for message in data)
+
+
+def _batch_results(batch, responses):
+    """Match each request in a batch to its response by id"""
+
+    by_uid = {}
+    for response in responses:
+        by_uid[response.uid] = response
+
+    results = []
+    for request in batch:
+        if request.notification:
+            results.append(None)
+            continue
+
+        # A response without an id is an error for the whole batch
+        response = by_uid.get(request.uid, by_uid.get(None))
+        if response is None:
+            results.append(RPCMessageError('No response received for %s' % \
+                                           request.uid))
+        elif response.error is not None:
+            results.append(response.exception())
+        else:
+            results.append(response)
+
+    return results
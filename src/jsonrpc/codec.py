@@ -0,0 +1,147 @@
+# Copyright 2017 Simon Kennedy <sffjunkie+code@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""JSON encoders and decoders used to marshal messages.
+
+A codec turns a Python object into UTF-8 encoded bytes and back again. The
+standard library :mod:`json` module is always available; ``orjson``,
+``ujson`` and ``rapidjson`` are used when they are installed.
+"""
+
+import json
+
+from jsonrpc import RPCError
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import rapidjson
+except ImportError:
+    rapidjson = None
+
+__all__ = ['JSONCodec', 'OrjsonCodec', 'UjsonCodec', 'RapidjsonCodec',
+           'get_codec', 'available_codecs']
+
+
+class JSONCodec(object):
+    """Codec using the standard library :mod:`json` module"""
+
+    name = 'json'
+
+    def encode(self, obj):
+        """Encode an object to UTF-8 encoded JSON"""
+        return json.dumps(obj).encode('UTF-8')
+
+    def decode(self, data):
+        """Decode JSON from bytes, a bytearray, a memoryview or a string"""
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+    def __repr__(self):
+        return 'Codec: %s' % self.name
+
+
+class OrjsonCodec(JSONCodec):
+    """Codec using ``orjson``"""
+
+    name = 'orjson'
+
+    def encode(self, obj):
+        return orjson.dumps(obj)
+
+    def decode(self, data):
+        return orjson.loads(data)
+
+
+class UjsonCodec(JSONCodec):
+    """Codec using ``ujson``"""
+
+    name = 'ujson'
+
+    def encode(self, obj):
+        return ujson.dumps(obj, ensure_ascii=False).encode('UTF-8')
+
+    def decode(self, data):
+        if isinstance(data, (bytearray, memoryview)):
+            data = bytes(data)
+        return ujson.loads(data)
+
+
+class RapidjsonCodec(JSONCodec):
+    """Codec using ``python-rapidjson``"""
+
+    name = 'rapidjson'
+
+    def encode(self, obj):
+        return rapidjson.dumps(obj, ensure_ascii=False).encode('UTF-8')
+
+    def decode(self, data):
+        if isinstance(data, (bytearray, memoryview)):
+            data = bytes(data)
+        return rapidjson.loads(data)
+
+
+# Fastest first
+_CODECS = [
+    (OrjsonCodec, lambda: orjson),
+    (RapidjsonCodec, lambda: rapidjson),
+    (UjsonCodec, lambda: ujson),
+    (JSONCodec, lambda: json),
+]
+
+_instances = {}
+
+
+def available_codecs():
+    """Return the names of the codecs which can be used, fastest first"""
+    return [cls.name for cls, module in _CODECS if module() is not None]
+
+
+def get_codec(codec=None):
+    """Return a codec instance.
+
+    Args:
+        codec (str or codec): The name of a codec, 'auto' for the fastest
+            codec installed or a codec instance which is returned unchanged.
+            None returns the standard library codec.
+    """
+    if codec is None:
+        codec = 'json'
+    elif not isinstance(codec, str):
+        return codec
+
+    if codec == 'auto':
+        codec = available_codecs()[0]
+
+    if codec in _instances:
+        return _instances[codec]
+
+    for cls, module in _CODECS:
+        if cls.name == codec:
+            if module() is None:
+                raise RPCError('JSON codec %s is not installed' % codec)
+
+            _instances[codec] = cls()
+            return _instances[codec]
+
+    raise RPCError('Unrecognised JSON codec %s specified' % codec)
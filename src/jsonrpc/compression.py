@@ -0,0 +1,204 @@
+# Copyright 2017 Simon Kennedy <sffjunkie+code@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""HTTP content encodings used to compress message bodies.
+
+``gzip`` and ``deflate`` are always available; ``br`` and ``zstd`` are
+used when ``brotli`` and ``zstandard`` are installed.
+"""
+
+import zlib
+
+from jsonrpc import RPCError
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+__all__ = ['RPCDecompressionError', 'RPCSizeLimitError',
+           'available_encodings', 'compress', 'decompress', 'decompressor',
+           'choose_encoding']
+
+# The compressed bytes passed to a decompressor at a time when its output
+# is limited and it cannot limit the output itself
+_INPUT_CHUNK_SIZE = 1024
+
+
+class RPCDecompressionError(RPCError):
+    """Raised when compressed data is corrupt"""
+    pass
+
+
+class RPCSizeLimitError(RPCError):
+    """Raised when data decompresses to more than the size allowed"""
+    pass
+
+
+class _ZlibDecompressor(object):
+    """Decompress zlib, gzip or raw deflate data a piece at a time"""
+
+    def __init__(self, wbits):
+        self._obj = zlib.decompressobj(wbits)
+
+    def decompress(self, data, max_length=0):
+        """Decompress a piece of data returning at most max_length bytes;
+        0 returns all of them"""
+        return self._obj.decompress(data, max_length)
+
+
+class _ChunkedDecompressor(object):
+    """Limit the output of a decompressor which cannot limit it itself by
+    feeding it small pieces of its input"""
+
+    def __init__(self, obj):
+        self._obj = obj
+
+    def decompress(self, data, max_length=0):
+        """Decompress a piece of data returning at most max_length bytes;
+        0 returns all of them"""
+        if not max_length:
+            return self._obj.decompress(data)
+
+        pieces = []
+        size = 0
+        for idx in range(0, len(data), _INPUT_CHUNK_SIZE):
+            piece = self._obj.decompress(data[idx:idx + _INPUT_CHUNK_SIZE])
+            pieces.append(piece)
+            size += len(piece)
+            if size >= max_length:
+                break
+
+        return b''.join(pieces)[:max_length]
+
+
+def _compress_gzip(data):
+    obj = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return obj.compress(data) + obj.flush()
+
+
+def _compress_zstd(data):
+    return zstandard.ZstdCompressor(level=3).compress(data)
+
+
+# Smallest output first
+_ENCODINGS = [
+    ('zstd', lambda: zstandard, _compress_zstd,
+     lambda: _ChunkedDecompressor(
+         zstandard.ZstdDecompressor().decompressobj())),
+    ('br', lambda: brotli, lambda data: brotli.compress(data, quality=4),
+     lambda: _ChunkedDecompressor(brotli.Decompressor())),
+    ('gzip', lambda: zlib, _compress_gzip,
+     lambda: _ZlibDecompressor(31)),
+    # A zlib stream as the HTTP specification requires; 47 also accepts
+    # gzip data sent by mistake
+    ('deflate', lambda: zlib, lambda data: zlib.compress(data, 6),
+     lambda: _ZlibDecompressor(47)),
+]
+
+
+def available_encodings():
+    """Return the names of the encodings which can be used, smallest output
+    first"""
+    return [name for name, module, _c, _d in _ENCODINGS if module() is not None]
+
+
+def _encoding(name):
+    for encoding in _ENCODINGS:
+        if encoding[0] == name:
+            if encoding[1]() is None:
+                raise RPCError('Content encoding %s is not installed' % name)
+            return encoding
+
+    raise RPCError('Unrecognised content encoding %s specified' % name)
+
+
+def compress(data, encoding):
+    """Compress data with a content encoding
+
+    Args:
+        data (bytes): The data to compress
+        encoding (str): 'gzip', 'deflate', 'br' or 'zstd'
+    """
+    return _encoding(encoding)[2](data)
+
+
+def decompressor(encoding):
+    """Return an object whose ``decompress(data, max_length=0)`` method
+    decompresses data a piece at a time as it is received"""
+    return _encoding(encoding)[3]()
+
+
+def decompress(data, encoding, max_length=None):
+    """Decompress data compressed with a content encoding
+
+    Args:
+        data (bytes): The data to decompress
+        encoding (str): 'gzip', 'deflate', 'br' or 'zstd'
+        max_length (int): The most bytes the data may decompress to; None
+            allows any size
+
+    Raises:
+        RPCError: The encoding is not recognised or not installed
+        RPCDecompressionError: The data is corrupt
+        RPCSizeLimitError: The data decompresses to more than max_length
+            bytes
+    """
+    d = decompressor(encoding)
+    try:
+        if max_length is None:
+            return d.decompress(data)
+
+        # Ask for one byte more than allowed to find out if there is more
+        decompressed = d.decompress(data, max_length + 1)
+    except Exception as exc:
+        raise RPCDecompressionError('Unable to decompress %s data: %s' % \
+                                    (encoding, exc))
+
+    if len(decompressed) > max_length:
+        raise RPCSizeLimitError('%s data decompresses to more than %d bytes' % \
+                                (encoding, max_length))
+    return decompressed
+
+
+def choose_encoding(accept_encoding):
+    """Choose the available encoding with the smallest output from an
+    ``Accept-Encoding`` header
+
+    Returns:
+        str: The name of the encoding or None if none of the acceptable
+        encodings are available
+    """
+    accepted = set()
+    for item in accept_encoding.split(','):
+        name, _sep, params = item.strip().partition(';')
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+
+    for name in available_encodings():
+        if name in accepted or '*' in accepted:
+            return name
+
+    return None
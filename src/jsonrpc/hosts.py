@@ -0,0 +1,216 @@
+# Copyright 2017 Simon Kennedy <sffjunkie+code@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The hosts an :class:`~jsonrpc.client.RPCClient` spreads its calls over.
+
+Each host tracks its recent latency and a circuit breaker. After
+``breaker_threshold`` consecutive connection failures, which include HTTP
+5xx replies that do not carry a JSON-RPC response, the breaker opens and
+the host is skipped for ``breaker_timeout`` seconds. A single trial call is then let through; it
+closes the breaker if it succeeds and opens it again if it fails.
+"""
+
+import time
+
+from jsonrpc import RPCError
+from jsonrpc.message import RPCRequestError
+from jsonrpc.retry import CONNECTION_ERRORS
+
+__all__ = ['RPCUnavailableError', 'Host', 'HostSet']
+
+BALANCE_POLICIES = ('round-robin', 'latency')
+
+
+class RPCUnavailableError(RPCError):
+    """Raised when every host is unhealthy or has its circuit breaker open"""
+    pass
+
+
+class Host(object):
+    """A host which calls are sent to
+
+    Args:
+        host (str): Host name or the path of the socket for 'unix'
+        port (int): Port number on the host
+        path (str): The path requests are sent to; (http and ws only)
+        breaker_threshold (int): Consecutive failures which open the
+            circuit breaker; None never opens it
+        breaker_timeout (float): Seconds the breaker stays open before a
+            trial call is allowed
+        alpha (float): The weight given to each new latency in the
+            exponentially weighted moving average
+    """
+    def __init__(self, host, port, path='/jsonrpc', breaker_threshold=None,
+                 breaker_timeout=30, alpha=0.3):
+        self.host = host
+        self.port = port
+        self.url = 'http://{}:{}{}'.format(host, port, path)
+        self.ws_url = 'ws://{}:{}{}'.format(host, port, path)
+        self.breaker_threshold = breaker_threshold
+        self.breaker_timeout = breaker_timeout
+        self.alpha = alpha
+
+        self.state = 'closed'
+        self.healthy = True
+        self.latency = None
+        self.in_flight = 0
+        self.calls = 0
+        self.failures = 0
+        self.ejections = 0
+
+        # The TCP connection pool, created by the client on first use
+        self.pool = None
+
+        self._consecutive_failures = 0
+        self._opened_at = 0
+        self._trial = False
+
+    def available(self, now):
+        """Return True if calls may be sent to the host"""
+        if not self.healthy:
+            return False
+
+        if self.state == 'open' and now - self._opened_at >= self.breaker_timeout:
+            self.state = 'half-open'
+
+        if self.state == 'half-open':
+            return not self._trial
+
+        return self.state == 'closed'
+
+    def call(self):
+        """Return a context manager which records the outcome of a call"""
+        return _HostCall(self)
+
+    def succeeded(self, elapsed):
+        """Record a call answered after elapsed seconds"""
+        if self.latency is None:
+            self.latency = elapsed
+        else:
+            self.latency += self.alpha * (elapsed - self.latency)
+
+        self._consecutive_failures = 0
+        self._trial = False
+        self.state = 'closed'
+
+    def failed(self):
+        """Record a call which could not reach the host"""
+        self.failures += 1
+        self._consecutive_failures += 1
+        self._trial = False
+
+        if self.breaker_threshold is None:
+            return
+
+        if self.state == 'half-open' or \
+           self._consecutive_failures >= self.breaker_threshold:
+            if self.state == 'closed':
+                self.ejections += 1
+            self.state = 'open'
+            self._opened_at = time.monotonic()
+
+    def abandoned(self):
+        """Record a call cancelled before it was answered"""
+        self._trial = False
+
+    def stats(self):
+        return {
+            'host': self.host,
+            'port': self.port,
+            'state': self.state,
+            'healthy': self.healthy,
+            'latency': self.latency,
+            'in_flight': self.in_flight,
+            'calls': self.calls,
+            'failures': self.failures,
+            'ejections': self.ejections,
+        }
+
+
+class _HostCall(object):
+    __slots__ = ('host', 'start')
+
+    def __init__(self, host):
+        self.host = host
+
+    def __enter__(self):
+        self.host.calls += 1
+        self.host.in_flight += 1
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        host = self.host
+        host.in_flight -= 1
+
+        # An error returned by the host shows it is reachable
+        if exc_type is None or issubclass(exc_type, RPCRequestError):
+            host.succeeded(time.monotonic() - self.start)
+        elif issubclass(exc_type, CONNECTION_ERRORS):
+            host.failed()
+        else:
+            host.abandoned()
+
+        return False
+
+
+class HostSet(object):
+    """Choose the host for each call
+
+    Args:
+        hosts (list of :class:`Host`): The hosts to choose from
+        balance (str): 'round-robin' (default) takes each available host in
+            turn; 'latency' takes the host with the lowest moving average
+            latency weighted by its calls in flight
+    """
+    def __init__(self, hosts, balance='round-robin'):
+        self.hosts = list(hosts)
+        self.balance = balance
+        self._next = 0
+
+    def choose(self):
+        """Return the host to send the next call to
+
+        Raises:
+            RPCUnavailableError: No host is available
+        """
+        host = self.alternative(None)
+        if host is None:
+            raise RPCUnavailableError('No host is available')
+        return host
+
+    def alternative(self, exclude):
+        """Return an available host other than exclude or None"""
+        now = time.monotonic()
+        candidates = [h for h in self.hosts
+                      if h is not exclude and h.available(now)]
+        if not candidates:
+            return None
+
+        if len(candidates) == 1:
+            host = candidates[0]
+        elif self.balance == 'latency':
+            host = min(candidates, key=_load)
+        else:
+            host = candidates[self._next % len(candidates)]
+            self._next += 1
+
+        if host.state == 'half-open':
+            host._trial = True
+        return host
+
+
+def _load(host):
+    # A host with no latency recorded yet is tried first
+    return (host.latency or 0) * (host.in_flight + 1)
@@ -0,0 +1,544 @@
+# Copyright 2017 Simon Kennedy <sffjunkie+code@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Method stubs built from the API description a host returns for
+``JSONRPC.Introspect``.
+
+The description lists each method's parameters as JSON schemas (draft 03,
+as used by Kodi) which refer to shared types by id. Each method's schemas
+are compiled into a validator the first time the method is used, so an
+invalid call raises :class:`~jsonrpc.message.RPCRequestError` without
+being sent.
+"""
+
+import inspect
+import json
+import keyword
+import os
+import re
+
+from jsonrpc.message import RPCRequestError, METHOD_NOT_FOUND, INVALID_PARAMS
+
+__all__ = ['RPCSchema', 'version_string']
+
+
+class _Invalid(Exception):
+    """A value which does not match its schema; path locates the value"""
+
+    def __init__(self, message):
+        Exception.__init__(self, message)
+        self.message = message
+        self.path = []
+
+    def __str__(self):
+        path = ''
+        for item in self.path:
+            if isinstance(item, int):
+                path += '[%d]' % item
+            else:
+                path += '.' + item if path else item
+        return '%s: %s' % (path, self.message) if path else self.message
+
+
+_TYPES = {
+    'string': lambda v: isinstance(v, str),
+    'integer': lambda v: isinstance(v, int) and not isinstance(v, bool),
+    'number': lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    'boolean': lambda v: isinstance(v, bool),
+    'object': lambda v: isinstance(v, dict),
+    'array': lambda v: isinstance(v, (list, tuple)),
+    'null': lambda v: v is None,
+}
+
+_ANNOTATIONS = {
+    'string': 'str',
+    'integer': 'int',
+    'number': 'float',
+    'boolean': 'bool',
+    'object': 'dict',
+    'array': 'list',
+    'null': 'None',
+}
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _nested(validate, key, value):
+    try:
+        validate(value)
+    except _Invalid as exc:
+        exc.path.insert(0, key)
+        raise
+
+
+class _Compiler(object):
+    """Compile schemas into functions which raise :class:`_Invalid` for a
+    value which does not match"""
+
+    def __init__(self, types):
+        self.types = types
+        self.compiled = {}
+
+    def ref(self, name):
+        try:
+            return self.compiled[name]
+        except KeyError:
+            pass
+
+        if name not in self.types:
+            # An unknown type accepts any value rather than rejecting calls
+            # the host would accept
+            self.compiled[name] = None
+            return None
+
+        # Types may refer to themselves so refer to the entry in compiled
+        # until the type has been compiled
+        compiled = self.compiled
+        compiled[name] = lambda value: compiled[name] and compiled[name](value)
+        compiled[name] = self.compile(self.types[name])
+        return compiled[name]
+
+    def compile(self, schema):
+        """Return a validator for a schema or None if it accepts any value"""
+        if isinstance(schema, str):
+            return self.ref(schema)
+
+        checks = []
+
+        if '$ref' in schema:
+            checks.append(self.ref(schema['$ref']))
+
+        extends = schema.get('extends', [])
+        if not isinstance(extends, list):
+            extends = [extends]
+        checks.extend(self.compile(base) for base in extends)
+
+        checks.append(self._type(schema.get('type', 'any')))
+
+        if 'enum' in schema:
+            checks.append(_enum(schema['enum']))
+
+        minimum = schema.get('minimum')
+        maximum = schema.get('maximum')
+        if minimum is not None or maximum is not None:
+            checks.append(_range(minimum, maximum))
+
+        min_length = schema.get('minLength')
+        max_length = schema.get('maxLength')
+        if min_length is not None or max_length is not None:
+            checks.append(_length(min_length, max_length))
+
+        if 'items' in schema or 'minItems' in schema or \
+           'maxItems' in schema or schema.get('uniqueItems', False):
+            checks.append(self._array(schema))
+
+        if 'properties' in schema or 'additionalProperties' in schema:
+            checks.append(self._object(schema))
+
+        checks = [check for check in checks if check is not None]
+        if not checks:
+            return None
+        if len(checks) == 1:
+            return checks[0]
+
+        def check(value):
+            for c in checks:
+                c(value)
+        return check
+
+    def _type(self, kind):
+        kinds = kind if isinstance(kind, list) else [kind]
+
+        alternatives = []
+        for kind in kinds:
+            if isinstance(kind, dict):
+                validate = self.compile(kind)
+            elif kind in _TYPES:
+                validate = _type(kind)
+            else:
+                validate = None
+
+            if validate is None:
+                # 'any' or a schema without constraints
+                return None
+            alternatives.append(validate)
+
+        if len(alternatives) == 1:
+            return alternatives[0]
+
+        names = ', '.join(k if isinstance(k, str) else 'schema' for k in kinds)
+
+        def check(value):
+            for validate in alternatives:
+                try:
+                    validate(value)
+                    return
+                except _Invalid:
+                    pass
+            raise _Invalid('%r is not one of the allowed types (%s)' % \
+                           (value, names))
+        return check
+
+    def _array(self, schema):
+        items = schema.get('items')
+        if isinstance(items, list):
+            positional = [self.compile(item) for item in items]
+            validate_item = None
+        else:
+            positional = None
+            validate_item = self.compile(items) if items is not None else None
+
+        min_items = schema.get('minItems')
+        max_items = schema.get('maxItems')
+        unique = schema.get('uniqueItems', False)
+
+        def check(value):
+            if not isinstance(value, (list, tuple)):
+                return
+
+            if min_items is not None and len(value) < min_items:
+                raise _Invalid('at least %d items are needed' % min_items)
+            if max_items is not None and len(value) > max_items:
+                raise _Invalid('at most %d items are allowed' % max_items)
+
+            if unique:
+                for idx, item in enumerate(value):
+                    if item in value[:idx]:
+                        raise _Invalid('%r is repeated' % (item,))
+
+            if positional is not None:
+                for idx, (validate, item) in enumerate(zip(positional, value)):
+                    if validate is not None:
+                        _nested(validate, idx, item)
+            elif validate_item is not None:
+                for idx, item in enumerate(value):
+                    _nested(validate_item, idx, item)
+        return check
+
+    def _object(self, schema):
+        members = {}
+        required = []
+        for name, member in schema.get('properties', {}).items():
+            members[name] = self.compile(member)
+            if member.get('required', False):
+                required.append(name)
+
+        additional = schema.get('additionalProperties', True)
+        if isinstance(additional, dict):
+            additional = self.compile(additional) or True
+
+        def check(value):
+            if not isinstance(value, dict):
+                return
+
+            for name in required:
+                if name not in value:
+                    raise _Invalid('%s is required' % name)
+
+            for name, item in value.items():
+                if name in members:
+                    validate = members[name]
+                elif additional is True:
+                    continue
+                elif additional is False:
+                    raise _Invalid('%s is not allowed' % name)
+                else:
+                    validate = additional
+
+                if validate is not None:
+                    _nested(validate, name, item)
+        return check
+
+
+def _type(kind):
+    matches = _TYPES[kind]
+
+    def check(value):
+        if not matches(value):
+            raise _Invalid('%r is not of type %s' % (value, kind))
+    return check
+
+
+def _enum(allowed):
+    def check(value):
+        if value not in allowed:
+            raise _Invalid('%r is not one of %s' % \
+                           (value, ', '.join(repr(a) for a in allowed)))
+    return check
+
+
+def _range(minimum, maximum):
+    def check(value):
+        if not _is_number(value):
+            return
+        if minimum is not None and value < minimum:
+            raise _Invalid('%r is less than the minimum %r' % (value, minimum))
+        if maximum is not None and value > maximum:
+            raise _Invalid('%r is more than the maximum %r' % (value, maximum))
+    return check
+
+
+def _length(min_length, max_length):
+    def check(value):
+        if not isinstance(value, str):
+            return
+        if min_length is not None and len(value) < min_length:
+            raise _Invalid('%r is shorter than %d' % (value, min_length))
+        if max_length is not None and len(value) > max_length:
+            raise _Invalid('%r is longer than %d' % (value, max_length))
+    return check
+
+
+class _Method(object):
+    """The compiled parameters of a method"""
+
+    def __init__(self, name, description, compiler):
+        self.name = name
+        self.description = description.get('description', '')
+        self.params = []
+        for param in description.get('params', []):
+            self.params.append((param['name'], compiler.compile(param),
+                                param.get('required', False)))
+        self._by_name = dict((name, validate)
+                             for name, validate, _r in self.params)
+
+    def check(self, args, kwargs):
+        """Raise :class:`RPCRequestError` if the parameters do not match"""
+        try:
+            self._check(args, kwargs)
+        except _Invalid as exc:
+            raise RPCRequestError('Invalid params', INVALID_PARAMS, str(exc))
+
+    def _check(self, args, kwargs):
+        params = self.params
+        if len(args) > len(params):
+            raise _Invalid('%s takes at most %d parameters but %d were given' % \
+                           (self.name, len(params), len(args)))
+
+        for (name, validate, _required), value in zip(params, args):
+            if validate is not None:
+                _nested(validate, name, value)
+
+        by_name = self._by_name
+        for name, value in kwargs.items():
+            if name not in by_name:
+                raise _Invalid('Unknown parameter %s' % name)
+            validate = by_name[name]
+            if validate is not None:
+                _nested(validate, name, value)
+
+        for name, _validate, required in params[len(args):]:
+            if required and name not in kwargs:
+                raise _Invalid('Missing parameter %s' % name)
+
+
+class RPCSchema(object):
+    """The API of a host as described by ``JSONRPC.Introspect``
+
+    Args:
+        description (dict): The result of ``JSONRPC.Introspect``
+    """
+    def __init__(self, description):
+        self.description = description
+        self.version = description.get('version', None)
+        self.methods = description.get('methods', {})
+
+        self._compiler = _Compiler(description.get('types', {}))
+        self._compiled = {}
+
+    def __repr__(self):
+        return 'RPCSchema: %d methods' % len(self.methods)
+
+    @classmethod
+    def load(cls, path):
+        """Load a description saved with :meth:`save`"""
+        with open(path, 'r', encoding='UTF-8') as fp:
+            return cls(json.load(fp))
+
+    def save(self, path):
+        """Save the description, replacing any file at path in one step"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'w', encoding='UTF-8') as fp:
+            json.dump(self.description, fp)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def cache_path(directory, version):
+        """Return the file in directory which caches the description for a
+        version of the API"""
+        return os.path.join(directory, 'jsonrpc-%s.json' % \
+                            re.sub(r'[^\w.-]', '_', str(version)))
+
+    def namespace_methods(self, namespace):
+        """Return the names of the methods in a namespace"""
+        prefix = namespace + '.'
+        return sorted(name[len(prefix):] for name in self.methods
+                      if name.startswith(prefix))
+
+    def check(self, method, args=(), kwargs=None):
+        """Raise :class:`RPCRequestError` without calling the host if the
+        method does not exist or its parameters are invalid"""
+        self._method(method).check(args, kwargs or {})
+
+    def checker(self, method):
+        """Return the function which checks the parameters of a method when
+        called with the positional and named parameters
+
+        Raises:
+            RPCRequestError: The method does not exist
+        """
+        return self._method(method).check
+
+    def stub(self, method, call):
+        """Wrap a coroutine function which calls a method so that its
+        parameters are checked first
+
+        The stub has the method's description as its docstring and a
+        signature listing its parameters.
+
+        Args:
+            method (str): The method's name e.g. 'Player.GetProperties'
+            call (coroutine function): Called with the parameters when
+                they are valid
+        """
+        if method not in self.methods:
+            async def missing(*args, **kwargs):
+                raise RPCRequestError('Method not found', METHOD_NOT_FOUND,
+                                      method)
+            return missing
+
+        compiled = self._method(method)
+        check = compiled.check
+
+        async def stub(*args, **kwargs):
+            check(args, kwargs)
+            return await call(*args, **kwargs)
+
+        stub.__name__ = stub.__qualname__ = method
+        stub.__doc__ = compiled.description
+        stub.__signature__ = self._signature(method)
+        return stub
+
+    def stub_source(self):
+        """Return the source of a Python stub file (.pyi) with a class for
+        each namespace for editors and type checkers"""
+        lines = ['# API version %s' % self.version,
+                 'from typing import Any', '']
+
+        namespace = None
+        for name in sorted(self.methods):
+            ns, _sep, method = name.rpartition('.')
+            if ns != namespace:
+                namespace = ns
+                lines.extend(['', 'class %s:' % ns.replace('.', '_')])
+
+            params = ['self']
+            for param in self.methods[name].get('params', []):
+                text = '%s: %s' % (param['name'], self._annotation(param))
+                if not param.get('required', False):
+                    text += ' = ...'
+                params.append(text)
+
+            if not _valid_signature(self.methods[name].get('params', [])):
+                params = ['self', '*args: Any', '**kwargs: Any']
+
+            lines.append('    async def %s(%s) -> Any: ...' % \
+                         (method, ', '.join(params)))
+
+        return '\n'.join(lines) + '\n'
+
+    def _method(self, method):
+        try:
+            return self._compiled[method]
+        except KeyError:
+            pass
+
+        if method not in self.methods:
+            raise RPCRequestError('Method not found', METHOD_NOT_FOUND, method)
+
+        compiled = _Method(method, self.methods[method], self._compiler)
+        self._compiled[method] = compiled
+        return compiled
+
+    def _signature(self, method):
+        params = self.methods[method].get('params', [])
+        if not _valid_signature(params):
+            return inspect.Signature([
+                inspect.Parameter('args', inspect.Parameter.VAR_POSITIONAL),
+                inspect.Parameter('kwargs', inspect.Parameter.VAR_KEYWORD)])
+
+        parameters = []
+        for param in params:
+            default = inspect.Parameter.empty
+            if not param.get('required', False):
+                default = param.get('default', None)
+            parameters.append(inspect.Parameter(
+                param['name'], inspect.Parameter.POSITIONAL_OR_KEYWORD,
+                default=default, annotation=self._annotation(param)))
+        return inspect.Signature(parameters)
+
+    def _annotation(self, schema, depth=0):
+        """Return the name of the Python type of the values of a schema"""
+        types = self._compiler.types
+        while '$ref' in schema and depth < 10:
+            schema = types.get(schema['$ref'], {})
+            depth += 1
+
+        kind = schema.get('type', 'any')
+        if isinstance(kind, list):
+            names = []
+            for k in kind:
+                name = self._annotation(k, depth + 1) if isinstance(k, dict) \
+                    else _ANNOTATIONS.get(k, 'Any')
+                if name not in names:
+                    names.append(name)
+            if 'Any' in names or len(names) > 1:
+                return 'Any'
+            return names[0]
+
+        return _ANNOTATIONS.get(kind, 'Any')
+
+
+def _valid_signature(params):
+    """Return True if the parameters can be listed in a Python signature"""
+    seen_optional = False
+    for param in params:
+        name = param.get('name', '')
+        if not name.isidentifier() or keyword.iskeyword(name) or name == 'self':
+            return False
+        if param.get('required', False):
+            if seen_optional:
+                return False
+        else:
+            seen_optional = True
+    return True
+
+
+def version_string(result):
+    """Return the version in the result of ``JSONRPC.Version`` as a string
+    e.g. '12.4.0'"""
+    version = result
+    if isinstance(result, dict):
+        version = result.get('version', result)
+
+    if isinstance(version, dict):
+        return '.'.join(str(version.get(part, 0))
+                        for part in ('major', 'minor', 'patch'))
+    return str(version)
@@ -13,11 +13,16 @@
 # limitations under the License.
 
 import json
+import re
 import uuid
 
-from jsonrpc import RPCError
+from jsonrpc import RPCError, buffer
+from jsonrpc.codec import get_codec
 
-__all__ = ['RPCMessageError', 'RPCRequest', 'RPCResponse']
+__all__ = ['RPCMessageError', 'RPCRequest', 'RPCPreparedRequest',
+           'RPCResponse', 'RPCBatch', 'uuid_ids', 'PARSE_ERROR',
+           'INVALID_REQUEST', 'METHOD_NOT_FOUND', 'INVALID_PARAMS',
+           'INTERNAL_ERROR']
 
 
 class RPCMessageError(RPCError):
@@ -40,7 +45,159 @@ class RPCRequestError(RPCError):
             return '%s' % self.message
 
 
+# The error codes defined by the JSON-RPC 2.0 specification
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+
+def uuid_ids():
+    """Generate request ids from random UUIDs"""
+    while True:
+        yield str(uuid.uuid4())
+
+
+def _loads(data, codec=None):
+    if len(data) == 0:
+        raise RPCMessageError('Empty JSON data received.')
+
+    return get_codec(codec).decode(data)
+
+
+# Patterns used to read the members of a response around the result
+# without scanning the result itself
+_OPEN = re.compile(rb'\s*\{')
+_KEY = re.compile(rb'\s*"([^"\\]*)"\s*:\s*')
+_SIMPLE = rb'(?:"[^"\\]*"|[-+.0-9eE]+|true|false|null)'
+_SIMPLE_VALUE = re.compile(_SIMPLE)
+_SEPARATOR = re.compile(rb'\s*,')
+_TAIL = re.compile(rb'(?:\s*,\s*"[^"\\]*"\s*:\s*' + _SIMPLE + rb')*\s*\}\s*$')
+_TAIL_MEMBER = re.compile(rb'\s*,\s*"([^"\\]*)"\s*:\s*(' + _SIMPLE + rb')')
+
+# Trailing members longer than this are not looked for
+_TAIL_WINDOW = 4096
+
+
+def _scan_response(data):
+    """Find the members of a response and the position of the result
+    without decoding the result.
+
+    Only responses whose other members have simple values (numbers,
+    strings without escapes, true, false and null) can be scanned; which
+    covers the id and version of a successful response.
+
+    Returns:
+        tuple: (members, start, end) with the decoded members other than
+        the result and the slice of ``data`` holding the encoded result, or
+        None if the response needs to be decoded in full.
+    """
+    match = _OPEN.match(data)
+    if match is None:
+        return None
+
+    members = {}
+    pos = match.end()
+    while True:
+        match = _KEY.match(data, pos)
+        if match is None:
+            return None
+
+        key = match.group(1)
+        pos = match.end()
+        if key == b'result':
+            break
+
+        match = _SIMPLE_VALUE.match(data, pos)
+        if match is None:
+            return None
+        members[key.decode('UTF-8')] = json.loads(match.group().decode('UTF-8'))
+
+        match = _SEPARATOR.match(data, pos=match.end())
+        if match is None:
+            return None
+        pos = match.end()
+
+    start = pos
+    end = _rstrip(data, start, data.rfind(b'}'))
+    if end <= start:
+        return None
+
+    if data[end - 1] not in b']}':
+        # The result may be followed by other members
+        match = _TAIL.search(data, max(start, len(data) - _TAIL_WINDOW))
+        if match is None:
+            return None
+
+        end = _rstrip(data, start, match.start())
+        for member in _TAIL_MEMBER.finditer(data, match.start(), match.end()):
+            members[member.group(1).decode('UTF-8')] = \
+                json.loads(member.group(2).decode('UTF-8'))
+
+    if end <= start or members.get('error', None) is not None:
+        return None
+
+    # The id is needed to route the response, so it must not be lost with
+    # members after the result which could not be read
+    if 'id' not in members:
+        return None
+
+    # A response with an error has a null result, which is caught here
+    # along with other simple results followed by a complex member. A
+    # complex result followed by one is only found by scanning the whole
+    # result, so that is left until the result is used.
+    first = data[start]
+    if first == 0x7b:  # {
+        if data[end - 1] != 0x7d:
+            return None
+    elif first == 0x5b:  # [
+        if data[end - 1] != 0x5d:
+            return None
+    elif _SIMPLE_VALUE.fullmatch(data, start, end) is None:
+        return None
+
+    return members, start, end
+
+
+def _closes_at(data, start, end):
+    """Return True if the bracket opened at data[start] is closed by the
+    byte at end - 1"""
+    match = buffer._STRUCTURAL.match
+    depth = 0
+    pos = start
+    while pos < end:
+        found = match(data, pos, end)
+        if found is None:
+            return False
+
+        pos = found.end()
+        ch = data[pos - 1]
+        if ch == 0x22:  # an unterminated string
+            return False
+        elif ch == 0x7b or ch == 0x5b:  # { or [
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return pos == end
+
+    return False
+
+
+def _rstrip(data, start, end):
+    """Move end back over whitespace"""
+    while end > start and data[end - 1] in b' \t\r\n':
+        end -= 1
+    return end
+
+
+_UNDECODED = object()
+
+
 class RPCRequest(object):
+    __slots__ = ('method', 'version', 'uid', 'notification', 'params')
+
     def __init__(self, method='', uid=None, version='2.0',
     			 notification=False, *args, **kwargs):
         """Construct a JSON request
@@ -63,7 +220,7 @@ class RPCRequest(object):
 
         self.uid = None
         if not notification:
-            if not uid:
+            if uid is None:
                 self.uid = str(uuid.uuid4())
             elif uid == '':
                 raise RPCMessageError('RPCRequest: No (u)id provided')
@@ -115,8 +272,12 @@ class RPCRequest(object):
 
             self.params[str(nameorvalue)] = value
 
-    def marshal(self):
-        """Convert command to a string ready to be sent over the wire"""
+    def marshal(self, codec=None):
+        """Convert command to a string ready to be sent over the wire
+
+        :param codec: The JSON codec or codec name to encode with
+        :type codec: str or :class:`~jsonrpc.codec.JSONCodec`
+        """
 
         if self.method == '':
             raise RPCMessageError(('RPCRequest.marshal: '
@@ -135,22 +296,24 @@ class RPCRequest(object):
         elif self.version == '2.0':
             data['jsonrpc'] = '2.0'
 
-        return json.dumps(data).encode('UTF-8')
+        return get_codec(codec).encode(data)
 
-    def unmarshal(self, data):
+    def unmarshal(self, data, codec=None):
         """Initialise the command with data from over the wire
 
         :param data: The data to initialise the command with.
         :type data: string
+        :param codec: The JSON codec or codec name to decode with
+        :type codec: str or :class:`~jsonrpc.codec.JSONCodec`
         """
 
-        if len(data) == 0:
-            raise RPCMessageError('Empty JSON data received.')
+        self._load(_loads(data, codec))
 
-        if isinstance(data, (bytes, bytearray)):
-            data = data.decode('UTF-8')
+    def _load(self, data):
+        """Initialise the command from a decoded JSON object"""
 
-        data = json.loads(data)
+        if not isinstance(data, dict):
+            raise RPCMessageError('Request is not a JSON object.')
 
         if 'jsonrpc' in data:
             self.version = data.pop('jsonrpc')
@@ -173,7 +336,176 @@ class RPCRequest(object):
             self.params = [data['params']]
 
 
+class RPCPreparedRequest(object):
+    __slots__ = ('method', 'version', 'names', 'constants', '_codec',
+                 '_keys', '_fixed', '_open')
+
+    def __init__(self, method, params=(), constants=None, version='2.0',
+                 codec=None):
+        """Construct a template for the requests to a frequently called
+        method.
+
+        The parts of the message which are the same for every call, the
+        version, the method name and any constant parameters, are encoded
+        once. :meth:`request` encodes only the id and the parameters which
+        vary.
+
+        :param method: The method name to call
+        :type method:  str
+        :param params: The names of the parameters which may be passed
+                       with each call
+        :type params:  list of str
+        :param constants: Named parameters sent with every call
+        :type constants:  dict
+        :param version: The version of JSON message to produce
+        :type version: str
+        :param codec: The JSON codec or codec name to encode with
+        :type codec: str or :class:`~jsonrpc.codec.JSONCodec`
+        """
+
+        if method == '':
+            raise RPCMessageError(('RPCPreparedRequest: '
+                            'No method name specified.'))
+
+        self.method = method
+        self.version = version
+        self.names = tuple(params)
+        self.constants = dict(constants or {})
+        self._codec = codec = get_codec(codec)
+
+        both = set(self.names) & set(self.constants)
+        if both:
+            raise RPCMessageError(('RPCPreparedRequest: Parameters %s are '
+                            'both constant and passed with each call') % \
+                            ', '.join(sorted(both)))
+
+        self._keys = dict((name, codec.encode(name) + b': ')
+                          for name in self.names)
+
+        envelope = b'{'
+        if version == '1.1':
+            envelope += b'"version": "1.1", '
+        elif version == '2.0':
+            envelope += b'"jsonrpc": "2.0", '
+        envelope += b'"method": ' + codec.encode(method)
+
+        # The message when no parameters are passed with the call, and the
+        # start of the message with the params object left open for them
+        if self.constants:
+            encoded = codec.encode(self.constants).rstrip()
+            self._fixed = envelope + b', "params": ' + encoded + b', "id": '
+            self._open = envelope + b', "params": ' + encoded[:-1] + b', '
+        else:
+            self._fixed = envelope + b', "id": '
+            self._open = envelope + b', "params": {'
+
+    def __repr__(self):
+        return 'RPCPreparedRequest: %s' % self.method
+
+    def request(self, uid, *args, **kwargs):
+        """Return the request for a single call
+
+        :param uid: The message id to send
+        :type uid: Any JSON encodeable value
+
+        The positional arguments are the values of the parameters in the
+        order of ``params``; keyword arguments give them by name.
+        """
+
+        if kwargs and not self._keys.keys() >= kwargs.keys():
+            raise RPCMessageError('Unexpected parameters %s for %s' % \
+                                  (', '.join(sorted(set(kwargs) - set(self._keys))),
+                                   self.method))
+
+        if not args:
+            return _PreparedCall(self, uid, kwargs)
+
+        if len(args) > len(self.names):
+            raise RPCMessageError(('%s takes %d parameters but %d '
+                            'were given') % \
+                            (self.method, len(self.names), len(args)))
+
+        values = dict(zip(self.names, args))
+        if kwargs:
+            values.update(kwargs)
+        return _PreparedCall(self, uid, values)
+
+
+class _PreparedCall(object):
+    """A request made from a :class:`RPCPreparedRequest`, which can be sent
+    wherever an :class:`RPCRequest` can"""
+
+    __slots__ = ('template', 'uid', 'values')
+
+    notification = False
+
+    def __init__(self, template, uid, values):
+        self.template = template
+        self.uid = uid
+        self.values = values
+
+    def __repr__(self):
+        return 'RPCRequest: %s, %s' % (str(self.uid), self.template.method)
+
+    @property
+    def method(self):
+        return self.template.method
+
+    @property
+    def version(self):
+        return self.template.version
+
+    @property
+    def params(self):
+        constants = self.template.constants
+        if not self.values:
+            return constants or None
+
+        params = dict(constants)
+        params.update(self.values)
+        return params
+
+    def marshal(self, codec=None):
+        """Convert the request to a string ready to be sent over the wire
+
+        :param codec: The JSON codec or codec name to encode with
+        :type codec: str or :class:`~jsonrpc.codec.JSONCodec`
+        """
+
+        template = self.template
+        if codec is None or codec is template._codec:
+            codec = template._codec
+        else:
+            codec = get_codec(codec)
+
+        uid = self.uid
+        if type(uid) is int:
+            uid = str(uid).encode('UTF-8')
+        else:
+            uid = codec.encode(uid)
+
+        if not self.values:
+            return template._fixed + uid + b'}'
+
+        keys = template._keys
+        parts = [template._open]
+        for name, value in self.values.items():
+            parts.append(keys[name])
+            if type(value) is int:
+                parts.append(str(value).encode('UTF-8'))
+            else:
+                parts.append(codec.encode(value))
+            parts.append(b', ')
+
+        parts[-1] = b'}, "id": '
+        parts.append(uid)
+        parts.append(b'}')
+        return b''.join(parts)
+
+
 class RPCResponse(object):
+    __slots__ = ('uid', 'version', 'error', '_result', '_raw', '_codec')
+
     def __init__(self, uid='', version='2.0'):
         """Construct a JSON response
 
@@ -188,6 +520,41 @@ class RPCResponse(object):
         self.version = version
         self.result = None
         self.error = None
+        self._codec = None
+
+    @property
+    def result(self):
+        """The result of the request, decoded on first access for a
+        response unmarshalled with ``lazy=True``"""
+        result = self._result
+        if result is _UNDECODED:
+            try:
+                result = self._result = get_codec(self._codec).decode(self._raw)
+            except ValueError:
+                # The bytes taken for the result ran on into a member after
+                # it, which the decoder rejects as extra data
+                self._load(_loads(self._raw.obj, self._codec))
+                result = self._result
+        return result
+
+    @result.setter
+    def result(self, value):
+        self._result = value
+        self._raw = None
+
+    @property
+    def raw_result(self):
+        """The result as encoded JSON bytes.
+
+        For a response unmarshalled with ``lazy=True`` these are the bytes
+        received, which are checked to hold only the result and returned
+        without being decoded.
+        """
+        raw = self._raw
+        if raw is not None and (self._result is not _UNDECODED or
+                                _closes_at(raw, 0, len(raw))):
+            return bytes(raw)
+        return get_codec(self._codec).encode(self.result)
 
     def __getitem__(self, key):
         if self.result is not None:
@@ -201,60 +568,178 @@ class RPCResponse(object):
     def __repr__(self):
         return 'RPCResponse: %s' % str(self.uid)
 
-    def marshal(self):
-        """Convert response to bytes ready to be sent over the wire"""
+    def exception(self):
+        """Return the :class:`RPCRequestError` for an error response or None
+        if the request succeeded."""
+
+        if self.error is None:
+            return None
+
+        return RPCRequestError(self.error['message'], self.error['code'],
+                               self.error.get('data', None))
+
+    def marshal(self, codec=None):
+        """Convert response to bytes ready to be sent over the wire
+
+        :param codec: The JSON codec or codec name to encode with
+        :type codec: str or :class:`~jsonrpc.codec.JSONCodec`
+        """
 
         if self.uid == '':
             raise RPCMessageError('Unable to marshal response: No id specified.')
 
         data = {
             'id': self.uid,
-            'result': None,
-            'error': None,
         }
 
         if self.version == '2.0':
+            # Only one of result or error may be present in a 2.0 response
             data['jsonrpc'] = '2.0'
+            if self.error is not None:
+                data['error'] = self.error
+            else:
+                data['result'] = self.result
         else:
             data['version'] = self.version
-
-        if self.error is not None:
-            data['error'] = self.error
-        elif self.result is not None:
             data['result'] = self.result
+            data['error'] = self.error
 
-        return json.dumps(data).encode('UTF-8')
+        return get_codec(codec).encode(data)
 
-    def unmarshal(self, data):
+    def unmarshal(self, data, codec=None, lazy=False):
         """Initialise the response with data from over the wire
 
         :param data:   The data to initialise the command with.
         :type data:    string
+        :param codec:  The JSON codec or codec name to decode with
+        :type codec:   str or :class:`~jsonrpc.codec.JSONCodec`
+        :param lazy:   Only read the id and version of a successful
+                       response and decode the result when it is first
+                       accessed. Responses which cannot be read this way
+                       are decoded in full, either here or when the result
+                       is first accessed.
+        :type lazy:    bool
         """
-        if len(data) == 0:
-            raise RPCMessageError('Empty JSON data received.')
+        self._codec = codec
+
+        if lazy and isinstance(data, (bytes, bytearray)):
+            scanned = _scan_response(data)
+            if scanned is not None:
+                members, start, end = scanned
+                self.uid = members.get('id', None)
+                self.error = None
+                self._result = _UNDECODED
+                self._raw = memoryview(data)[start:end]
+
+                if 'jsonrpc' in members:
+                    self.version = members['jsonrpc']
+                else:
+                    self.version = members.get('version', '1.0')
+                return
+
+        self._load(_loads(data, codec))
 
-        if isinstance(data, (bytes, bytearray)):
-            data = data.decode('UTF-8')
+    def _load(self, data):
+        """Initialise the response from a decoded JSON object"""
 
-        data = json.loads(data)
+        if not isinstance(data, dict):
+            raise RPCMessageError('Response is not a JSON object.')
 
+        has_result = 'result' in data
         self.result = data.pop('result', None)
         self.error = data.pop('error', None)
 
-        if self.result and self.error:
+        if self.result is not None and self.error is not None:
             raise RPCMessageError('Invalid response data: Both "result" and "error" specified.')
 
-        if not self.result and not self.error:
+        if not has_result and self.error is None:
             raise RPCMessageError('Invalid response data: "result" or "error" not specified.')
 
-        if self.error is not None:
-            data = self.error.get('data', None)
-            raise RPCRequestError(self.error['message'], self.error['code'], data)
+        self.uid = data.pop('id', None)
 
-        self.uid = data.pop('id')
+        if self.error is not None:
+            raise self.exception()
 
         if 'jsonrpc' in data:
             self.version = data['jsonrpc']
         else:
             self.version = data.get('version', '1.0')
+
+
+class RPCBatch(object):
+    __slots__ = ('messages',)
+
+    def __init__(self, messages=None):
+        """Construct a JSON RPC 2.0 batch
+
+        A batch holds either requests (including notifications) to send or
+        the responses received for them.
+
+        :param messages: The messages in the batch
+        :type messages:  list of :class:`RPCRequest` or :class:`RPCResponse`
+        """
+
+        self.messages = list(messages or [])
+
+    def __iter__(self):
+        return iter(self.messages)
+
+    def __len__(self):
+        return len(self.messages)
+
+    def __repr__(self):
+        return 'RPCBatch: %d messages' % len(self.messages)
+
+    def append(self, message):
+        """Append a request or response to the batch"""
+
+        self.messages.append(message)
+
+    def marshal(self, codec=None):
+        """Convert the batch to a JSON array ready to be sent over the wire
+
+        :param codec: The JSON codec or codec name to encode with
+        :type codec: str or :class:`~jsonrpc.codec.JSONCodec`
+        """
+
+        if not self.messages:
+            raise RPCMessageError('Unable to marshal batch: No messages.')
+
+        codec = get_codec(codec)
+        return b'[' + b', '.join([m.marshal(codec) for m in self.messages]) + b']'
+
+    def unmarshal(self, data, codec=None):
+        """Initialise the batch with data from over the wire
+
+        Each element which contains a method is decoded as an
+        :class:`RPCRequest` and all others as an :class:`RPCResponse`. Error
+        responses are kept with their ``error`` attribute set rather than
+        raising :class:`RPCRequestError`.
+
+        :param data:   The data to initialise the batch with.
+        :type data:    string
+        :param codec:  The JSON codec or codec name to decode with
+        :type codec:   str or :class:`~jsonrpc.codec.JSONCodec`
+        """
+
+        data = _loads(data, codec)
+
+        if isinstance(data, dict):
+            # A server returns a single error if it cannot read the batch
+            data = [data]
+        elif not data:
+            raise RPCMessageError('Empty batch received.')
+
+        self.messages = []
+        for item in data:
+            if isinstance(item, dict) and 'method' in item:
+                message = RPCRequest()
+                message._load(item)
+            else:
+                message = RPCResponse()
+                try:
+                    message._load(item)
+                except RPCRequestError:
+                    pass
+
+            self.messages.append(message)
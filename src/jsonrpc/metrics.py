@@ -0,0 +1,173 @@
+# Copyright 2017 Simon Kennedy <sffjunkie+code@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+from bisect import bisect_left
+
+__all__ = ['RPCMetrics', 'DEFAULT_BUCKETS']
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RPCMetrics(object):
+    """Call counts, latencies and traffic for :class:`~jsonrpc.client.RPCClient`
+
+    Args:
+        buckets (list of float): The upper bounds in seconds of the latency
+            histogram buckets. Calls slower than the last bound are counted
+            in an extra overflow bucket.
+        hooks (list of callable): Called as ``hook(method, seconds, error)``
+            when each call completes; ``error`` is the exception raised or
+            returned for the call or None. Use :meth:`add_hook` to add more.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS, hooks=None):
+        self.buckets = tuple(buckets)
+        self.hooks = list(hooks or [])
+
+        self.in_flight = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+        self._methods = {}
+
+    def add_hook(self, hook):
+        """Call ``hook(method, seconds, error)`` when each call completes"""
+        self.hooks.append(hook)
+
+    def call(self, method):
+        """Return a context manager which records a call to a method"""
+        return _Call(self, method)
+
+    def started(self, method):
+        """Record the start of a call
+
+        Returns:
+            float: The start time to pass to :meth:`finished`
+        """
+        stats = self._stats(method)
+        stats.in_flight += 1
+        self.in_flight += 1
+        return time.perf_counter()
+
+    def finished(self, method, start, error=None):
+        """Record the end of a call started with :meth:`started`"""
+        elapsed = time.perf_counter() - start
+
+        stats = self._stats(method)
+        stats.in_flight -= 1
+        self.in_flight -= 1
+        stats.calls += 1
+        if error is not None:
+            stats.errors += 1
+
+        stats.total += elapsed
+        if stats.minimum is None or elapsed < stats.minimum:
+            stats.minimum = elapsed
+        if elapsed > stats.maximum:
+            stats.maximum = elapsed
+        stats.counts[bisect_left(self.buckets, elapsed)] += 1
+
+        for hook in self.hooks:
+            hook(method, elapsed, error)
+
+    def sent(self, size):
+        """Record bytes written to the host"""
+        self.bytes_sent += size
+
+    def received(self, size):
+        """Record bytes read from the host"""
+        self.bytes_received += size
+
+    def snapshot(self):
+        """Return a copy of the current values
+
+        Returns:
+            dict: The calls in flight and bytes sent and received in total,
+            and for each method the number of calls completed, the number
+            which failed, the calls in flight and a latency histogram. The
+            histogram has one count per bucket bound plus an overflow
+            count.
+        """
+        methods = {}
+        for name, stats in self._methods.items():
+            methods[name] = {
+                'calls': stats.calls,
+                'errors': stats.errors,
+                'in_flight': stats.in_flight,
+                'latency': {
+                    'sum': stats.total,
+                    'min': stats.minimum,
+                    'max': stats.maximum,
+                    'bounds': list(self.buckets),
+                    'counts': list(stats.counts),
+                },
+            }
+
+        return {
+            'in_flight': self.in_flight,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'methods': methods,
+        }
+
+    def reset(self):
+        """Clear the recorded values, keeping the calls in flight"""
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+        for name, stats in list(self._methods.items()):
+            if stats.in_flight:
+                in_flight = stats.in_flight
+                stats = self._methods[name] = _MethodStats(len(self.buckets))
+                stats.in_flight = in_flight
+            else:
+                del self._methods[name]
+
+    def _stats(self, method):
+        try:
+            return self._methods[method]
+        except KeyError:
+            stats = self._methods[method] = _MethodStats(len(self.buckets))
+            return stats
+
+
+class _MethodStats(object):
+    __slots__ = ('calls', 'errors', 'in_flight', 'total', 'minimum',
+                 'maximum', 'counts')
+
+    def __init__(self, buckets):
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = 0.0
+        self.counts = [0] * (buckets + 1)
+
+
+class _Call(object):
+    __slots__ = ('metrics', 'method', 'start')
+
+    def __init__(self, metrics, method):
+        self.metrics = metrics
+        self.method = method
+
+    def __enter__(self):
+        self.start = self.metrics.started(self.method)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.finished(self.method, self.start, exc)
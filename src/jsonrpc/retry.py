@@ -0,0 +1,151 @@
+# Copyright 2017 Simon Kennedy <sffjunkie+code@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Policies which retry and hedge the calls made by
+:class:`~jsonrpc.client.RPCClient`.
+
+Both only apply to the methods matching their patterns, which should be
+idempotent as a call may reach the host more than once.
+"""
+
+import asyncio
+import collections
+import random
+from fnmatch import fnmatchcase
+
+import aiohttp
+
+__all__ = ['RetryPolicy', 'HedgePolicy']
+
+# Errors which mean the host could not be reached or did not answer
+CONNECTION_ERRORS = (OSError, asyncio.TimeoutError, aiohttp.ClientError)
+
+
+class _MethodPolicy(object):
+    """Match method names against a list of globs"""
+
+    def __init__(self, methods):
+        if isinstance(methods, str):
+            methods = [methods]
+        self.methods = list(methods)
+        self._matches = {}
+
+    def applies(self, method):
+        """Return True if the policy applies to a method"""
+        try:
+            return self._matches[method]
+        except KeyError:
+            pass
+
+        match = any(fnmatchcase(method, pattern) for pattern in self.methods)
+        self._matches[method] = match
+        return match
+
+
+class RetryPolicy(_MethodPolicy):
+    """Retry failed calls with an exponential backoff
+
+    The delay before retry ``n`` is chosen at random between 0 and
+    ``min(max_backoff, backoff * 2 ** (n - 1))`` so that clients which
+    failed together do not retry together.
+
+    Args:
+        methods (list of str): Method names or globs e.g. ['*.Get*']
+        attempts (int): The maximum number of times a call is sent
+        backoff (float): Seconds to wait before the first retry
+        max_backoff (float): The longest wait between attempts
+        jitter (bool): Randomise the delays; False waits the full delay
+        attempt_timeout (float): Seconds to wait for the response to each
+            attempt before it is abandoned and retried; None waits for the
+            call's deadline
+        retry_on (tuple): The exception types which are retried; by
+            default connection errors and timed out attempts
+    """
+    def __init__(self, methods, attempts=3, backoff=0.1, max_backoff=2.0,
+                 jitter=True, attempt_timeout=None,
+                 retry_on=CONNECTION_ERRORS):
+        super().__init__(methods)
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.attempt_timeout = attempt_timeout
+        self.retry_on = tuple(retry_on)
+        self.retries = 0
+
+    def delay(self, attempt, exc):
+        """Return the seconds to wait before sending a call again
+
+        Args:
+            attempt (int): The number of attempts made so far
+            exc (Exception): The error from the last attempt
+
+        Returns:
+            float: The delay or None if the call should not be retried
+        """
+        if attempt >= self.attempts or not isinstance(exc, self.retry_on):
+            return None
+
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+
+class HedgePolicy(_MethodPolicy):
+    """Send a second copy of a call which has not been answered within a
+    percentile of the method's recent latencies and use whichever response
+    arrives first
+
+    The copy is sent to another host when the client has several.
+    Otherwise a tcp, unix or ws client sends it on a different connection,
+    so ``tcp_connections`` must be more than 1.
+
+    Args:
+        methods (list of str): Method names or globs e.g. ['*.Get*']
+        percentile (float): The percentile of the recent latencies to wait
+            for before hedging e.g. 95
+        delay (float): Seconds to wait before hedging until ``min_samples``
+            latencies have been recorded for a method
+        samples (int): The number of recent latencies kept for each method
+        min_samples (int): The number of latencies needed before the
+            percentile is used
+    """
+    def __init__(self, methods, percentile=95, delay=0.1, samples=100,
+                 min_samples=20):
+        super().__init__(methods)
+        self.percentile = percentile
+        self.initial_delay = delay
+        self.min_samples = min_samples
+        self.hedged = 0
+        self.won = 0
+
+        self._latencies = collections.defaultdict(
+            lambda: collections.deque(maxlen=samples))
+
+    def delay(self, method):
+        """Return the seconds to wait for a response before hedging"""
+        latencies = self._latencies.get(method, ())
+        if len(latencies) < self.min_samples:
+            return self.initial_delay
+
+        latencies = sorted(latencies)
+        idx = int(round((len(latencies) - 1) * self.percentile / 100))
+        return latencies[idx]
+
+    def record(self, method, elapsed, hedge_won=False):
+        """Record the latency of an answered call"""
+        self._latencies[method].append(elapsed)
+        if hedge_won:
+            self.won += 1
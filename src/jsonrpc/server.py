@@ -0,0 +1,538 @@
+# Copyright 2017 Simon Kennedy <sffjunkie+code@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import inspect
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+
+from aiohttp import web
+
+from jsonrpc import RPCError, buffer
+from jsonrpc.codec import get_codec
+from jsonrpc.compression import (RPCDecompressionError, RPCSizeLimitError,
+                                 compress, decompress, choose_encoding)
+from jsonrpc.message import (RPCResponse, RPCBatch, RPCRequestError,
+                             PARSE_ERROR, INVALID_REQUEST, METHOD_NOT_FOUND,
+                             INVALID_PARAMS, INTERNAL_ERROR)
+
+__all__ = ['RPCServer', 'PARSE_ERROR', 'INVALID_REQUEST', 'METHOD_NOT_FOUND',
+           'INVALID_PARAMS', 'INTERNAL_ERROR']
+
+
+class RPCServer():
+    """An asyncio JSON RPC server.
+
+    Methods are registered by name (e.g. 'Player.GetItem') and requests
+    are served over TCP, Unix domain sockets, HTTP, WebSockets or any
+    combination from the same registry.
+
+    Args:
+        codec (str): The JSON codec used to encode and decode messages;
+            see :func:`~jsonrpc.codec.get_codec`
+        thread_workers (int): The number of threads used to run methods
+            registered with ``execution='thread'``; None uses the
+            :class:`~concurrent.futures.ThreadPoolExecutor` default
+        process_workers (int): The number of processes used to run methods
+            registered with ``execution='process'``; None uses one per CPU
+    """
+    def __init__(self, codec='json', thread_workers=None, process_workers=None):
+        self.codec = get_codec(codec)
+        self.thread_workers = thread_workers
+        self.process_workers = process_workers
+
+        self._methods = {}
+        self._executors = {}
+        self._tcp_servers = []
+        self._http_runners = []
+        self._websockets = set()
+
+    def register(self, name, handler=None, execution='inline',
+                 concurrency=None):
+        """Register a handler for a method.
+
+        The handler may be a function or a coroutine function. Its signature
+        is inspected once here so that parameters can be bound to it without
+        further introspection on each call. Can also be used as a decorator
+        e.g. ``@server.register('Player.GetItem')``
+
+        Args:
+            name (str): The full method name including the namespace
+            handler (callable): The function to call
+            execution (str): Where the handler runs; 'inline' (default) on
+                the event loop, 'thread' in the server's thread pool for
+                blocking functions or 'process' in the server's process
+                pool for CPU bound functions. Process handlers, their
+                parameters and results must be picklable.
+            concurrency (int): The maximum number of calls to the method
+                which may run at once; None for no limit
+        """
+        if handler is None:
+            def decorator(handler):
+                self.register(name, handler, execution, concurrency)
+                return handler
+            return decorator
+
+        self._methods[name] = _Method(name, handler, execution, concurrency)
+        return handler
+
+    def add_namespace(self, namespace, obj, execution='inline',
+                      concurrency=None):
+        """Register each public callable attribute of an object as
+        ``namespace.attribute``
+
+        Args:
+            namespace (str): The namespace to register the methods under
+            obj (object): The object whose methods to register
+            execution (str): Where the handlers run; see :meth:`register`
+            concurrency (int): The limit on concurrent calls to each method
+        """
+        for attr in dir(obj):
+            if attr.startswith('_'):
+                continue
+
+            handler = getattr(obj, attr)
+            if callable(handler):
+                self.register('{}.{}'.format(namespace, attr), handler,
+                              execution, concurrency)
+
+    async def start_tcp(self, host='127.0.0.1', port=9090, framing='json'):
+        """Start serving requests over TCP
+
+        Args:
+            framing (str): How messages are delimited; see
+                :func:`~jsonrpc.buffer.get_framing`
+
+        Returns:
+            :class:`asyncio.Server`: The listening server
+        """
+        framing = buffer.get_framing(framing)
+        loop = asyncio.get_event_loop()
+        server = await loop.create_server(lambda: _ServerTCPProtocol(self,
+                                                                     framing),
+                                          host, port)
+        self._tcp_servers.append(server)
+        return server
+
+    async def start_unix(self, path, framing='json'):
+        """Start serving requests over a Unix domain socket
+
+        Args:
+            path (str): The path of the socket to create
+            framing (str): How messages are delimited; see
+                :func:`~jsonrpc.buffer.get_framing`
+
+        Returns:
+            :class:`asyncio.Server`: The listening server
+        """
+        framing = buffer.get_framing(framing)
+        loop = asyncio.get_event_loop()
+        server = await loop.create_unix_server(lambda: _ServerTCPProtocol(self,
+                                                                          framing),
+                                               path)
+        self._tcp_servers.append(server)
+        return server
+
+    async def start_http(self, host='127.0.0.1', port=8080, path='/jsonrpc',
+                         compression_threshold=None,
+                         max_request_size=1024 ** 2):
+        """Start serving requests POSTed to a path over HTTP
+
+        Request bodies compressed with any of the encodings in
+        :mod:`jsonrpc.compression` are accepted.
+
+        Args:
+            compression_threshold (int): Responses of at least this many
+                bytes are compressed with the best encoding the client
+                accepts. None (default) never compresses responses.
+            max_request_size (int): The largest request body accepted in
+                bytes, both as sent and once decompressed. Larger requests
+                are answered with status 413.
+
+        Returns:
+            :class:`aiohttp.web.AppRunner`: The runner for the application
+        """
+        app = web.Application(client_max_size=max_request_size)
+        app.router.add_post(path, partial(self._http_handler,
+                                          compression_threshold,
+                                          max_request_size))
+        return await self._start_app(app, host, port, auto_decompress=False)
+
+    async def start_ws(self, host='127.0.0.1', port=9090, path='/jsonrpc',
+                       heartbeat=None):
+        """Start serving requests sent over WebSockets connected to a path
+
+        Each message received is answered with a message holding the
+        response. Requests are processed concurrently so responses may be
+        sent in a different order to the requests.
+
+        Args:
+            heartbeat (float): Seconds between pings sent to each client;
+                None to not send pings
+
+        Returns:
+            :class:`aiohttp.web.AppRunner`: The runner for the application
+        """
+        app = web.Application()
+        app.router.add_get(path, partial(self._ws_handler, heartbeat))
+        return await self._start_app(app, host, port)
+
+    async def _start_app(self, app, host, port, **kwargs):
+        runner = web.AppRunner(app, **kwargs)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+
+        self._http_runners.append(runner)
+        return runner
+
+    async def close(self):
+        """Stop serving requests"""
+        for server in self._tcp_servers:
+            server.close()
+            await server.wait_closed()
+
+        for ws in list(self._websockets):
+            await ws.close()
+
+        for runner in self._http_runners:
+            await runner.cleanup()
+
+        self._tcp_servers = []
+        self._http_runners = []
+
+        loop = asyncio.get_event_loop()
+        for executor in self._executors.values():
+            await loop.run_in_executor(None, executor.shutdown)
+        self._executors = {}
+
+    async def dispatch(self, data):
+        """Process a request or batch of requests received from a client.
+
+        Args:
+            data (bytes): The encoded request
+
+        Returns:
+            None: No response should be sent
+            bytes: The encoded response
+        """
+        try:
+            message = self.codec.decode(data)
+        except ValueError:
+            return self._error(None, '2.0', PARSE_ERROR,
+                               'Parse error').marshal(self.codec)
+
+        if isinstance(message, list):
+            if not message:
+                return self._error(None, '2.0', INVALID_REQUEST,
+                                   'Invalid Request').marshal(self.codec)
+
+            if len(message) == 1:
+                responses = [await self._handle(message[0])]
+            else:
+                responses = await asyncio.gather(*[self._handle(item)
+                                                   for item in message])
+
+            responses = [r for r in responses if r is not None]
+            if not responses:
+                return None
+
+            return RPCBatch(responses).marshal(self.codec)
+
+        response = await self._handle(message)
+        if response is None:
+            return None
+
+        return response.marshal(self.codec)
+
+    async def _handle(self, message):
+        """Call the method for a single decoded request
+
+        Returns:
+            None: For a notification
+            :class:`RPCResponse`: The result or error
+        """
+        if not isinstance(message, dict):
+            return self._error(None, '2.0', INVALID_REQUEST, 'Invalid Request')
+
+        version = message.get('jsonrpc', None) or message.get('version', '1.0')
+        uid = message.get('id', None)
+        if version == '2.0':
+            notification = 'id' not in message
+        else:
+            notification = uid is None
+
+        name = message.get('method', None)
+        if not isinstance(name, str):
+            return self._error(uid, version, INVALID_REQUEST, 'Invalid Request')
+
+        method = self._methods.get(name, None)
+        try:
+            if method is None:
+                raise RPCRequestError('Method not found', METHOD_NOT_FOUND, name)
+
+            args, kwargs = method.bind(message.get('params', None))
+            if method.execution == 'inline' and method.semaphore is None:
+                result = method.handler(*args, **kwargs)
+                if method.awaitable:
+                    result = await result
+            else:
+                result = await self._run(method, args, kwargs)
+        except RPCRequestError as exc:
+            if notification:
+                return None
+            return self._error(uid, version, exc.code or INTERNAL_ERROR,
+                               exc.message, exc.data)
+        except Exception as exc:
+            if notification:
+                return None
+            return self._error(uid, version, INTERNAL_ERROR, 'Internal error',
+                               str(exc))
+
+        if notification:
+            return None
+
+        response = RPCResponse(uid, version)
+        response.result = result
+        return response
+
+    async def _run(self, method, args, kwargs):
+        """Call a method which has a concurrency limit or runs in an
+        executor"""
+        if method.semaphore is None:
+            return await self._execute(method, args, kwargs)
+
+        async with method.semaphore:
+            return await self._execute(method, args, kwargs)
+
+    async def _execute(self, method, args, kwargs):
+        if method.execution == 'inline':
+            result = method.handler(*args, **kwargs)
+            if method.awaitable:
+                result = await result
+            return result
+
+        executor = self._executor(method.execution)
+        call = partial(method.handler, *args, **kwargs)
+        return await asyncio.get_event_loop().run_in_executor(executor, call)
+
+    def _executor(self, execution):
+        executor = self._executors.get(execution, None)
+        if executor is None:
+            if execution == 'thread':
+                executor = ThreadPoolExecutor(self.thread_workers)
+            else:
+                executor = ProcessPoolExecutor(self.process_workers)
+            self._executors[execution] = executor
+
+        return executor
+
+    def _error(self, uid, version, code, message, data=None):
+        response = RPCResponse(uid, version)
+        response.error = {'code': code, 'message': message}
+        if data is not None:
+            response.error['data'] = data
+        return response
+
+    async def _http_handler(self, compression_threshold, max_request_size,
+                            request):
+        body = await request.read()
+
+        encoding = request.headers.get('Content-Encoding', 'identity')
+        if encoding != 'identity':
+            try:
+                body = decompress(body, encoding, max_request_size)
+            except RPCSizeLimitError as exc:
+                return web.Response(status=413, text=str(exc))
+            except RPCDecompressionError as exc:
+                return web.Response(status=400, text=str(exc))
+            except RPCError as exc:
+                return web.Response(status=415, text=str(exc))
+
+        reply = await self.dispatch(body)
+        if reply is None:
+            return web.Response(status=204)
+
+        headers = None
+        if compression_threshold is not None and \
+           len(reply) >= compression_threshold:
+            encoding = choose_encoding(request.headers.get('Accept-Encoding', ''))
+            if encoding is not None:
+                reply = compress(reply, encoding)
+                headers = {'Content-Encoding': encoding,
+                           'Vary': 'Accept-Encoding'}
+
+        return web.Response(body=reply, content_type='application/json',
+                            headers=headers)
+
+    async def _ws_handler(self, heartbeat, request):
+        ws = web.WebSocketResponse(heartbeat=heartbeat, max_msg_size=0)
+        await ws.prepare(request)
+
+        self._websockets.add(ws)
+        tasks = set()
+        try:
+            async for msg in ws:
+                if msg.type == web.WSMsgType.TEXT:
+                    data = msg.data.encode('UTF-8')
+                elif msg.type == web.WSMsgType.BINARY:
+                    data = msg.data
+                else:
+                    continue
+
+                task = asyncio.ensure_future(self._ws_respond(ws, data))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            self._websockets.discard(ws)
+            for task in tasks:
+                task.cancel()
+
+        return ws
+
+    async def _ws_respond(self, ws, data):
+        reply = await self.dispatch(data)
+        if reply is not None and not ws.closed:
+            await ws.send_str(reply.decode('UTF-8'))
+
+
+class _Method(object):
+    """A registered method with its parameter binding prepared in advance"""
+
+    __slots__ = ('name', 'handler', 'awaitable', 'execution', 'semaphore',
+                 'max_positional', 'required', 'names', 'var_positional',
+                 'var_keyword')
+
+    def __init__(self, name, handler, execution='inline', concurrency=None):
+        self.name = name
+        self.handler = handler
+        self.awaitable = _is_coroutine_function(handler)
+
+        if execution not in ('inline', 'thread', 'process'):
+            raise RPCError('Unrecognised execution %s specified' % execution)
+
+        if self.awaitable and execution != 'inline':
+            raise RPCError('Coroutine function %s must be run inline' % name)
+
+        self.execution = execution
+
+        self.semaphore = None
+        if concurrency is not None:
+            self.semaphore = asyncio.Semaphore(concurrency)
+
+        positional = []
+        required = set()
+        names = set()
+        self.var_positional = False
+        self.var_keyword = False
+
+        for param in inspect.signature(handler).parameters.values():
+            if param.kind == param.VAR_POSITIONAL:
+                self.var_positional = True
+            elif param.kind == param.VAR_KEYWORD:
+                self.var_keyword = True
+            else:
+                if param.kind != param.KEYWORD_ONLY:
+                    positional.append(param.name)
+                if param.kind != param.POSITIONAL_ONLY:
+                    names.add(param.name)
+                if param.default is param.empty:
+                    required.add(param.name)
+
+        self.max_positional = len(positional)
+        self.names = frozenset(names)
+
+        # The required parameters which are still missing once the first
+        # n positional parameters have been supplied
+        self.required = tuple(frozenset(required.difference(positional[:n]))
+                              for n in range(len(positional) + 1))
+
+    def bind(self, params):
+        """Return the positional and keyword arguments for the handler from
+        the request parameters"""
+        if params is None:
+            args, kwargs = (), {}
+        elif isinstance(params, list):
+            args, kwargs = params, {}
+        elif isinstance(params, dict):
+            args, kwargs = (), params
+        else:
+            args, kwargs = [params], {}
+
+        self._check(args, kwargs)
+        return args, kwargs
+
+    def _check(self, args, kwargs):
+        count = len(args)
+        if count > self.max_positional:
+            if not self.var_positional:
+                raise RPCRequestError('Invalid params', INVALID_PARAMS,
+                                      'Too many positional parameters')
+            count = self.max_positional
+
+        missing = self.required[count]
+        if kwargs:
+            if not self.var_keyword:
+                unknown = kwargs.keys() - self.names
+                if unknown:
+                    raise RPCRequestError('Invalid params', INVALID_PARAMS,
+                                          'Unknown parameters %s' % \
+                                          ', '.join(sorted(unknown)))
+            missing = missing - kwargs.keys()
+
+        if missing:
+            raise RPCRequestError('Invalid params', INVALID_PARAMS,
+                                  'Missing parameters %s' % \
+                                  ', '.join(sorted(missing)))
+
+
+def _is_coroutine_function(handler):
+    while hasattr(handler, 'func'):
+        # functools.partial
+        handler = handler.func
+    return asyncio.iscoroutinefunction(handler)
+
+
+class _ServerTCPProtocol(asyncio.Protocol):
+    """Serve JSONRPC messages received on a TCP _transport"""
+
+    def __init__(self, server, framing=buffer.JSONBuffer):
+        self._server = server
+        self._framing = framing
+        self._transport = None
+        self._tasks = set()
+
+    def connection_made(self, transport):
+        self._buffer = self._framing(result_handler=self._message_received,
+                                     encoding=None)
+        self._transport = transport
+
+    def connection_lost(self, exc):
+        for task in self._tasks:
+            task.cancel()
+
+    def data_received(self, data):
+        self._buffer.append(data)
+
+    def _message_received(self, data):
+        del self._buffer.messsages[:]
+
+        task = asyncio.ensure_future(self._respond(data))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _respond(self, data):
+        reply = await self._server.dispatch(data)
+        if reply is not None and not self._transport.is_closing():
+            self._transport.write(self._buffer.frame(reply))
@@ -0,0 +1,357 @@
+# Copyright 2017 Simon Kennedy <sffjunkie+code@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Incremental decoding of large results.
+
+The elements of an array within a result are decoded one at a time as the
+response arrives, so only the elements not yet consumed are held in memory
+rather than the whole response.
+"""
+
+import asyncio
+import json
+import re
+
+from jsonrpc.codec import get_codec
+from jsonrpc.message import RPCResponse, RPCMessageError
+
+__all__ = ['JSONArrayParser', 'ResultStream']
+
+# A single token of the response outside of the streamed array
+_TOKEN = re.compile(rb'''
+    \s*
+    (?:
+        ("[^"\\]*(?:\\.[^"\\]*)*")
+      | ([{}\[\]:,])
+      | ([^\s{}\[\]:,"]+)
+    )
+''', re.DOTALL | re.VERBOSE)
+# The opening quote of a string which has not been received in full
+_OPEN_STRING = re.compile(rb'\s*"')
+# The rest of a string up to its closing quote, the end of the data or a
+# backslash at the end of the data
+_STRING_BODY = re.compile(rb'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)
+
+# Skips complete strings and other bytes up to the next bracket, comma or
+# the opening quote of an unterminated string
+_ELEMENT = re.compile(rb'''
+    [^"{}\[\],]*
+    (?:"[^"\\]*(?:\\.[^"\\]*)*"[^"{}\[\],]*)*
+    [{}\[\],"]
+''', re.DOTALL | re.VERBOSE)
+
+
+class JSONArrayParser(object):
+    """Decode the elements of an array within a JSON RPC response as the
+    data for the response is received.
+
+    Messages which arrive before the response, such as notifications, are
+    skipped. If the response is an error then :class:`~jsonrpc.message.RPCRequestError`
+    is raised.
+
+    Args:
+        path (str): The dotted path to the array within the result, e.g.
+            'artists' for ``result.artists``. An empty path streams the
+            result itself.
+        codec (str): The JSON codec used to decode each element
+    """
+    def __init__(self, path='', codec=None):
+        self.path = ['result']
+        if path:
+            self.path.extend(path.split('.'))
+
+        self.finished = False
+
+        self._codec = get_codec(codec)
+        self._data = bytearray()
+        self._pos = 0
+        # One entry per open container before the array;
+        # [is object, current key, expecting a key]
+        self._stack = []
+        self._in_array = False
+        self._depth = 0
+        self._start = 0
+        # A string which continues in the next data received is scanned
+        # from where the last data ended rather than from its start
+        self._in_string = False
+        self._string_start = 0
+
+    def feed(self, data):
+        """Add data received for the response
+
+        Returns:
+            list: The elements completed by the data
+        """
+        self._data += data
+        items = []
+
+        while not self.finished:
+            if self._in_array:
+                if not self._scan_array(items):
+                    break
+            elif not self._scan_response():
+                break
+
+        self._compact()
+        return items
+
+    def _scan_response(self):
+        """Scan the response up to the start of the array
+
+        Returns:
+            bool: True if the array has been found
+        """
+        buf = self._data
+        stack = self._stack
+
+        while True:
+            if self._in_string:
+                if not self._skip_string():
+                    return False
+                string = buf[self._string_start:self._pos]
+                punctuation = None
+
+            else:
+                match = _TOKEN.match(buf, self._pos)
+                if match is None:
+                    match = _OPEN_STRING.match(buf, self._pos)
+                    if match is None:
+                        return False
+
+                    self._string_start = match.end() - 1
+                    self._pos = match.end()
+                    self._in_string = True
+                    continue
+
+                string, punctuation, literal = match.groups()
+                if literal is not None and match.end() == len(buf):
+                    # The literal may continue in the next data received
+                    return False
+
+                self._pos = match.end()
+
+            if punctuation == b'{' or punctuation == b'[':
+                if punctuation == b'[' and self._at_path():
+                    self._in_array = True
+                    self._depth = 0
+                    self._start = self._pos
+                    return True
+
+                if not stack:
+                    self._start = match.start(2)
+                stack.append([punctuation == b'{', None, True])
+
+            elif punctuation == b'}' or punctuation == b']':
+                if stack:
+                    stack.pop()
+                    if not stack:
+                        self._message_complete(buf[self._start:self._pos])
+
+            elif punctuation == b':':
+                if stack:
+                    stack[-1][2] = False
+
+            elif punctuation == b',':
+                if stack and stack[-1][0]:
+                    stack[-1][1] = None
+                    stack[-1][2] = True
+
+            elif string is not None:
+                if stack and stack[-1][0] and stack[-1][2]:
+                    stack[-1][1] = json.loads(bytes(string).decode('UTF-8'))
+
+    def _skip_string(self):
+        """Move past the rest of a string, starting from the last byte
+        checked
+
+        Returns:
+            bool: True if the end of the string has been reached
+        """
+        buf = self._data
+        pos = _STRING_BODY.match(buf, self._pos).end()
+        if pos == len(buf) or buf[pos] != 0x22:  # double quote
+            # Wait for the rest of the string or the escaped character
+            self._pos = pos
+            return False
+
+        self._pos = pos + 1
+        self._in_string = False
+        return True
+
+    def _at_path(self):
+        stack = self._stack
+        if len(stack) != len(self.path):
+            return False
+
+        for (is_object, key, expecting_key), name in zip(stack, self.path):
+            if not is_object or expecting_key or key != name:
+                return False
+
+        return True
+
+    def _message_complete(self, data):
+        """Handle a message which finished without the array being found"""
+        message = json.loads(bytes(data).decode('UTF-8'))
+
+        if isinstance(message, dict) and 'method' in message:
+            # A notification received before the response
+            self._start = self._pos
+            return
+
+        # Raises RPCRequestError for an error response
+        response = RPCResponse()
+        response._load(message)
+
+        raise RPCMessageError('No array found at %s in response' % \
+                              '.'.join(self.path))
+
+    def _scan_array(self, items):
+        """Scan the elements of the array
+
+        Returns:
+            bool: True if the end of the array has been reached
+        """
+        buf = self._data
+
+        while True:
+            if self._in_string and not self._skip_string():
+                return False
+
+            match = _ELEMENT.match(buf, self._pos)
+            if match is None:
+                return False
+
+            end = match.end()
+            ch = buf[end - 1]
+            if ch == 0x22:  # double quote
+                # The string has not been received in full
+                self._pos = end
+                self._in_string = True
+                continue
+
+            self._pos = end
+            if ch == 0x7b or ch == 0x5b:  # { or [
+                self._depth += 1
+            elif ch == 0x7d or ch == 0x5d:  # } or ]
+                if self._depth == 0:
+                    self._element_complete(items, end - 1)
+                    self.finished = True
+                    return True
+                self._depth -= 1
+            elif self._depth == 0:  # comma between elements
+                self._element_complete(items, end - 1)
+                self._start = end
+
+    def _element_complete(self, items, end):
+        element = bytes(self._data[self._start:end]).strip()
+        if element:
+            items.append(self._codec.decode(element))
+
+    def _compact(self):
+        if self._in_array or self._stack:
+            start = self._start
+        else:
+            start = self._pos
+
+        if start:
+            del self._data[:start]
+            self._pos -= start
+            self._start -= start
+            self._string_start -= start
+
+
+class _Failure(object):
+    __slots__ = ('exc',)
+
+    def __init__(self, exc):
+        self.exc = exc
+
+
+_END = object()
+
+
+class ResultStream(object):
+    """An async iterator over the elements of an array in a result
+
+    Elements are yielded while the response is still being received. At
+    most ``window`` decoded elements are held waiting for the consumer;
+    reading stops while the window is full.
+
+    Args:
+        source (coroutine function): Called with a coroutine function which
+            is passed each piece of data received and returns True once the
+            array is complete.
+        path (str): The dotted path to the array within the result
+        codec (str): The JSON codec used to decode each element
+        window (int): The maximum number of decoded elements to hold
+    """
+    def __init__(self, source, path='', codec=None, window=100):
+        self._source = source
+        self._parser = JSONArrayParser(path, codec)
+        self._queue = asyncio.Queue(window)
+        self._task = None
+        self._done = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._done:
+            raise StopAsyncIteration
+
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+        item = await self._queue.get()
+        if item is _END:
+            self._done = True
+            raise StopAsyncIteration
+
+        if isinstance(item, _Failure):
+            self._done = True
+            raise item.exc
+
+        return item
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def aclose(self):
+        """Stop receiving the response"""
+        self._done = True
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        try:
+            await self._source(self._feed)
+            if not self._parser.finished:
+                raise RPCMessageError('Response ended before the result was complete')
+        except Exception as exc:
+            await self._queue.put(_Failure(exc))
+        else:
+            await self._queue.put(_END)
+
+    async def _feed(self, data):
+        for item in self._parser.feed(data):
+            await self._queue.put(item)
+
+        return self._parser.finished
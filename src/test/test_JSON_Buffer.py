@@ -5,9 +5,11 @@ import os.path
 p = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.insert(0, p)
 
+import pytest
 from unittest import mock
 
-from jsonrpc.buffer import JSONBuffer
+from jsonrpc import RPCError
+from jsonrpc.buffer import JSONBuffer, LineBuffer, LengthPrefixBuffer, get_framing
 
 def test_JSONBuffer_CompleteMessage():
     h = mock.MagicMock()
@@ -46,3 +48,88 @@ def test_JSONBuffer_2PartialMessages():
     b.append(b'ult6": "1"}{"')
     b.append(b'result7": "\'1"}')
     assert h.call_count == 2
+
+
+def test_JSONBuffer_EscapedQuote():
+    h = mock.MagicMock()
+    b = JSONBuffer(result_handler=h)
+    b.append(b'{"result8": "a \\"}\\" b"}')
+    assert h.call_count == 1
+    assert b.messsages[0] == '{"result8": "a \\"}\\" b"}'
+
+
+def test_JSONBuffer_EscapedBackslash():
+    h = mock.MagicMock()
+    b = JSONBuffer(result_handler=h)
+    b.append(b'{"result9": "c:\\\\"}{"result10": "}"}')
+    assert h.call_count == 2
+
+
+def test_JSONBuffer_EscapeSplit():
+    h = mock.MagicMock()
+    b = JSONBuffer(result_handler=h)
+    b.append(b'{"result11": "\\')
+    b.append(b'"}"}')
+    assert h.call_count == 1
+    assert b.messsages[0] == '{"result11": "\\"}"}'
+
+
+def test_JSONBuffer_Array():
+    h = mock.MagicMock()
+    b = JSONBuffer(result_handler=h)
+    b.append(b'[{"result12": "1"}, {"result13": "]"}]{"result14": [1]}')
+    assert h.call_count == 2
+    assert b.messsages[0].startswith('[')
+
+
+def test_JSONBuffer_SplitCharacter():
+    h = mock.MagicMock()
+    b = JSONBuffer(result_handler=h)
+    data = '{"result15": "\u00e9"}'.encode('UTF-8')
+    b.append(data[:-3])
+    b.append(data[-3:])
+    assert b.messsages[0] == '{"result15": "\u00e9"}'
+
+
+def test_JSONBuffer_ByteAtATime():
+    h = mock.MagicMock()
+    b = JSONBuffer(result_handler=h)
+    data = b'{"result16": {"a": [1, "}"]}}\r\n' * 3
+    for idx in range(len(data)):
+        b.append(data[idx:idx + 1])
+    assert h.call_count == 3
+
+
+def test_JSONBuffer_Bytes():
+    h = mock.MagicMock()
+    b = JSONBuffer(result_handler=h, encoding=None)
+    b.append(b'{"result17": "1"}')
+    h.assert_called_once_with(b'{"result17": "1"}')
+
+
+def test_LineBuffer_Messages():
+    h = mock.MagicMock()
+    b = LineBuffer(result_handler=h)
+    b.append(b'{"result18": "}\\n"}\n\n[{"res')
+    b.append(b'ult19": 1}]\r\n{')
+    assert b.messsages == ['{"result18": "}\\n"}', '[{"result19": 1}]']
+    assert LineBuffer.frame(b'{}') == b'{}\n'
+
+
+def test_LengthPrefixBuffer_Messages():
+    h = mock.MagicMock()
+    b = LengthPrefixBuffer(result_handler=h, encoding=None)
+    data = LengthPrefixBuffer.frame(b'{"result20": "}"}') + \
+        LengthPrefixBuffer.frame(b'[1, 2]')
+    assert data[:4] == b'\x00\x00\x00\x11'
+    for idx in range(len(data)):
+        b.append(data[idx:idx + 1])
+    assert b.messsages == [b'{"result20": "}"}', b'[1, 2]']
+
+
+def test_Framing():
+    assert get_framing('json') is JSONBuffer
+    assert get_framing('line') is LineBuffer
+    assert get_framing('length') is LengthPrefixBuffer
+    with pytest.raises(RPCError):
+        get_framing('netstring')
@@ -0,0 +1,141 @@
+# Copyright (c) 2017 Simon Kennedy <sffjunkie+code@gmail.com>
+
+import sys
+import os.path
+p = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, p)
+
+import asyncio
+from unittest import mock
+
+from jsonrpc.cache import RPCCache
+from jsonrpc.client import RPCClient
+from jsonrpc.server import RPCServer
+
+
+def async_test(f):
+    def wrapper(*args, **kwargs):
+        asyncio.run(f(*args, **kwargs))
+    return wrapper
+
+
+def test_Cache_Uncached():
+    cache = RPCCache()
+    cache.store('Player.GetItem', None, 'a')
+    assert cache.lookup('Player.GetItem', None) == (False, None)
+    assert cache.stats()['misses'] == 0
+
+
+def test_Cache_CanonicalParams():
+    cache = RPCCache()
+    cache.add('AudioLibrary.Get*')
+    cache.store('AudioLibrary.GetArtists', {'a': 1, 'b': [1, 2]}, 'artists')
+    assert cache.lookup('AudioLibrary.GetArtists', {'b': [1, 2], 'a': 1}) == \
+        (True, 'artists')
+    assert cache.lookup('AudioLibrary.GetArtists', {'a': 2, 'b': [1, 2]}) == \
+        (False, None)
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_Cache_TTL():
+    cache = RPCCache()
+    cache.add('JSONRPC.Introspect', ttl=10)
+    with mock.patch('time.monotonic', return_value=100):
+        cache.store('JSONRPC.Introspect', None, 'api')
+    with mock.patch('time.monotonic', return_value=109):
+        assert cache.lookup('JSONRPC.Introspect', None) == (True, 'api')
+    with mock.patch('time.monotonic', return_value=111):
+        assert cache.lookup('JSONRPC.Introspect', None) == (False, None)
+    assert cache.stats()['entries'] == 0
+
+
+def test_Cache_MaxEntries():
+    cache = RPCCache()
+    cache.add('AudioLibrary.*', max_entries=2)
+    cache.store('AudioLibrary.GetArtists', None, 'artists')
+    cache.store('AudioLibrary.GetAlbums', None, 'albums')
+    cache.lookup('AudioLibrary.GetArtists', None)
+    cache.store('AudioLibrary.GetSongs', None, 'songs')
+    assert cache.lookup('AudioLibrary.GetAlbums', None)[0] is False
+    assert cache.lookup('AudioLibrary.GetArtists', None)[0] is True
+    assert cache.lookup('AudioLibrary.GetSongs', None)[0] is True
+
+
+def test_Cache_MaxBytes():
+    cache = RPCCache()
+    cache.add('AudioLibrary.*', max_bytes=20)
+    cache.store('AudioLibrary.GetArtists', None, 'a' * 8)
+    cache.store('AudioLibrary.GetAlbums', None, 'b' * 8)
+    assert cache.stats()['bytes'] == 20
+    cache.store('AudioLibrary.GetSongs', None, 'c' * 8)
+    assert cache.stats()['bytes'] == 20
+    assert cache.lookup('AudioLibrary.GetArtists', None)[0] is False
+    cache.store('AudioLibrary.GetGenres', None, 'd' * 30)
+    assert cache.lookup('AudioLibrary.GetGenres', None)[0] is False
+
+
+def test_Cache_Invalidate():
+    cache = RPCCache()
+    cache.add('*')
+    cache.store('AudioLibrary.GetArtists', [1], 'a')
+    cache.store('AudioLibrary.GetArtists', [2], 'b')
+    cache.store('VideoLibrary.GetMovies', None, 'c')
+    cache.invalidate('AudioLibrary.GetArtists', [1])
+    assert cache.stats()['entries'] == 2
+    cache.invalidate('AudioLibrary.*')
+    assert cache.stats()['entries'] == 1
+    cache.invalidate()
+    assert cache.stats()['entries'] == 0
+
+
+def test_Cache_Notification():
+    cache = RPCCache()
+    cache.add('AudioLibrary.*', invalidated_by=['AudioLibrary.On*'])
+    cache.add('VideoLibrary.*', invalidated_by=['VideoLibrary.OnUpdate'])
+    cache.store('AudioLibrary.GetArtists', None, 'a')
+    cache.store('VideoLibrary.GetMovies', None, 'b')
+    cache.notification('AudioLibrary.OnRemove')
+    assert cache.lookup('AudioLibrary.GetArtists', None)[0] is False
+    assert cache.lookup('VideoLibrary.GetMovies', None)[0] is True
+
+
+@async_test
+async def test_Cache_Client():
+    calls = []
+    server = RPCServer()
+    server.register('AudioLibrary.GetArtists',
+                    lambda limit: calls.append(limit) or ['artist'] * limit)
+    runner = await server.start_http('127.0.0.1', 0)
+    port = runner.addresses[0][1]
+
+    cache = RPCCache()
+    cache.add('AudioLibrary.GetArtists', ttl=60)
+    async with RPCClient('127.0.0.1', port, cache=cache) as conn:
+        for _idx in range(3):
+            assert await conn.AudioLibrary.GetArtists(limit=2) == ['artist'] * 2
+        await conn.AudioLibrary.GetArtists(limit=1)
+    assert calls == [2, 1]
+    assert cache.stats()['hits'] == 2
+
+    await server.close()
+
+
+@async_test
+async def test_Cache_ClientNotification():
+    async def clean(reader, writer):
+        await reader.read(65536)
+        writer.write(b'{"jsonrpc": "2.0", "method": "AudioLibrary.OnCleanFinished"}'
+                     b'{"jsonrpc": "2.0", "id": 1, "result": "OK"}')
+
+    tcp = await asyncio.start_server(clean, '127.0.0.1', 0)
+    port = tcp.sockets[0].getsockname()[1]
+
+    cache = RPCCache()
+    cache.add('AudioLibrary.Get*', invalidated_by=['AudioLibrary.On*'])
+    cache.store('AudioLibrary.GetArtists', None, 'stale')
+    async with RPCClient('127.0.0.1', port, method='tcp',
+                         cache=cache) as conn:
+        await conn.AudioLibrary.Clean()
+    assert cache.stats()['entries'] == 0
+    tcp.close()
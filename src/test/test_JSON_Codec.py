@@ -0,0 +1,55 @@
+# Copyright (c) 2017 Simon Kennedy <sffjunkie+code@gmail.com>
+
+import sys
+import os.path
+p = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, p)
+
+import pytest
+
+from jsonrpc import RPCError
+from jsonrpc.codec import JSONCodec, get_codec, available_codecs
+from jsonrpc.message import RPCRequest, RPCResponse
+
+
+@pytest.mark.parametrize('name', available_codecs())
+def test_Codec_RoundTrip(name):
+    codec = get_codec(name)
+    data = codec.encode({'label': 'é', 'ids': [1, 2]})
+    assert isinstance(data, bytes)
+    assert codec.decode(data) == {'label': 'é', 'ids': [1, 2]}
+    assert codec.decode(memoryview(data)) == {'label': 'é', 'ids': [1, 2]}
+    assert codec.decode(bytearray(data)) == {'label': 'é', 'ids': [1, 2]}
+
+
+@pytest.mark.parametrize('name', available_codecs())
+def test_Codec_Message(name):
+    command = RPCRequest('VideoLibrary.GetMovies', uid=1, limit=10)
+    data = command.marshal(name)
+
+    received = RPCRequest()
+    received.unmarshal(data, name)
+    assert received.params == {'limit': 10}
+
+    response = RPCResponse()
+    response.unmarshal(b'{"jsonrpc": "2.0", "result": {"a": 1}, "id": 1}', name)
+    assert response.result['a'] == 1
+
+
+def test_Codec_Default():
+    assert isinstance(get_codec(), JSONCodec)
+    assert get_codec().name == 'json'
+
+
+def test_Codec_Auto():
+    assert get_codec('auto').name == available_codecs()[0]
+
+
+def test_Codec_Instance():
+    codec = JSONCodec()
+    assert get_codec(codec) is codec
+
+
+def test_Codec_Unknown():
+    with pytest.raises(RPCError):
+        get_codec('yaml')
@@ -0,0 +1,179 @@
+# Copyright (c) 2017 Simon Kennedy <sffjunkie+code@gmail.com>
+
+import sys
+import os.path
+p = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, p)
+
+import pytest
+import asyncio
+import functools
+import json
+
+import zlib
+
+import aiohttp
+
+from jsonrpc import RPCError
+from jsonrpc.client import RPCClient
+from jsonrpc.compression import (available_encodings, compress, decompress,
+                                 decompressor, choose_encoding,
+                                 RPCDecompressionError, RPCSizeLimitError,
+                                 _ChunkedDecompressor)
+from jsonrpc.message import RPCRequest
+from jsonrpc.metrics import RPCMetrics
+from jsonrpc.server import RPCServer
+
+ARTISTS = [{'artistid': idx, 'artist': 'Artist %d' % idx, 'genre': ['Rock']}
+           for idx in range(2000)]
+
+
+def async_test(f):
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        asyncio.run(f(*args, **kwargs))
+    return wrapper
+
+
+@pytest.mark.parametrize('encoding', available_encodings())
+def test_Compression_RoundTrip(encoding):
+    data = json.dumps(ARTISTS).encode('UTF-8')
+    compressed = compress(data, encoding)
+    assert len(compressed) < len(data) // 4
+    assert decompress(compressed, encoding) == data
+
+    d = decompressor(encoding)
+    pieces = [d.decompress(compressed[idx:idx + 100])
+              for idx in range(0, len(compressed), 100)]
+    assert b''.join(pieces) == data
+
+
+def test_Compression_Errors():
+    assert 'gzip' in available_encodings()
+    assert 'deflate' in available_encodings()
+
+    with pytest.raises(RPCError):
+        compress(b'data', 'lzma')
+    with pytest.raises(RPCError):
+        decompress(b'not compressed', 'gzip')
+    with pytest.raises(RPCError):
+        RPCClient('127.0.0.1', compression='lzma')
+
+
+@pytest.mark.parametrize('encoding', available_encodings())
+def test_Compression_Limit(encoding):
+    data = b'0' * 100000
+    compressed = compress(data, encoding)
+    assert decompress(compressed, encoding, len(data)) == data
+    with pytest.raises(RPCSizeLimitError):
+        decompress(compressed, encoding, len(data) - 1)
+    with pytest.raises(RPCDecompressionError):
+        decompress(b'not compressed', encoding, len(data))
+
+
+def test_Compression_ChunkedLimit():
+    data = b'0' * 100000
+    d = _ChunkedDecompressor(zlib.decompressobj())
+    assert d.decompress(zlib.compress(data), 10) == b'0' * 10
+    d = _ChunkedDecompressor(zlib.decompressobj())
+    assert d.decompress(zlib.compress(data)) == data
+
+
+def test_Compression_ChooseEncoding():
+    assert choose_encoding('') is None
+    assert choose_encoding('identity') is None
+    assert choose_encoding('deflate') == 'deflate'
+    assert choose_encoding('deflate, gzip') == 'gzip'
+    assert choose_encoding('gzip;q=0, deflate;q=0.5') == 'deflate'
+    assert choose_encoding('*') == available_encodings()[0]
+
+
+def make_server():
+    server = RPCServer()
+
+    @server.register('AudioLibrary.GetArtists')
+    def get_artists(limit=None):
+        return {'artists': ARTISTS[:limit]}
+
+    return server
+
+
+@pytest.mark.parametrize('encoding', available_encodings())
+@async_test
+async def test_Compression_Http(encoding):
+    server = make_server()
+    runner = await server.start_http('127.0.0.1', 0, compression_threshold=1024)
+    port = runner.addresses[0][1]
+
+    metrics = RPCMetrics()
+    async with RPCClient('127.0.0.1', port, compression=encoding,
+                         compression_threshold=10, metrics=metrics) as conn:
+        result = await conn.AudioLibrary.GetArtists()
+        assert result == {'artists': ARTISTS}
+        assert metrics.bytes_received < len(json.dumps(ARTISTS)) // 4
+
+        # Below the threshold the response is sent as is
+        assert await conn.AudioLibrary.GetArtists(limit=1) == \
+            {'artists': ARTISTS[:1]}
+
+        request = RPCRequest('AudioLibrary.GetArtists')
+        async with conn.stream(request, 'artists') as artists:
+            received = [artist async for artist in artists]
+        assert received == ARTISTS
+
+    await server.close()
+
+
+@async_test
+async def test_Compression_Negotiation():
+    server = make_server()
+    runner = await server.start_http('127.0.0.1', 0, compression_threshold=1024)
+    url = 'http://127.0.0.1:%d/jsonrpc' % runner.addresses[0][1]
+    body = RPCRequest('AudioLibrary.GetArtists', uid=1).marshal()
+
+    async with aiohttp.ClientSession(auto_decompress=False) as session:
+        async with session.post(url, data=compress(body, 'deflate'),
+                                headers={'Content-Encoding': 'deflate',
+                                         'Accept-Encoding': 'gzip'}) as r:
+            assert r.headers['Content-Encoding'] == 'gzip'
+            data = json.loads(decompress(await r.read(), 'gzip'))
+            assert data['result'] == {'artists': ARTISTS}
+
+        async with session.post(url, data=body,
+                                headers={'Accept-Encoding': 'identity'}) as r:
+            assert 'Content-Encoding' not in r.headers
+            assert json.loads(await r.read())['id'] == 1
+
+        async with session.post(url, data=body,
+                                headers={'Content-Encoding': 'lzma'}) as r:
+            assert r.status == 415
+
+        async with session.post(url, data=b'not compressed',
+                                headers={'Content-Encoding': 'gzip'}) as r:
+            assert r.status == 400
+
+    await server.close()
+
+
+@async_test
+async def test_Compression_RequestLimit():
+    server = make_server()
+    runner = await server.start_http('127.0.0.1', 0, max_request_size=10000)
+    url = 'http://127.0.0.1:%d/jsonrpc' % runner.addresses[0][1]
+    body = RPCRequest('AudioLibrary.GetArtists', uid=1,
+                      padding=' ' * 9000).marshal()
+    padded = RPCRequest('AudioLibrary.GetArtists', uid=1,
+                        padding=' ' * 20000).marshal()
+
+    async with aiohttp.ClientSession() as session:
+        headers = {'Content-Encoding': 'gzip'}
+        async with session.post(url, data=compress(body, 'gzip'),
+                                headers=headers) as r:
+            assert r.status == 200
+        async with session.post(url, data=compress(padded, 'gzip'),
+                                headers=headers) as r:
+            assert r.status == 413
+        async with session.post(url, data=padded) as r:
+            assert r.status == 413
+
+    await server.close()
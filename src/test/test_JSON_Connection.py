@@ -10,32 +10,295 @@ import asyncio
 
 pytest.importorskip('jsonrpc.client')
 
-from jsonrpc.client import RPCClient
-from jsonrpc.message import RPCRequest
+import json
+from unittest import mock
+from aiohttp import web
+
+from jsonrpc import RPCError
+from jsonrpc.buffer import JSONBuffer
+from jsonrpc.client import RPCClient, _TCPProtocol
+from jsonrpc.message import RPCRequest, RPCRequestError, uuid_ids
+from jsonrpc.server import RPCServer
 
 
 def async_test(f):
     def wrapper(*args, **kwargs):
-        coro = asyncio.coroutine(f)
-        future = coro(*args, **kwargs)
-        loop = asyncio.get_event_loop()
-        loop.run_until_complete(future)
+        asyncio.run(f(*args, **kwargs))
     return wrapper
 
 
+async def echo_server(handler):
+    """Start a loopback TCP server which replies to each complete message
+    with the messages returned by ``handler``."""
+
+    async def client_connected(reader, writer):
+        b = JSONBuffer()
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            b.append(data)
+            for message in b.messsages:
+                for reply in handler(json.loads(message)):
+                    writer.write(json.dumps(reply).encode('UTF-8'))
+            del b.messsages[:]
+        writer.close()
+
+    server = await asyncio.start_server(client_connected, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    return server, port
+
+
+async def http_server(handler, peers=None):
+    """Start a loopback HTTP server which replies to each POST with the
+    message returned by ``handler``."""
+
+    async def post(request):
+        if peers is not None:
+            peers.add(request.transport.get_extra_info('peername'))
+        reply = handler(json.loads((await request.read()).decode('UTF-8')))
+        if reply is None:
+            return web.Response(status=204)
+        return web.json_response(reply)
+
+    app = web.Application()
+    app.router.add_post('/jsonrpc', post)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, port
+
+
+def echo_batch(messages):
+    replies = [{'jsonrpc': '2.0', 'id': m['id'], 'result': m.get('params')}
+               for m in messages if 'id' in m and m['method'] != 'Fail.Me']
+    replies.extend({'jsonrpc': '2.0', 'id': m['id'],
+                    'error': {'code': -32601, 'message': 'Method not found'}}
+                   for m in messages if m['method'] == 'Fail.Me')
+    return list(reversed(replies)) or None
+
+
+def batch_requests():
+    return [RPCRequest('Echo.Params', a=1),
+            RPCRequest('GUI.ShowNotification', notification=True),
+            RPCRequest('Fail.Me'),
+            RPCRequest('Echo.Params', b=2)]
+
+
+def check_batch_results(results):
+    assert results[0].result == {'a': 1}
+    assert results[1] is None
+    assert isinstance(results[2], RPCRequestError)
+    assert results[2].code == -32601
+    assert results[3]['b'] == 2
+
+
+def echo(message):
+    if 'id' in message:
+        yield {'jsonrpc': '2.0', 'id': message['id'],
+               'result': message.get('params')}
+
+
+@async_test
+async def test_JSONConnection_Tcp_Loopback():
+    server, port = await echo_server(echo)
+    conn = RPCClient(host='127.0.0.1', port=port, method='tcp')
+    response = await conn.request(RPCRequest('Echo.Params', dave=True))
+    assert response.result == {'dave': True}
+    await conn.close()
+    server.close()
+
+
+@async_test
+async def test_JSONConnection_Tcp_LazyTrailingMembers():
+    # The id follows the result and is itself followed by an object
+    def reply(message):
+        yield {'jsonrpc': '2.0', 'result': message.get('params'),
+               'id': message['id'], 'meta': {'b': 2}}
+
+    server, port = await echo_server(reply)
+    async with RPCClient('127.0.0.1', port, method='tcp',
+                         lazy_results=True) as conn:
+        response = await asyncio.wait_for(conn.Echo.Params(a=1), 2)
+        assert response.uid == 1
+        assert response.result == {'a': 1}
+    server.close()
+
+
+@async_test
+async def test_JSONConnection_Tcp_Ids():
+    server, port = await echo_server(echo)
+    conn = RPCClient(host='127.0.0.1', port=port, method='tcp')
+    first = await conn.Echo.Params(1, 2)
+    second = await conn.Echo.Params()
+    assert first.result == [1, 2]
+    assert (first.uid, second.uid) == (1, 2)
+
+    conn.id_generator = uuid_ids()
+    response = await conn.Echo.Params()
+    assert isinstance(response.uid, str)
+    await conn.close()
+    server.close()
+
+
+@async_test
+async def test_JSONConnection_Tcp_Concurrent():
+    def reverse(message):
+        # Reply in the opposite order to the requests to check each
+        # waiter receives its own response
+        reverse.pending.append(message)
+        if len(reverse.pending) == 50:
+            for m in reversed(reverse.pending):
+                yield {'jsonrpc': '2.0', 'id': m['id'], 'result': m['params']}
+    reverse.pending = []
+
+    server, port = await echo_server(reverse)
+    conn = RPCClient(host='127.0.0.1', port=port, method='tcp')
+    responses = await asyncio.gather(*[conn.Echo.Params(idx=idx)
+                                       for idx in range(50)])
+    assert [r['idx'] for r in responses] == list(range(50))
+    assert conn.pool_stats()['in_flight'] == [0]
+    await conn.close()
+    server.close()
+
+
+@async_test
+async def test_JSONConnection_Tcp_ErrorResponse():
+    def error(message):
+        yield {'jsonrpc': '2.0', 'id': message['id'],
+               'error': {'code': -32601, 'message': 'Method not found'}}
+
+    server, port = await echo_server(error)
+    conn = RPCClient(host='127.0.0.1', port=port, method='tcp')
+    with pytest.raises(RPCRequestError) as exc:
+        await conn.Missing.Method()
+    assert exc.value.code == -32601
+    await conn.close()
+    server.close()
+
+
+@async_test
+async def test_JSONConnection_Tcp_Notification():
+    def notify(message):
+        yield {'jsonrpc': '2.0', 'method': 'Player.OnPlay',
+               'params': {'data': 1}}
+        yield {'jsonrpc': '2.0', 'id': message['id'], 'result': 'OK'}
+
+    received = asyncio.Queue()
+    server, port = await echo_server(notify)
+    conn = RPCClient(host='127.0.0.1', port=port, method='tcp',
+                     notification_handler=received.put)
+    response = await conn.Player.Play()
+    assert response.result == 'OK'
+    notification = await asyncio.wait_for(received.get(), 1)
+    assert notification.method == 'Player.OnPlay'
+    assert notification.params == {'data': 1}
+    await conn.close()
+    server.close()
+
+
+@async_test
+async def test_JSONConnection_Tcp_Subscribe():
+    def notify(message):
+        for idx in range(3):
+            yield {'jsonrpc': '2.0', 'method': 'Player.OnPlay',
+                   'params': {'data': idx}}
+            yield {'jsonrpc': '2.0', 'method': 'Player.OnStop',
+                   'params': {'data': idx}}
+        yield {'jsonrpc': '2.0', 'id': message['id'], 'result': 'OK'}
+
+    started = asyncio.Event()
+    release = asyncio.Event()
+    played = []
+    stopped = []
+    conn = RPCClient(host='127.0.0.1', port=0, method='tcp')
+
+    @conn.subscribe('Player.OnPlay')
+    async def on_play(notification):
+        started.set()
+        await release.wait()
+        played.append(notification.params['data'])
+
+    conn.subscribe('Player.OnS*', lambda n: stopped.append(n.params['data']))
+
+    server, port = await echo_server(notify)
+    conn.port = port
+
+    # A handler which has not finished does not hold up responses
+    response = await conn.Player.Play()
+    assert response.result == 'OK'
+    await asyncio.wait_for(started.wait(), 1)
+    assert played == []
+
+    release.set()
+    for _ in range(10):
+        await asyncio.sleep(0)
+    assert played == [0, 1, 2]
+    assert stopped == [0, 1, 2]
+
+    conn.unsubscribe('Player.OnPlay', on_play)
+    await conn.Player.Play()
+    await asyncio.sleep(0.05)
+    assert played == [0, 1, 2]
+    assert stopped == [0, 1, 2] * 2
+    await conn.close()
+    server.close()
+
+
+@pytest.mark.parametrize('overflow, expected', [
+    ('drop-oldest', [3, 4]),
+    ('drop-newest', [0, 1]),
+    ('block', [0, 1, 2, 3, 4]),
+])
+def test_JSONConnection_NotificationOverflow(overflow, expected):
+    async def run():
+        transport = mock.MagicMock()
+        received = []
+        conn = RPCClient(host='127.0.0.1', method='tcp',
+                         notification_queue_size=2,
+                         notification_overflow=overflow)
+        conn.subscribe('Player.OnPlay', lambda n: received.append(n.params))
+        protocol = _TCPProtocol(notification_callback=conn._notification_received)
+        protocol.connection_made(transport)
+
+        protocol.data_received(b''.join(
+            b'{"jsonrpc": "2.0", "method": "Player.OnPlay", "params": [%d]}' % idx
+            for idx in range(5)))
+        if overflow == 'block':
+            assert transport.pause_reading.call_count == 1
+
+        for _ in range(10):
+            await asyncio.sleep(0)
+        assert [params[0] for params in received] == expected
+        if overflow == 'block':
+            assert transport.resume_reading.call_count == 1
+        else:
+            assert conn.notification_stats()['dropped'] == 3
+        await conn.close()
+
+    asyncio.run(run())
+
+
+def test_JSONConnection_NotificationOverflowPolicy():
+    with pytest.raises(RPCError):
+        RPCClient(host='127.0.0.1', notification_overflow='drop-all')
+
+
 #@async_test
 #def test_JSONConnection_Http_GetArtists():
 #    conn = RPCClient(host='127.0.0.1', port=8080,
 #                     username='xbmc', password='xbmc')
 #    request = RPCRequest('AudioLibrary.GetArtists')
-#    response = yield from conn.request(request)
+#    response = await conn.request(request)
 
 
 #@async_test
 #def test_JSONConnection_Http_Introspect():
 #    conn = RPCClient(host='127.0.0.1', port=8080,
 #                     username='xbmc', password='xbmc')
-#    response = yield from conn.JSONRPC.Introspect(filter={'getdescriptions': True})
+#    response = await conn.JSONRPC.Introspect(filter={'getdescriptions': True})
 
 
 #@async_test
@@ -69,27 +332,343 @@ def async_test(f):
 #        yield from conn.request(request)
 
 
+@async_test
+async def test_JSONConnection_Tcp_Batch():
+    server, port = await echo_server(lambda m: [echo_batch(m)])
+    conn = RPCClient(host='127.0.0.1', port=port, method='tcp')
+    results = await conn.batch(batch_requests())
+    check_batch_results(results)
+    assert conn.pool_stats()['in_flight'] == [0]
+    await conn.close()
+    server.close()
+
+
+@async_test
+async def test_JSONConnection_Http_Batch():
+    runner, port = await http_server(echo_batch)
+    conn = RPCClient(host='127.0.0.1', port=port)
+    results = await conn.batch(batch_requests())
+    check_batch_results(results)
+    await conn.close()
+    await runner.cleanup()
+
+
+@async_test
+async def test_JSONConnection_Http_BatchNotifications():
+    runner, port = await http_server(echo_batch)
+    conn = RPCClient(host='127.0.0.1', port=port)
+    results = await conn.batch([RPCRequest('GUI.ShowNotification',
+                                           notification=True)] * 2)
+    assert results == [None, None]
+    await conn.close()
+    await runner.cleanup()
+
+
+@async_test
+async def test_JSONConnection_Http_AutoBatch():
+    posts = []
+    def counted(message):
+        posts.append(message)
+        if isinstance(message, list):
+            return echo_batch(message)
+        return echo_batch([message])[0]
+
+    runner, port = await http_server(counted)
+    conn = RPCClient(host='127.0.0.1', port=port, batch_window=0.01)
+    results = await asyncio.gather(*[conn.Echo.Params(idx=idx)
+                                     for idx in range(10)])
+    assert results == [{'idx': idx} for idx in range(10)]
+    assert len(posts) == 1
+
+    with pytest.raises(RPCRequestError):
+        await conn.Fail.Me()
+    await conn.close()
+    await runner.cleanup()
+
+
+@async_test
+async def test_JSONConnection_Tcp_AutoBatchSize():
+    frames = []
+    def counted(message):
+        frames.append(message)
+        return [echo_batch(message)]
+
+    server, port = await echo_server(counted)
+    conn = RPCClient(host='127.0.0.1', port=port, method='tcp',
+                     batch_window=10, batch_size=5)
+    results = await asyncio.gather(*[conn.Echo.Params(idx=idx)
+                                     for idx in range(10)])
+    assert [r['idx'] for r in results] == list(range(10))
+    assert len(frames) == 2
+    await conn.close()
+    server.close()
+
+
+@async_test
+async def test_JSONConnection_Http_KeepAlive():
+    peers = set()
+    runner, port = await http_server(lambda m: next(echo(m)), peers)
+    async with RPCClient(host='127.0.0.1', port=port,
+                         username='xbmc', password='xbmc') as conn:
+        for idx in range(5):
+            assert await conn.Echo.Params(idx=idx) == {'idx': idx}
+    assert len(peers) == 1
+    await runner.cleanup()
+
+
 @pytest.mark.kodi
 @async_test
-def test_JSONConnection_Tcp_Introspect():
+async def test_JSONConnection_Tcp_Introspect():
     conn = RPCClient(host='127.0.0.1', port=9090, method='tcp')
     request = RPCRequest('JSONRPC.Introspect')
-    response = yield from conn.request(request)
-    conn.close()
+    response = await conn.request(request)
+    await conn.close()
 
 
 @pytest.mark.kodi
 @async_test
-def test_JSONConnection_Tcp_Introspect_AttrAccess():
+async def test_JSONConnection_Tcp_Introspect_AttrAccess():
     conn = RPCClient(host='127.0.0.1', port=9090, method='tcp')
-    response = yield from conn.JSONRPC.Introspect(getdescriptions=True)
-    conn.close()
+    response = await conn.JSONRPC.Introspect(getdescriptions=True)
+    await conn.close()
 #    pass
 
 
 @pytest.mark.kodi
 @async_test
-def test_JSONConnection_Tcp_Introspect_BadParameter():
+async def test_JSONConnection_Tcp_Introspect_BadParameter():
     conn = RPCClient(host='127.0.0.1', port=9090, method='tcp')
-    response = yield from conn.JSONRPC.Introspect(filter={'getdescriptions': True})
-    conn.close()
+    response = await conn.JSONRPC.Introspect(filter={'getdescriptions': True})
+    await conn.close()
+
+
+@async_test
+async def test_JSONConnection_Tcp_PoolRouting():
+    server = RPCServer()
+    release = asyncio.Event()
+
+    @server.register('Slow.Wait')
+    async def wait():
+        await release.wait()
+        return 'done'
+
+    server.register('JSONRPC.Ping', lambda: 'pong')
+    tcp = await server.start_tcp('127.0.0.1', 0)
+    port = tcp.sockets[0].getsockname()[1]
+
+    async with RPCClient('127.0.0.1', port, method='tcp',
+                         tcp_connections=3) as conn:
+        slow = asyncio.ensure_future(conn.Slow.Wait())
+        await asyncio.sleep(0.01)
+        stats = conn.pool_stats()
+        assert stats['connected'] == 3
+        assert sorted(stats['in_flight']) == [0, 0, 1]
+        busy = stats['in_flight'].index(1)
+
+        for _idx in range(6):
+            response = await conn.JSONRPC.Ping()
+            assert response.result == 'pong'
+
+        stats = conn.pool_stats()
+        assert stats['requests'][busy] == 1
+        assert sum(stats['requests']) == 7
+
+        release.set()
+        assert (await slow).result == 'done'
+
+    await server.close()
+
+
+@async_test
+async def test_JSONConnection_Tcp_PoolReconnect():
+    server = RPCServer()
+    server.register('JSONRPC.Ping', lambda: 'pong')
+    tcp = await server.start_tcp('127.0.0.1', 0)
+    port = tcp.sockets[0].getsockname()[1]
+
+    async with RPCClient('127.0.0.1', port, method='tcp',
+                         tcp_connections=2) as conn:
+        await conn.JSONRPC.Ping()
+        conn._pool().protocols[0]._transport.abort()
+        await asyncio.sleep(0.01)
+        assert conn.pool_stats()['connected'] == 1
+
+        response = await conn.JSONRPC.Ping()
+        assert response.result == 'pong'
+
+        for _idx in range(50):
+            await asyncio.sleep(0.01)
+            if conn.pool_stats()['connected'] == 2:
+                break
+        assert conn.pool_stats()['reconnects'] == 1
+
+    await server.close()
+
+
+@async_test
+async def test_JSONConnection_Tcp_MaxInFlight():
+    server = RPCServer()
+    running = []
+
+    @server.register('Slow.Wait')
+    async def wait():
+        running.append(1)
+        peak = len(running)
+        await asyncio.sleep(0.01)
+        running.pop()
+        return peak
+
+    tcp = await server.start_tcp('127.0.0.1', 0)
+    port = tcp.sockets[0].getsockname()[1]
+
+    async with RPCClient('127.0.0.1', port, method='tcp',
+                         max_in_flight=2) as conn:
+        responses = await asyncio.gather(*[conn.Slow.Wait()
+                                           for _idx in range(6)])
+        assert max(r.result for r in responses) == 2
+
+    await server.close()
+
+
+@async_test
+async def test_JSONConnection_Tcp_WriteBackpressure():
+    transport = mock.MagicMock(**{'is_closing.return_value': False})
+    protocol = _TCPProtocol()
+    protocol.connection_made(transport)
+
+    protocol.pause_writing()
+    send = asyncio.ensure_future(protocol.send(RPCRequest('Player.Stop', uid=1)))
+    await asyncio.sleep(0)
+    assert not transport.write.called
+
+    protocol.resume_writing()
+    await asyncio.sleep(0)
+    assert transport.write.call_count == 1
+
+    protocol.data_received(b'{"jsonrpc": "2.0", "id": 1, "result": "OK"}')
+    assert (await send).result == 'OK'
+
+
+@async_test
+async def test_JSONConnection_Tcp_ReadBackpressure():
+    transport = mock.MagicMock(**{'is_closing.return_value': False})
+    protocol = _TCPProtocol(max_undelivered=2)
+    protocol.connection_made(transport)
+
+    sends = [asyncio.ensure_future(protocol.send(RPCRequest('Player.Stop', uid=idx)))
+             for idx in range(3)]
+    await asyncio.sleep(0)
+
+    protocol.data_received(b'{"jsonrpc": "2.0", "id": 0, "result": 0}'
+                           b'{"jsonrpc": "2.0", "id": 1, "result": 1}')
+    assert transport.pause_reading.call_count == 1
+
+    await asyncio.sleep(0)
+    assert transport.resume_reading.call_count == 1
+
+    protocol.data_received(b'{"jsonrpc": "2.0", "id": 2, "result": 2}')
+    responses = await asyncio.gather(*sends)
+    assert [r.result for r in responses] == [0, 1, 2]
+    assert not protocol._buffer.messsages
+
+
+@async_test
+async def test_JSONConnection_Tcp_LostWhileQueued():
+    transport = mock.MagicMock(**{'is_closing.return_value': False})
+    protocol = _TCPProtocol(max_in_flight=1)
+    protocol.connection_made(transport)
+
+    sends = [asyncio.ensure_future(protocol.send(RPCRequest('Player.Stop', uid=idx)))
+             for idx in range(2)]
+    await asyncio.sleep(0)
+    assert transport.write.call_count == 1
+
+    # The queued request is not written once the connection has gone
+    transport.is_closing.return_value = True
+    protocol.connection_lost(None)
+    results = await asyncio.wait_for(
+        asyncio.gather(*sends, return_exceptions=True), 1)
+    assert [type(r) for r in results] == [ConnectionResetError] * 2
+    assert transport.write.call_count == 1
+    assert not protocol._pending
+
+
+async def ws_server(handler, connections):
+    """Start a loopback WebSocket server which replies to each message with
+    the messages returned by ``handler``, which is also passed the
+    connection's WebSocket."""
+
+    async def get(request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        connections.append(ws)
+        async for msg in ws:
+            for reply in handler(ws, json.loads(msg.data)):
+                await ws.send_str(json.dumps(reply))
+        return ws
+
+    app = web.Application()
+    app.router.add_get('/jsonrpc', get)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, port
+
+
+@async_test
+async def test_JSONConnection_Ws():
+    server = RPCServer()
+
+    @server.register('Player.GetItem')
+    async def get_item(playerid):
+        await asyncio.sleep(0.01 * (5 - playerid))
+        return {'id': playerid}
+
+    runner = await server.start_ws('127.0.0.1', 0)
+    port = runner.addresses[0][1]
+
+    async with RPCClient('127.0.0.1', port, method='ws') as conn:
+        responses = await asyncio.gather(*[conn.Player.GetItem(idx)
+                                           for idx in range(5)])
+        assert [r['id'] for r in responses] == list(range(5))
+
+        results = await conn.batch([RPCRequest('Player.GetItem', playerid=4),
+                                    RPCRequest('Player.Stop')])
+        assert results[0]['id'] == 4
+        assert results[1].code == -32601
+
+        with pytest.raises(RPCRequestError):
+            await conn.Player.Stop()
+
+    await server.close()
+
+
+@async_test
+async def test_JSONConnection_Ws_NotificationsAndReconnect():
+    def notify(ws, message):
+        yield {'jsonrpc': '2.0', 'method': 'Player.OnPlay',
+               'params': {'data': message['id']}}
+        yield {'jsonrpc': '2.0', 'id': message['id'], 'result': 'OK'}
+
+    connections = []
+    runner, port = await ws_server(notify, connections)
+
+    received = asyncio.Queue()
+    conn = RPCClient('127.0.0.1', port, method='ws',
+                     notification_handler=received.put)
+    assert (await conn.Player.Play()).result == 'OK'
+    assert (await asyncio.wait_for(received.get(), 1)).method == 'Player.OnPlay'
+
+    await connections[0].close()
+    for _ in range(50):
+        await asyncio.sleep(0.02)
+        if conn.pool_stats()['reconnects']:
+            break
+    assert conn.pool_stats()['reconnects'] == 1
+    assert len(connections) == 2
+
+    assert (await conn.Player.Play()).result == 'OK'
+    await conn.close()
+    await runner.cleanup()
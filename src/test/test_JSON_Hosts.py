@@ -0,0 +1,349 @@
+# Copyright (c) 2017 Simon Kennedy <sffjunkie+code@gmail.com>
+
+import sys
+import os.path
+p = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, p)
+
+import pytest
+import asyncio
+import functools
+from unittest import mock
+
+import aiohttp
+from aiohttp import web
+
+from jsonrpc import RPCError
+from jsonrpc.client import RPCClient
+from jsonrpc.hosts import Host, HostSet, RPCUnavailableError
+from jsonrpc.message import RPCRequest, RPCRequestError
+from jsonrpc.retry import RetryPolicy, HedgePolicy
+from jsonrpc.server import RPCServer
+
+
+def async_test(f):
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        asyncio.run(f(*args, **kwargs))
+    return wrapper
+
+
+def test_Hosts_Breaker():
+    host = Host('127.0.0.1', 8080, breaker_threshold=2, breaker_timeout=10)
+    hosts = HostSet([host])
+
+    with mock.patch('time.monotonic', return_value=100):
+        host.failed()
+        assert hosts.choose() is host
+        host.failed()
+        assert host.state == 'open'
+        with pytest.raises(RPCUnavailableError):
+            hosts.choose()
+
+    with mock.patch('time.monotonic', return_value=110):
+        # A single trial call is let through
+        assert hosts.choose() is host
+        assert host.state == 'half-open'
+        assert hosts.alternative(None) is None
+
+        host.failed()
+        assert host.state == 'open'
+        assert host.ejections == 1
+
+    with mock.patch('time.monotonic', return_value=120):
+        assert hosts.choose() is host
+        with host.call():
+            pass
+        assert host.state == 'closed'
+        assert hosts.choose() is host
+
+
+def test_Hosts_NoBreaker():
+    host = Host('127.0.0.1', 8080)
+    for _ in range(10):
+        host.failed()
+    assert host.state == 'closed'
+    assert host.failures == 10
+
+
+def test_Hosts_Balance():
+    a, b, c = [Host('127.0.0.1', port) for port in (1, 2, 3)]
+    hosts = HostSet([a, b, c])
+    assert [hosts.choose() for _ in range(4)] == [a, b, c, a]
+    assert hosts.alternative(b) in (a, c)
+
+    hosts = HostSet([a, b, c], balance='latency')
+    a.succeeded(0.01)
+    b.succeeded(0.05)
+    assert hosts.choose() is c
+    c.succeeded(0.02)
+    assert hosts.choose() is a
+
+    a.in_flight = 4
+    assert hosts.choose() is c
+
+    # The average moves towards each new latency
+    a.succeeded(0.11)
+    assert a.latency == pytest.approx(0.04)
+
+    with pytest.raises(RPCError):
+        RPCClient('127.0.0.1', balance='random')
+
+
+def make_server(name, calls, delay=0):
+    server = RPCServer()
+
+    @server.register('JSONRPC.Ping')
+    def ping():
+        return 'pong'
+
+    @server.register('Player.GetItem')
+    async def get_item():
+        calls.append(name)
+        await asyncio.sleep(delay)
+        return name
+
+    @server.register('Player.GetItems')
+    def get_items():
+        return [name, name]
+
+    return server
+
+
+async def start_broken(status, text):
+    """Start an HTTP server which answers every request with a status and
+    a body"""
+    async def handler(request):
+        await request.read()
+        return web.Response(status=status, text=text)
+
+    app = web.Application()
+    app.router.add_post('/jsonrpc', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    return runner, runner.addresses[0][1]
+
+
+async def start_http(*servers):
+    ports = []
+    for server in servers:
+        runner = await server.start_http('127.0.0.1', 0)
+        ports.append(runner.addresses[0][1])
+    return ports
+
+
+@async_test
+async def test_Hosts_RoundRobin():
+    calls = []
+    servers = [make_server('a', calls), make_server('b', calls)]
+    ports = await start_http(*servers)
+
+    hosts = [('127.0.0.1', port) for port in ports]
+    async with RPCClient(hosts) as conn:
+        for _ in range(4):
+            await conn.Player.GetItem()
+        assert calls == ['a', 'b', 'a', 'b']
+
+        stats = conn.host_stats()
+        assert [s['port'] for s in stats] == ports
+        assert [s['calls'] for s in stats] == [2, 2]
+        assert all(s['latency'] > 0 for s in stats)
+
+    for server in servers:
+        await server.close()
+
+
+@async_test
+async def test_Hosts_Latency():
+    calls = []
+    servers = [make_server('slow', calls, 0.05), make_server('fast', calls)]
+    ports = await start_http(*servers)
+
+    hosts = [('127.0.0.1', port) for port in ports]
+    async with RPCClient(hosts, balance='latency') as conn:
+        for _ in range(10):
+            await conn.Player.GetItem()
+        assert calls.count('slow') == 1
+
+    for server in servers:
+        await server.close()
+
+
+@async_test
+async def test_Hosts_Ejection():
+    calls = []
+    servers = [make_server('a', calls), make_server('b', calls)]
+    ports = await start_http(*servers)
+    await servers[0].close()
+
+    hosts = [('127.0.0.1', port) for port in ports]
+    retry = RetryPolicy('*', backoff=0)
+    async with RPCClient(hosts, retry=retry, breaker_threshold=1,
+                         breaker_timeout=60) as conn:
+        for _ in range(4):
+            assert await conn.Player.GetItem() == 'b'
+        assert retry.retries == 1
+
+        stats = conn.host_stats()
+        assert stats[0]['state'] == 'open'
+        assert stats[0]['ejections'] == 1
+        assert stats[1]['state'] == 'closed'
+
+    await servers[1].close()
+
+
+@async_test
+async def test_Hosts_HealthCheck():
+    calls = []
+    servers = [make_server('a', calls), make_server('b', calls)]
+    ports = await start_http(*servers)
+
+    hosts = [('127.0.0.1', port) for port in ports]
+    async with RPCClient(hosts, health_interval=0.02,
+                         health_timeout=0.5) as conn:
+        assert await conn.Player.GetItem() == 'a'
+
+        await servers[0].close()
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if not conn.host_stats()[0]['healthy']:
+                break
+        assert [s['healthy'] for s in conn.host_stats()] == [False, True]
+
+        for _ in range(3):
+            assert await conn.Player.GetItem() == 'b'
+
+        await servers[1].close()
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if not conn.host_stats()[1]['healthy']:
+                break
+        with pytest.raises(RPCUnavailableError):
+            await conn.Player.GetItem()
+
+
+@async_test
+async def test_Hosts_StreamTrial():
+    calls = []
+    server = make_server('a', calls)
+    ports = await start_http(server)
+
+    async with RPCClient('127.0.0.1', ports[0], breaker_threshold=1,
+                         breaker_timeout=0.05) as conn:
+        host = conn._host_set().hosts[0]
+        host.failed()
+        assert host.state == 'open'
+        await asyncio.sleep(0.06)
+
+        # The stream is the trial call which closes the breaker
+        for _ in range(2):
+            async with conn.stream(RPCRequest('Player.GetItems')) as items:
+                assert [item async for item in items] == ['a', 'a']
+            assert host.state == 'closed'
+
+        assert host.calls == 2
+        assert host.latency > 0
+
+    await server.close()
+
+
+@async_test
+async def test_Hosts_ServerErrors():
+    calls = []
+    runner, broken = await start_broken(503, 'Service Unavailable')
+    server = make_server('b', calls)
+    ports = await start_http(server)
+
+    hosts = [('127.0.0.1', broken), ('127.0.0.1', ports[0])]
+    async with RPCClient(hosts[:1], breaker_threshold=2) as conn:
+        for _ in range(2):
+            with pytest.raises(aiohttp.ClientResponseError):
+                await conn.Player.GetItem()
+
+        stats = conn.host_stats()[0]
+        assert stats['state'] == 'open'
+        assert stats['failures'] == 2
+
+    retry = RetryPolicy('*', backoff=0)
+    async with RPCClient(hosts, retry=retry) as conn:
+        assert await conn.Player.GetItem() == 'b'
+        assert retry.retries == 1
+
+    await runner.cleanup()
+    await server.close()
+
+
+@async_test
+async def test_Hosts_ServerErrorReply():
+    # A 5xx status with a JSON-RPC error is an answer from the host
+    error = '{"jsonrpc": "2.0", "id": 1, ' \
+        '"error": {"code": -32603, "message": "Internal error"}}'
+    runner, broken = await start_broken(500, error)
+
+    async with RPCClient('127.0.0.1', broken, breaker_threshold=1) as conn:
+        for _ in range(2):
+            with pytest.raises(RPCRequestError) as exc:
+                await conn.Player.GetItem()
+            assert exc.value.code == -32603
+
+            with pytest.raises(RPCRequestError) as exc:
+                async for _ in conn.stream(RPCRequest('Player.GetItems')):
+                    pass
+            assert exc.value.code == -32603
+
+        stats = conn.host_stats()[0]
+        assert stats['state'] == 'closed'
+        assert stats['failures'] == 0
+
+    await runner.cleanup()
+
+
+@async_test
+async def test_Hosts_HealthCheckBadReply():
+    calls = []
+    runner, broken = await start_broken(200, 'not JSON')
+    server = make_server('b', calls)
+    ports = await start_http(server)
+
+    hosts = [('127.0.0.1', broken), ('127.0.0.1', ports[0])]
+    async with RPCClient(hosts, health_interval=0.02,
+                         health_timeout=0.5) as conn:
+        with pytest.raises(ValueError):
+            await conn.Player.GetItem()
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if not conn.host_stats()[0]['healthy']:
+                break
+        assert [s['healthy'] for s in conn.host_stats()] == [False, True]
+
+        # The health checks carry on
+        await asyncio.sleep(0.05)
+        assert not conn._health_task.done()
+        for _ in range(3):
+            assert await conn.Player.GetItem() == 'b'
+
+    await runner.cleanup()
+    await server.close()
+
+
+@async_test
+async def test_Hosts_Hedge():
+    calls = []
+    servers = [make_server('slow', calls, 1), make_server('fast', calls)]
+    ports = await start_http(*servers)
+
+    hosts = [('127.0.0.1', port) for port in ports]
+    hedge = HedgePolicy('Player.*', delay=0.05)
+    async with RPCClient(hosts, hedge=hedge) as conn:
+        assert await conn.Player.GetItem() == 'fast'
+        assert calls == ['slow', 'fast']
+        assert hedge.won == 1
+
+        stats = conn.host_stats()
+        assert [s['in_flight'] for s in stats] == [0, 0]
+        assert stats[0]['failures'] == 0
+
+    for server in servers:
+        await server.close()
@@ -0,0 +1,240 @@
+# Copyright (c) 2017 Simon Kennedy <sffjunkie+code@gmail.com>
+
+import sys
+import os.path
+p = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, p)
+
+import pytest
+import asyncio
+import copy
+import functools
+import inspect
+import subprocess
+
+from jsonrpc.client import RPCClient
+from jsonrpc.introspect import RPCSchema, version_string
+from jsonrpc.message import RPCRequestError
+from jsonrpc.server import RPCServer, METHOD_NOT_FOUND, INVALID_PARAMS
+
+# A cut down version of the description Kodi returns
+DESCRIPTION = {
+    'version': '12.4.0',
+    'types': {
+        'Player.Id': {'id': 'Player.Id', 'type': 'integer', 'minimum': 0,
+                      'maximum': 2, 'default': -1},
+        'Player.Property.Name': {'id': 'Player.Property.Name',
+                                 'type': 'string',
+                                 'enum': ['time', 'totaltime', 'speed']},
+        'List.Filter.Rule': {'id': 'List.Filter.Rule', 'type': 'object',
+                             'properties': {
+                                 'field': {'type': 'string', 'required': True},
+                                 'value': {'type': ['string', 'array'],
+                                           'required': True}},
+                             'additionalProperties': False},
+        'List.Filter': {'id': 'List.Filter', 'type': [
+            {'type': 'object', 'properties': {
+                'and': {'type': 'array', 'items': {'$ref': 'List.Filter'},
+                        'minItems': 1, 'required': True}},
+             'additionalProperties': False},
+            {'$ref': 'List.Filter.Rule'}]},
+        'List.Limits': {'id': 'List.Limits', 'type': 'object',
+                        'properties': {'start': {'type': 'integer',
+                                                 'minimum': 0}}},
+    },
+    'methods': {
+        'JSONRPC.Ping': {'description': 'Ping responder', 'params': [],
+                         'type': 'method'},
+        'Player.GetProperties': {
+            'description': 'Retrieves the values of the given properties',
+            'params': [
+                {'name': 'playerid', '$ref': 'Player.Id', 'required': True},
+                {'name': 'properties', 'type': 'array', 'required': True,
+                 'items': {'$ref': 'Player.Property.Name'},
+                 'uniqueItems': True}],
+            'type': 'method'},
+        'AudioLibrary.GetArtists': {
+            'description': 'Retrieve all artists',
+            'params': [
+                {'name': 'limits', '$ref': 'List.Limits'},
+                {'name': 'filter', '$ref': 'List.Filter'},
+                {'name': 'albumartistsonly', 'type': ['boolean', 'null'],
+                 'default': None}],
+            'type': 'method'},
+    },
+}
+
+
+def async_test(f):
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        asyncio.run(f(*args, **kwargs))
+    return wrapper
+
+
+def invalid(schema, method, *args, **kwargs):
+    with pytest.raises(RPCRequestError) as exc:
+        schema.check(method, args, kwargs)
+    assert exc.value.code == INVALID_PARAMS
+    return exc.value.data
+
+
+def test_Schema_Check():
+    schema = RPCSchema(DESCRIPTION)
+    schema.check('JSONRPC.Ping')
+    schema.check('Player.GetProperties', (1, ['time', 'speed']))
+    schema.check('Player.GetProperties', (),
+                 {'playerid': 0, 'properties': []})
+
+    assert invalid(schema, 'Player.GetProperties', 3, ['time']) == \
+        'playerid: 3 is more than the maximum 2'
+    assert invalid(schema, 'Player.GetProperties', True, ['time']) == \
+        'playerid: True is not of type integer'
+    assert invalid(schema, 'Player.GetProperties', 1, ['time', 'bogus']) == \
+        "properties[1]: 'bogus' is not one of 'time', 'totaltime', 'speed'"
+    assert invalid(schema, 'Player.GetProperties', 1, ['time', 'time']) == \
+        "properties: 'time' is repeated"
+    assert invalid(schema, 'Player.GetProperties', 1) == \
+        'Missing parameter properties'
+    assert invalid(schema, 'Player.GetProperties', 1, [], 2).startswith(
+        'Player.GetProperties takes at most 2 parameters')
+    assert invalid(schema, 'JSONRPC.Ping', extra=1) == \
+        'Unknown parameter extra'
+
+    with pytest.raises(RPCRequestError) as exc:
+        schema.check('Player.Missing')
+    assert exc.value.code == METHOD_NOT_FOUND
+
+
+def test_Schema_RecursiveTypes():
+    schema = RPCSchema(DESCRIPTION)
+    rule = {'field': 'genre', 'value': 'Rock'}
+    schema.check('AudioLibrary.GetArtists', (),
+                 {'filter': {'and': [rule, {'and': [rule]}]},
+                  'limits': {'start': 0, 'end': 10},
+                  'albumartistsonly': None})
+
+    data = invalid(schema, 'AudioLibrary.GetArtists',
+                   filter={'and': [rule, {'and': []}]})
+    assert data.startswith('filter: ')
+    invalid(schema, 'AudioLibrary.GetArtists',
+            filter={'field': 'genre', 'value': 1})
+    assert invalid(schema, 'AudioLibrary.GetArtists',
+                   limits={'start': -1}) == \
+        'limits.start: -1 is less than the minimum 0'
+
+
+def test_Schema_Stubs():
+    schema = RPCSchema(DESCRIPTION)
+    stub = schema.stub('Player.GetProperties', None)
+    assert stub.__doc__ == 'Retrieves the values of the given properties'
+    signature = inspect.signature(stub)
+    assert list(signature.parameters) == ['playerid', 'properties']
+    assert signature.parameters['playerid'].annotation == 'int'
+
+    source = schema.stub_source()
+    assert 'class Player:' in source
+    assert '    async def GetProperties(self, playerid: int, ' \
+        'properties: list) -> Any: ...' in source
+    assert 'albumartistsonly: Any = ...' in source
+    compile(source, 'jsonrpc.pyi', 'exec')
+
+    assert schema.namespace_methods('Player') == ['GetProperties']
+
+
+def test_Schema_Version():
+    assert version_string({'version': {'major': 12, 'minor': 4,
+                                       'patch': 0}}) == '12.4.0'
+    assert version_string({'version': 6}) == '6'
+    assert RPCSchema.cache_path('/tmp', '12.4/0').endswith('jsonrpc-12.4_0.json')
+
+
+def test_Client_DoesNotImportServer():
+    code = ('import sys; import jsonrpc.client; '
+            'sys.exit("jsonrpc.server" in sys.modules)')
+    assert subprocess.call([sys.executable, '-c', code], cwd=p) == 0
+
+
+def make_server(calls):
+    server = RPCServer()
+
+    @server.register('JSONRPC.Version')
+    def version():
+        calls.append('JSONRPC.Version')
+        return {'version': {'major': 12, 'minor': 4, 'patch': 0}}
+
+    @server.register('JSONRPC.Introspect')
+    def introspect():
+        calls.append('JSONRPC.Introspect')
+        return copy.deepcopy(DESCRIPTION)
+
+    @server.register('Player.GetProperties')
+    def get_properties(playerid, properties):
+        calls.append('Player.GetProperties')
+        return dict((name, 0) for name in properties)
+
+    return server
+
+
+@pytest.mark.parametrize('method', ['http', 'tcp'])
+@async_test
+async def test_Client_Introspect(tmp_path, method):
+    calls = []
+    server = make_server(calls)
+    if method == 'http':
+        runner = await server.start_http('127.0.0.1', 0)
+        port = runner.addresses[0][1]
+    else:
+        tcp = await server.start_tcp('127.0.0.1', 0)
+        port = tcp.sockets[0].getsockname()[1]
+
+    async with RPCClient('127.0.0.1', port, method=method) as conn:
+        await conn.Player.GetProperties(5, ['time'])
+        assert calls.pop() == 'Player.GetProperties'
+
+        schema = await conn.introspect(str(tmp_path))
+        assert schema.version == '12.4.0'
+        assert calls == ['JSONRPC.Version', 'JSONRPC.Introspect']
+        assert os.path.exists(str(tmp_path / 'jsonrpc-12.4.0.json'))
+
+        result = await conn.Player.GetProperties(1, ['time'])
+        if method == 'tcp':
+            result = result.result
+        assert result == {'time': 0}
+
+        with pytest.raises(RPCRequestError) as exc:
+            await conn.Player.GetProperties(5, ['time'])
+        assert exc.value.code == INVALID_PARAMS
+        with pytest.raises(RPCRequestError) as exc:
+            await conn.Player.Stop()
+        assert exc.value.code == METHOD_NOT_FOUND
+
+        # Prepared methods are checked in the same way
+        get_time = conn.prepare('Player.GetProperties', ['playerid'],
+                                {'properties': ['time']})
+        with pytest.raises(RPCRequestError) as exc:
+            await get_time(5)
+        assert exc.value.code == INVALID_PARAMS
+        with pytest.raises(RPCRequestError) as exc:
+            await conn.prepare('Player.GetProperties', ['properties'])(['time'])
+        assert exc.value.code == INVALID_PARAMS
+        with pytest.raises(RPCRequestError) as exc:
+            conn.prepare('Player.Stop')
+        assert exc.value.code == METHOD_NOT_FOUND
+        assert calls.count('Player.GetProperties') == 1
+
+        result = await get_time(playerid=1)
+        if method == 'tcp':
+            result = result.result
+        assert result == {'time': 0}
+        assert 'GetProperties' in dir(conn.Player)
+
+    # A new client loads the description from the cache
+    del calls[:]
+    async with RPCClient('127.0.0.1', port, method=method) as conn:
+        schema = await conn.introspect(str(tmp_path))
+        assert calls == ['JSONRPC.Version']
+        with pytest.raises(RPCRequestError):
+            await conn.Player.GetProperties(1, ['bogus'])
+
+    await server.close()
@@ -8,7 +8,7 @@ sys.path.insert(0, p)
 import pytest
 
 import json
-from jsonrpc.message import RPCRequest, RPCResponse, RPCMessageError, RPCRequestError
+from jsonrpc.message import RPCRequest, RPCPreparedRequest, RPCResponse, RPCBatch, RPCMessageError, RPCRequestError, uuid_ids
 
 
 def test_Request_Kwargs():
@@ -71,7 +71,7 @@ def test_Response_MarshalError():
     message = response.marshal()
     data = json.loads(message.decode('UTF-8'))
     assert data['id'] == 1
-    assert data['result'] == None
+    assert 'result' not in data
     assert data['error']['code'] == -32768
     assert data['error']['message'] == 'Unable to get movies'
 
@@ -105,3 +105,166 @@ def test_Response_UnmarshalErrorInfo():
     except RPCRequestError as exc:
         assert exc.code == -32768
         assert exc.message == 'Bad id'
+
+
+def test_Response_Unmarshal_EmptyResult():
+    response = RPCResponse()
+    response.unmarshal(b'{"jsonrpc": "2.0", "result": [], "id": 1}')
+    assert response.result == []
+
+
+def test_Response_Unmarshal_NoResult():
+    with pytest.raises(RPCMessageError):
+        response = RPCResponse()
+        response.unmarshal(b'{"jsonrpc": "2.0", "id": 1}')
+
+
+def test_Batch_Marshal():
+    batch = RPCBatch([RPCRequest('Player.GetActivePlayers', uid=1),
+                      RPCRequest('GUI.ShowNotification', notification=True)])
+
+    data = json.loads(batch.marshal().decode('UTF-8'))
+    assert len(data) == 2
+    assert data[0]['id'] == 1
+    assert 'id' not in data[1]
+
+
+def test_Batch_MarshalEmpty():
+    with pytest.raises(RPCMessageError):
+        RPCBatch().marshal()
+
+
+def test_Batch_Unmarshal():
+    batch = RPCBatch()
+    batch.unmarshal(b'[{"jsonrpc": "2.0", "result": [], "id": 1}, {"jsonrpc": "2.0", "error": {"code": -32601, "message": "Method not found"}, "id": 2}, {"jsonrpc": "2.0", "method": "Player.OnPlay"}]')
+    assert len(batch) == 3
+    assert batch.messages[0].result == []
+    assert batch.messages[1].uid == 2
+    assert batch.messages[1].exception().code == -32601
+    assert batch.messages[2].method == 'Player.OnPlay'
+
+
+def test_Request_Slots():
+    command = RPCRequest('VideoLibrary.GetMovies', uid=1)
+    assert not hasattr(command, '__dict__')
+    assert not hasattr(RPCResponse(), '__dict__')
+
+
+def test_Request_ZeroId():
+    command = RPCRequest('VideoLibrary.GetMovies', uid=0)
+    assert command.uid == 0
+
+
+def test_Request_EmptyId():
+    with pytest.raises(RPCMessageError):
+        RPCRequest('VideoLibrary.GetMovies', uid='')
+
+
+def test_Request_UUIDIds():
+    ids = uuid_ids()
+    first, second = next(ids), next(ids)
+    assert isinstance(first, str)
+    assert first != second
+
+
+def test_Response_UnmarshalLazy():
+    data = b'{"id": 1, "jsonrpc": "2.0", "result": {"artists": [{"id": 1}]}}'
+    response = RPCResponse()
+    response.unmarshal(data, lazy=True)
+    assert response.uid == 1
+    assert response.version == '2.0'
+    assert response.raw_result == b'{"artists": [{"id": 1}]}'
+    assert response['artists'] == [{'id': 1}]
+
+    response = RPCResponse()
+    response.unmarshal(b'{"jsonrpc":"2.0","result":"OK","id":"x"}\n', lazy=True)
+    assert response.uid == 'x'
+    assert response.result == 'OK'
+
+
+def test_Response_UnmarshalLazyFallback():
+    # The result cannot be found cheaply so the response is decoded in full
+    response = RPCResponse()
+    response.unmarshal(b'{"id": "a\\"b", "result": [1]}', lazy=True)
+    assert response.uid == 'a"b'
+    assert response.result == [1]
+
+    response = RPCResponse()
+    response.unmarshal(b'{"id": 2, "result": null, "error": null}', lazy=True)
+    assert response.result is None
+
+    with pytest.raises(RPCRequestError):
+        RPCResponse().unmarshal(b'{"id": 2, "result": null, '
+                                b'"error": {"code": 1, "message": "Failed"}}',
+                                lazy=True)
+
+    # Complex members after the result
+    for data, result in [
+            (b'{"id":1,"result":{"a":1},"meta":{"b":2}}', {'a': 1}),
+            (b'{"id":1,"result":[1, {"a": "]"}],"meta":[2]}', [1, {'a': ']'}]),
+            (b'{"id":1,"result":3,"meta":{"b":[2]}}', 3),
+            (b'{"result":{"a":1},"id":1,"meta":{"b":2}}', {'a': 1})]:
+        response = RPCResponse()
+        response.unmarshal(data, lazy=True)
+        assert response.uid == 1
+        assert response.result == result
+        assert json.loads(response.raw_result) == result
+
+        response = RPCResponse()
+        response.unmarshal(data, lazy=True)
+        assert json.loads(response.raw_result) == result
+        assert response.result == result
+
+    response = RPCResponse()
+    response.result = {'a': 1}
+    assert json.loads(response.raw_result) == {'a': 1}
+
+
+@pytest.mark.parametrize('codec', ['json', 'orjson'])
+def test_Request_Prepared(codec):
+    pytest.importorskip(codec)
+    properties = ['time', 'totaltime']
+    prepared = RPCPreparedRequest('Player.GetProperties', ['playerid', 'x'],
+                                  {'properties': properties}, codec=codec)
+
+    for request, params in [
+            (prepared.request(1, 5), {'playerid': 5}),
+            (prepared.request('a', playerid=0, x={'y': [1]}),
+             {'playerid': 0, 'x': {'y': [1]}}),
+            (prepared.request(3), {})]:
+        params['properties'] = properties
+        expected = RPCRequest('Player.GetProperties', request.uid, **params)
+        expected.uid = request.uid
+        assert json.loads(request.marshal()) == \
+            json.loads(expected.marshal())
+        assert request.params == params
+        assert request.method == 'Player.GetProperties'
+        assert not request.notification
+
+    batch = RPCBatch([prepared.request(7, 1), RPCRequest('JSONRPC.Ping', 8)])
+    assert [m['id'] for m in json.loads(batch.marshal())] == [7, 8]
+
+
+def test_Request_PreparedVersions():
+    prepared = RPCPreparedRequest('JSONRPC.Ping')
+    assert json.loads(prepared.request(1).marshal()) == \
+        {'jsonrpc': '2.0', 'method': 'JSONRPC.Ping', 'id': 1}
+    assert prepared.request(1).params is None
+
+    prepared = RPCPreparedRequest('JSONRPC.Ping', ['a'], version='1.1')
+    assert json.loads(prepared.request(1, 2).marshal()) == \
+        {'version': '1.1', 'method': 'JSONRPC.Ping', 'params': {'a': 2},
+         'id': 1}
+
+
+def test_Request_PreparedErrors():
+    with pytest.raises(RPCMessageError):
+        RPCPreparedRequest('')
+    with pytest.raises(RPCMessageError):
+        RPCPreparedRequest('Player.GetItem', ['playerid'], {'playerid': 1})
+
+    prepared = RPCPreparedRequest('Player.GetItem', ['playerid'])
+    with pytest.raises(RPCMessageError):
+        prepared.request(1, 1, 2)
+    with pytest.raises(RPCMessageError):
+        prepared.request(1, properties=[])
@@ -0,0 +1,137 @@
+# Copyright (c) 2017 Simon Kennedy <sffjunkie+code@gmail.com>
+
+import sys
+import os.path
+p = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, p)
+
+import pytest
+import asyncio
+import functools
+from unittest import mock
+
+from jsonrpc.client import RPCClient
+from jsonrpc.message import RPCRequest, RPCRequestError
+from jsonrpc.metrics import RPCMetrics
+from jsonrpc.server import RPCServer
+
+
+def async_test(f):
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        asyncio.run(f(*args, **kwargs))
+    return wrapper
+
+
+def test_Metrics_Histogram():
+    metrics = RPCMetrics(buckets=[0.01, 0.1])
+    for elapsed in (0.005, 0.01, 0.05, 5):
+        with mock.patch('time.perf_counter', side_effect=[100, 100 + elapsed]):
+            start = metrics.started('Player.GetItem')
+            metrics.finished('Player.GetItem', start)
+
+    latency = metrics.snapshot()['methods']['Player.GetItem']['latency']
+    assert sum(latency['counts']) == 4
+    assert latency['counts'][2] == 1
+    assert latency['bounds'] == [0.01, 0.1]
+    assert latency['min'] == pytest.approx(0.005)
+    assert latency['max'] == pytest.approx(5)
+
+
+def test_Metrics_CallsAndHooks():
+    calls = []
+    metrics = RPCMetrics(hooks=[lambda *args: calls.append(args)])
+
+    with metrics.call('JSONRPC.Ping'):
+        assert metrics.snapshot()['in_flight'] == 1
+        assert metrics.snapshot()['methods']['JSONRPC.Ping']['in_flight'] == 1
+
+    with pytest.raises(ValueError):
+        with metrics.call('JSONRPC.Ping'):
+            raise ValueError()
+
+    snapshot = metrics.snapshot()
+    assert snapshot['in_flight'] == 0
+    assert snapshot['methods']['JSONRPC.Ping']['calls'] == 2
+    assert snapshot['methods']['JSONRPC.Ping']['errors'] == 1
+    assert [(method, error is None) for method, _s, error in calls] == \
+        [('JSONRPC.Ping', True), ('JSONRPC.Ping', False)]
+
+
+def test_Metrics_Reset():
+    metrics = RPCMetrics()
+    metrics.sent(10)
+    metrics.finished('JSONRPC.Ping', metrics.started('JSONRPC.Ping'))
+    start = metrics.started('Player.GetItem')
+    metrics.reset()
+
+    snapshot = metrics.snapshot()
+    assert snapshot['bytes_sent'] == 0
+    assert list(snapshot['methods']) == ['Player.GetItem']
+    assert snapshot['methods']['Player.GetItem']['in_flight'] == 1
+
+    metrics.finished('Player.GetItem', start)
+    assert metrics.snapshot()['methods']['Player.GetItem']['calls'] == 1
+
+
+def make_server():
+    server = RPCServer()
+
+    @server.register('JSONRPC.Ping')
+    def ping():
+        return 'pong'
+
+    @server.register('Player.Fail')
+    def fail():
+        raise RPCRequestError('Failed', -32000)
+
+    return server
+
+
+async def exercise(conn, metrics):
+    await conn.request(RPCRequest('JSONRPC.Ping'))
+    with pytest.raises(RPCRequestError):
+        await conn.request(RPCRequest('Player.Fail'))
+    await conn.batch([RPCRequest('JSONRPC.Ping'), RPCRequest('Player.Fail')])
+
+    snapshot = metrics.snapshot()
+    assert snapshot['in_flight'] == 0
+    assert snapshot['bytes_sent'] > 0
+    assert snapshot['bytes_received'] > 0
+    assert snapshot['methods']['JSONRPC.Ping']['calls'] == 2
+    assert snapshot['methods']['JSONRPC.Ping']['errors'] == 0
+    assert snapshot['methods']['Player.Fail']['calls'] == 2
+    assert snapshot['methods']['Player.Fail']['errors'] == 2
+    assert sum(snapshot['methods']['JSONRPC.Ping']['latency']['counts']) == 2
+    return snapshot
+
+
+@async_test
+async def test_Metrics_Http():
+    server = make_server()
+    runner = await server.start_http('127.0.0.1', 0)
+    port = runner.addresses[0][1]
+
+    metrics = RPCMetrics()
+    async with RPCClient('127.0.0.1', port, metrics=metrics) as conn:
+        await exercise(conn, metrics)
+
+    await server.close()
+
+
+@async_test
+async def test_Metrics_Tcp():
+    server = make_server()
+    tcp = await server.start_tcp('127.0.0.1', 0)
+    port = tcp.sockets[0].getsockname()[1]
+
+    metrics = RPCMetrics()
+    async with RPCClient('127.0.0.1', port, method='tcp',
+                         metrics=metrics) as conn:
+        snapshot = await exercise(conn, metrics)
+
+        stats = conn.pool_stats()
+        assert stats['bytes_sent'] == [snapshot['bytes_sent']]
+        assert stats['bytes_received'] == [snapshot['bytes_received']]
+
+    await server.close()
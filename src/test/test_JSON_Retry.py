@@ -0,0 +1,204 @@
+# Copyright (c) 2017 Simon Kennedy <sffjunkie+code@gmail.com>
+
+import sys
+import os.path
+p = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, p)
+
+import pytest
+import asyncio
+import functools
+from unittest import mock
+
+import aiohttp
+
+from jsonrpc.client import RPCClient
+from jsonrpc.message import RPCRequest, RPCRequestError
+from jsonrpc.metrics import RPCMetrics
+from jsonrpc.retry import RetryPolicy, HedgePolicy
+from jsonrpc.server import RPCServer
+
+
+def async_test(f):
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        asyncio.run(f(*args, **kwargs))
+    return wrapper
+
+
+def test_Retry_Delay():
+    retry = RetryPolicy('*.Get*', attempts=4, backoff=0.1, max_backoff=0.3,
+                        jitter=False)
+    assert retry.applies('Player.GetItem')
+    assert not retry.applies('Player.Stop')
+
+    assert retry.delay(1, ConnectionResetError()) == pytest.approx(0.1)
+    assert retry.delay(2, ConnectionResetError()) == pytest.approx(0.2)
+    assert retry.delay(3, asyncio.TimeoutError()) == pytest.approx(0.3)
+    assert retry.delay(4, ConnectionResetError()) is None
+    assert retry.delay(1, RPCRequestError('Invalid params.', -32602)) is None
+
+    retry = RetryPolicy(['*'], backoff=1, max_backoff=1)
+    with mock.patch('random.uniform', return_value=0.5) as uniform:
+        assert retry.delay(1, OSError()) == 0.5
+    uniform.assert_called_once_with(0, 1)
+
+
+def test_Hedge_Delay():
+    hedge = HedgePolicy('*', percentile=90, delay=0.5, min_samples=10)
+    assert hedge.delay('Player.GetItem') == 0.5
+
+    for idx in range(1, 11):
+        hedge.record('Player.GetItem', idx / 100)
+    assert hedge.delay('Player.GetItem') == pytest.approx(0.09)
+    assert hedge.delay('Player.GetProperties') == 0.5
+
+
+def make_server(delays):
+    """A server whose Player.GetItem sleeps for each delay in turn"""
+    server = RPCServer()
+    delays = iter(delays)
+
+    @server.register('Player.GetItem')
+    async def get_item():
+        await asyncio.sleep(next(delays, 0))
+        return 'item'
+
+    @server.register('JSONRPC.Ping')
+    def ping():
+        return 'pong'
+
+    return server
+
+
+@async_test
+async def test_Deadline_Tcp():
+    # A host which never responds
+    server = await asyncio.get_event_loop().create_server(asyncio.Protocol,
+                                                          '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+
+    metrics = RPCMetrics()
+    async with RPCClient('127.0.0.1', port, method='tcp', metrics=metrics,
+                         request_timeout=0.05) as conn:
+        with pytest.raises(asyncio.TimeoutError):
+            await conn.request(RPCRequest('Player.GetItem', uid=1))
+
+        with pytest.raises(asyncio.TimeoutError):
+            await conn.batch([RPCRequest('Player.GetItem', uid=2)],
+                             timeout=0.01)
+
+        assert conn.pool_stats()['in_flight'] == [0]
+        assert metrics.snapshot()['in_flight'] == 0
+        assert metrics.snapshot()['methods']['Player.GetItem']['errors'] == 2
+
+    server.close()
+    await server.wait_closed()
+
+
+@async_test
+async def test_Deadline_Http():
+    server = make_server([1])
+    runner = await server.start_http('127.0.0.1', 0)
+    port = runner.addresses[0][1]
+
+    async with RPCClient('127.0.0.1', port) as conn:
+        with pytest.raises(asyncio.TimeoutError):
+            await conn.request(RPCRequest('Player.GetItem', uid=1),
+                               timeout=0.05)
+        assert await conn.JSONRPC.Ping() == 'pong'
+
+    await server.close()
+
+
+@async_test
+async def test_Retry_AttemptTimeout():
+    server = make_server([1])
+    tcp = await server.start_tcp('127.0.0.1', 0)
+    port = tcp.sockets[0].getsockname()[1]
+
+    retry = RetryPolicy('Player.Get*', attempt_timeout=0.05, jitter=False,
+                        backoff=0.01)
+    async with RPCClient('127.0.0.1', port, method='tcp', retry=retry,
+                         request_timeout=5) as conn:
+        response = await conn.request(RPCRequest('Player.GetItem', uid=1))
+        assert response.result == 'item'
+        assert retry.retries == 1
+
+    await server.close()
+
+
+@async_test
+async def test_Retry_ConnectionError():
+    server = make_server([])
+    runner = await server.start_http('127.0.0.1', 0)
+    port = runner.addresses[0][1]
+    await server.close()
+
+    retry = RetryPolicy('*', attempts=3, backoff=0.01)
+    async with RPCClient('127.0.0.1', port, retry=retry) as conn:
+        with pytest.raises(aiohttp.ClientConnectionError):
+            await conn.JSONRPC.Ping()
+        assert retry.retries == 2
+
+        # The deadline stops the retries
+        retry.retries = 0
+        retry.backoff = retry.max_backoff = 10
+        retry.jitter = False
+        with pytest.raises(aiohttp.ClientConnectionError):
+            await conn.request(RPCRequest('JSONRPC.Ping', uid=1), timeout=1)
+        assert retry.retries == 0
+
+        # Methods not matched are not retried
+        retry.methods = ['Player.*']
+        retry._matches.clear()
+        with pytest.raises(aiohttp.ClientConnectionError):
+            await conn.JSONRPC.Ping()
+        assert retry.retries == 0
+
+
+@pytest.mark.parametrize('method', ['http', 'tcp'])
+@async_test
+async def test_Hedge(method):
+    server = make_server([1])
+    if method == 'http':
+        runner = await server.start_http('127.0.0.1', 0)
+        port = runner.addresses[0][1]
+    else:
+        tcp = await server.start_tcp('127.0.0.1', 0)
+        port = tcp.sockets[0].getsockname()[1]
+
+    hedge = HedgePolicy('Player.*', delay=0.05)
+    async with RPCClient('127.0.0.1', port, method=method, hedge=hedge,
+                         tcp_connections=2, request_timeout=0.5) as conn:
+        result = await conn.request(RPCRequest('Player.GetItem', uid=1))
+        if method == 'tcp':
+            result = result.result
+            assert conn.pool_stats()['in_flight'] == [0, 0]
+        assert result == 'item'
+        assert hedge.hedged == 1
+        assert hedge.won == 1
+
+        # Answered before the delay
+        await conn.Player.GetItem()
+        assert hedge.hedged == 1
+
+    await server.close()
+
+
+@async_test
+async def test_Hedge_SingleConnection():
+    server = make_server([0.1])
+    tcp = await server.start_tcp('127.0.0.1', 0)
+    port = tcp.sockets[0].getsockname()[1]
+
+    hedge = HedgePolicy('*', delay=0.01)
+    async with RPCClient('127.0.0.1', port, method='tcp', hedge=hedge) as conn:
+        response = await conn.request(RPCRequest('Player.GetItem', uid=1))
+        assert response.result == 'item'
+        assert hedge.hedged == 0
+
+        with pytest.raises(RPCRequestError):
+            await conn.request(RPCRequest('Player.Stop', uid=2))
+
+    await server.close()
@@ -0,0 +1,374 @@
+# Copyright (c) 2017 Simon Kennedy <sffjunkie+code@gmail.com>
+
+import sys
+import os.path
+p = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, p)
+
+import pytest
+import asyncio
+import functools
+import json
+import os
+import socket
+import threading
+import time
+
+pytest.importorskip('jsonrpc.server')
+
+from jsonrpc import RPCError
+from jsonrpc.client import RPCClient
+from jsonrpc.message import RPCRequest, RPCRequestError
+from jsonrpc.server import (RPCServer, PARSE_ERROR, INVALID_REQUEST,
+                            METHOD_NOT_FOUND, INVALID_PARAMS, INTERNAL_ERROR)
+
+
+def async_test(f):
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        asyncio.run(f(*args, **kwargs))
+    return wrapper
+
+
+class Player(object):
+    def __init__(self):
+        self.played = []
+
+    def GetItem(self, playerid, properties=None):
+        return {'item': {'id': playerid, 'properties': properties or []}}
+
+    async def Play(self, item):
+        self.played.append(item)
+        return 'OK'
+
+    def Fail(self):
+        raise ValueError('Broken')
+
+    def Refuse(self):
+        raise RPCRequestError('Not now', 1001, {'reason': 'busy'})
+
+    def _private(self):
+        pass
+
+
+def process_id(value):
+    return [os.getpid(), value * 2]
+
+
+def make_server():
+    server = RPCServer()
+    player = Player()
+    server.add_namespace('Player', player)
+
+    @server.register('JSONRPC.Ping')
+    def ping():
+        return 'pong'
+
+    server.register('JSONRPC.Sum', lambda *values: sum(values))
+    return server, player
+
+
+def call(server, data):
+    reply = asyncio.run(server.dispatch(json.dumps(data).encode('UTF-8')))
+    if reply is None:
+        return None
+    return json.loads(reply.decode('UTF-8'))
+
+
+def test_Server_Positional():
+    server, _player = make_server()
+    reply = call(server, {'jsonrpc': '2.0', 'id': 1, 'method': 'Player.GetItem',
+                          'params': [1, ['title']]})
+    assert reply == {'jsonrpc': '2.0', 'id': 1,
+                     'result': {'item': {'id': 1, 'properties': ['title']}}}
+
+
+def test_Server_Named():
+    server, _player = make_server()
+    reply = call(server, {'jsonrpc': '2.0', 'id': 'a', 'method': 'Player.GetItem',
+                          'params': {'playerid': 2}})
+    assert reply['result']['item']['id'] == 2
+
+
+def test_Server_VarPositional():
+    server, _player = make_server()
+    reply = call(server, {'jsonrpc': '2.0', 'id': 1, 'method': 'JSONRPC.Sum',
+                          'params': [1, 2, 3]})
+    assert reply['result'] == 6
+
+
+def test_Server_Coroutine():
+    server, player = make_server()
+    reply = call(server, {'jsonrpc': '2.0', 'id': 1, 'method': 'Player.Play',
+                          'params': {'item': 'a'}})
+    assert reply['result'] == 'OK'
+    assert player.played == ['a']
+
+
+def test_Server_Notification():
+    server, player = make_server()
+    reply = call(server, {'jsonrpc': '2.0', 'method': 'Player.Play',
+                          'params': ['b']})
+    assert reply is None
+    assert player.played == ['b']
+
+
+def test_Server_Errors():
+    server, _player = make_server()
+
+    reply = asyncio.run(server.dispatch(b'{"jsonrpc": "2.0", "method"'))
+    reply = json.loads(reply.decode('UTF-8'))
+    assert reply['error']['code'] == PARSE_ERROR
+    assert reply['id'] is None
+    assert 'result' not in reply
+
+    reply = call(server, {'jsonrpc': '2.0', 'id': 1, 'method': 1})
+    assert reply['error']['code'] == INVALID_REQUEST
+
+    reply = call(server, {'jsonrpc': '2.0', 'id': 1, 'method': 'Player.Stop'})
+    assert reply['error']['code'] == METHOD_NOT_FOUND
+
+    reply = call(server, {'jsonrpc': '2.0', 'id': 1, 'method': 'Player._private'})
+    assert reply['error']['code'] == METHOD_NOT_FOUND
+
+    reply = call(server, {'jsonrpc': '2.0', 'id': 1, 'method': 'Player.GetItem'})
+    assert reply['error']['code'] == INVALID_PARAMS
+
+    reply = call(server, {'jsonrpc': '2.0', 'id': 1, 'method': 'Player.GetItem',
+                          'params': [1, 2, 3]})
+    assert reply['error']['code'] == INVALID_PARAMS
+
+    reply = call(server, {'jsonrpc': '2.0', 'id': 1, 'method': 'Player.GetItem',
+                          'params': {'playerid': 1, 'volume': 2}})
+    assert reply['error']['code'] == INVALID_PARAMS
+
+    reply = call(server, {'jsonrpc': '2.0', 'id': 1, 'method': 'Player.Fail'})
+    assert reply['error'] == {'code': INTERNAL_ERROR,
+                              'message': 'Internal error', 'data': 'Broken'}
+
+    reply = call(server, {'jsonrpc': '2.0', 'id': 1, 'method': 'Player.Refuse'})
+    assert reply['error'] == {'code': 1001, 'message': 'Not now',
+                              'data': {'reason': 'busy'}}
+
+
+def test_Server_Batch():
+    server, _player = make_server()
+    reply = call(server, [
+        {'jsonrpc': '2.0', 'id': 1, 'method': 'JSONRPC.Ping'},
+        {'jsonrpc': '2.0', 'method': 'Player.Play', 'params': ['c']},
+        {'jsonrpc': '2.0', 'id': 2, 'method': 'Player.Stop'},
+        1,
+    ])
+    assert len(reply) == 3
+    assert reply[0] == {'jsonrpc': '2.0', 'id': 1, 'result': 'pong'}
+    assert reply[1]['error']['code'] == METHOD_NOT_FOUND
+    assert reply[2]['error']['code'] == INVALID_REQUEST
+
+    assert call(server, [{'jsonrpc': '2.0', 'method': 'JSONRPC.Ping'}]) is None
+    assert call(server, [])['error']['code'] == INVALID_REQUEST
+
+
+@async_test
+async def test_Server_Tcp():
+    server, _player = make_server()
+    tcp = await server.start_tcp('127.0.0.1', 0)
+    port = tcp.sockets[0].getsockname()[1]
+
+    async with RPCClient('127.0.0.1', port, method='tcp') as conn:
+        responses = await asyncio.gather(*[conn.Player.GetItem(idx)
+                                           for idx in range(20)])
+        assert [r['item']['id'] for r in responses] == list(range(20))
+
+        results = await conn.batch([RPCRequest('JSONRPC.Ping'),
+                                    RPCRequest('Player.Stop')])
+        assert results[0].result == 'pong'
+        assert results[1].code == METHOD_NOT_FOUND
+
+    await server.close()
+
+
+@async_test
+async def test_Server_TcpLazyResults():
+    server, _player = make_server()
+    tcp = await server.start_tcp('127.0.0.1', 0)
+    port = tcp.sockets[0].getsockname()[1]
+
+    async with RPCClient('127.0.0.1', port, method='tcp',
+                         lazy_results=True) as conn:
+        responses = await asyncio.gather(*[conn.Player.GetItem(idx)
+                                           for idx in range(5)])
+        assert [json.loads(r.raw_result)['item']['id'] for r in responses] == \
+            list(range(5))
+        assert [r['item']['id'] for r in responses] == list(range(5))
+
+        with pytest.raises(RPCRequestError):
+            await conn.Player.Refuse()
+
+    await server.close()
+
+
+@pytest.mark.parametrize('framing', ['json', 'line', 'length'])
+@async_test
+async def test_Server_TcpFraming(framing):
+    server, _player = make_server()
+    tcp = await server.start_tcp('127.0.0.1', 0, framing=framing)
+    port = tcp.sockets[0].getsockname()[1]
+
+    async with RPCClient('127.0.0.1', port, method='tcp',
+                         framing=framing) as conn:
+        response = await conn.Player.GetItem(1, ['title'])
+        assert response['item']['properties'] == ['title']
+
+        results = await conn.batch([RPCRequest('JSONRPC.Ping'),
+                                    RPCRequest('Player.GetItem', playerid=2)])
+        assert results[0].result == 'pong'
+        assert results[1]['item']['id'] == 2
+
+    await server.close()
+
+
+@pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'),
+                    reason='Unix domain sockets not supported')
+@pytest.mark.parametrize('framing', ['json', 'length'])
+@async_test
+async def test_Server_Unix(tmp_path, framing):
+    path = str(tmp_path / 'jsonrpc.sock')
+    server, _player = make_server()
+    await server.start_unix(path, framing=framing)
+
+    async with RPCClient(path, method='unix', framing=framing,
+                         tcp_connections=2) as conn:
+        responses = await asyncio.gather(*[conn.Player.GetItem(idx)
+                                           for idx in range(10)])
+        assert [r['item']['id'] for r in responses] == list(range(10))
+
+        results = await conn.batch([RPCRequest('JSONRPC.Ping'),
+                                    RPCRequest('Player.Stop')])
+        assert results[0].result == 'pong'
+        assert results[1].code == METHOD_NOT_FOUND
+        assert conn.pool_stats()['connected'] == 2
+
+    await server.close()
+
+
+@async_test
+async def test_Server_Http():
+    server, _player = make_server()
+    runner = await server.start_http('127.0.0.1', 0)
+    port = runner.addresses[0][1]
+
+    async with RPCClient('127.0.0.1', port) as conn:
+        assert await conn.JSONRPC.Ping() == 'pong'
+        assert await conn.Player.GetItem(playerid=3) == \
+            {'item': {'id': 3, 'properties': []}}
+
+        with pytest.raises(RPCRequestError):
+            await conn.Player.Refuse()
+
+    await server.close()
+
+
+@pytest.mark.parametrize('method', ['http', 'tcp'])
+@async_test
+async def test_Server_Prepared(method):
+    server, _player = make_server()
+    if method == 'http':
+        runner = await server.start_http('127.0.0.1', 0)
+        port = runner.addresses[0][1]
+    else:
+        tcp = await server.start_tcp('127.0.0.1', 0)
+        port = tcp.sockets[0].getsockname()[1]
+
+    async with RPCClient('127.0.0.1', port, method=method) as conn:
+        get_item = conn.prepare('Player.GetItem', ['playerid'],
+                                {'properties': ['title']})
+        responses = await asyncio.gather(*[get_item(idx) for idx in range(5)])
+        assert [r['item'] for r in responses] == \
+            [{'id': idx, 'properties': ['title']} for idx in range(5)]
+
+        ping = conn.prepare('JSONRPC.Ping')
+        result = await ping()
+        if method == 'tcp':
+            result = result.result
+        assert result == 'pong'
+
+        results = await conn.batch([ping.template.request(100),
+                                    get_item.template.request(101, 7)])
+        assert results[0].result == 'pong'
+        assert results[1]['item']['id'] == 7
+
+        with pytest.raises(RPCRequestError):
+            await conn.prepare('Player.Refuse')()
+
+    await server.close()
+
+
+@async_test
+async def test_Server_ThreadExecution():
+    server = RPCServer(thread_workers=2)
+    threads = set()
+
+    def blocking(delay):
+        threads.add(threading.get_ident())
+        time.sleep(delay)
+        return delay
+
+    server.register('Slow.Sleep', blocking, execution='thread')
+    server.register('JSONRPC.Ping', lambda: 'pong')
+
+    start = time.monotonic()
+    slow = asyncio.gather(*[server.dispatch(b'{"jsonrpc": "2.0", "id": 1, "method": "Slow.Sleep", "params": [0.2]}')
+                            for _idx in range(2)])
+    ping = await server.dispatch(b'{"jsonrpc": "2.0", "id": 2, "method": "JSONRPC.Ping"}')
+    assert time.monotonic() - start < 0.1
+    assert json.loads(ping.decode('UTF-8'))['result'] == 'pong'
+
+    replies = await slow
+    assert time.monotonic() - start < 0.35
+    assert json.loads(replies[0].decode('UTF-8'))['result'] == 0.2
+    assert threading.get_ident() not in threads
+    await server.close()
+
+
+@async_test
+async def test_Server_ProcessExecution():
+    server = RPCServer(process_workers=1)
+    server.register('Math.Double', process_id, execution='process')
+
+    reply = await server.dispatch(b'{"jsonrpc": "2.0", "id": 1, "method": "Math.Double", "params": [21]}')
+    pid, value = json.loads(reply.decode('UTF-8'))['result']
+    assert value == 42
+    assert pid != os.getpid()
+    await server.close()
+
+
+@async_test
+async def test_Server_Concurrency():
+    server = RPCServer()
+    running = []
+
+    @server.register('Slow.Wait', concurrency=2)
+    async def wait():
+        running.append(1)
+        peak = len(running)
+        await asyncio.sleep(0.01)
+        running.pop()
+        return peak
+
+    replies = await asyncio.gather(*[server.dispatch(b'{"jsonrpc": "2.0", "id": 1, "method": "Slow.Wait"}')
+                                     for _idx in range(6)])
+    peaks = [json.loads(r.decode('UTF-8'))['result'] for r in replies]
+    assert max(peaks) == 2
+
+
+def test_Server_BadExecution():
+    server = RPCServer()
+
+    with pytest.raises(RPCError):
+        server.register('Slow.Sleep', time.sleep, execution='cluster')
+
+    async def coro():
+        pass
+
+    with pytest.raises(RPCError):
+        server.register('Slow.Wait', coro, execution='thread')
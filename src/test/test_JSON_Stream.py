@@ -0,0 +1,185 @@
+# Copyright (c) 2017 Simon Kennedy <sffjunkie+code@gmail.com>
+
+import sys
+import os.path
+p = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, p)
+
+import pytest
+import asyncio
+import functools
+import json
+import time
+
+from jsonrpc.client import RPCClient
+from jsonrpc.message import RPCRequest, RPCRequestError, RPCMessageError
+from jsonrpc.server import RPCServer
+from jsonrpc.stream import JSONArrayParser
+
+ARTISTS = [{'artistid': idx, 'artist': 'Artist, [%d] {"x"}' % idx}
+           for idx in range(500)]
+
+
+def async_test(f):
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        asyncio.run(f(*args, **kwargs))
+    return wrapper
+
+
+def response(result, uid=1):
+    return json.dumps({'id': uid, 'jsonrpc': '2.0', 'result': result}).encode()
+
+
+def feed_chunks(parser, data, size):
+    items = []
+    for idx in range(0, len(data), size):
+        items.extend(parser.feed(data[idx:idx + size]))
+    return items
+
+
+@pytest.mark.parametrize('size', [1, 7, 4096])
+def test_Stream_Parser(size):
+    data = response({'limits': {'start': 0, 'total': 500},
+                     'artists': ARTISTS})
+    parser = JSONArrayParser('artists')
+    assert feed_chunks(parser, data, size) == ARTISTS
+    assert parser.finished
+
+
+def test_Stream_ParserBounded():
+    data = response({'artists': ARTISTS})
+    parser = JSONArrayParser('artists')
+    for idx in range(0, len(data), 64):
+        parser.feed(data[idx:idx + 64])
+        assert len(parser._data) < 200
+
+
+def test_Stream_ParserLongStrings():
+    # A long string split over many pieces is scanned once rather than
+    # from its start each time more of it arrives
+    text = 'x\\"' * 350000
+    data = response({'note': text, 'artists': [{'artist': text}, 'y']})
+    parser = JSONArrayParser('artists')
+    start = time.perf_counter()
+    assert feed_chunks(parser, data, 1024) == [{'artist': text}, 'y']
+    assert time.perf_counter() - start < 2
+
+
+def test_Stream_ParserPaths():
+    parser = JSONArrayParser()
+    assert parser.feed(response([1, 'two', None, [3], {'a': [4]}])) == \
+        [1, 'two', None, [3], {'a': [4]}]
+
+    parser = JSONArrayParser('library.songs')
+    data = response({'songs': [0], 'library': {'songs': [1, 2]}})
+    assert parser.feed(data) == [1, 2]
+
+    parser = JSONArrayParser('artists')
+    assert parser.feed(response({'artists': []})) == []
+    assert parser.finished
+
+
+def test_Stream_ParserSkipsNotifications():
+    notification = json.dumps({'jsonrpc': '2.0', 'method': 'Player.OnPlay',
+                               'params': {'artists': [9]}}).encode()
+    parser = JSONArrayParser('artists')
+    data = notification + b'\n' + response({'artists': [1, 2]})
+    assert feed_chunks(parser, data, 5) == [1, 2]
+
+
+def test_Stream_ParserErrors():
+    parser = JSONArrayParser('artists')
+    error = json.dumps({'id': 1, 'jsonrpc': '2.0',
+                        'error': {'code': -32601,
+                                  'message': 'Method not found.'}}).encode()
+    with pytest.raises(RPCRequestError):
+        parser.feed(error)
+
+    parser = JSONArrayParser('artists')
+    with pytest.raises(RPCMessageError):
+        parser.feed(response({'albums': [1]}))
+
+
+def make_server():
+    server = RPCServer()
+
+    @server.register('AudioLibrary.GetArtists')
+    def get_artists():
+        return {'limits': {'total': len(ARTISTS)}, 'artists': ARTISTS}
+
+    return server
+
+
+@async_test
+async def test_Stream_Http():
+    server = make_server()
+    runner = await server.start_http('127.0.0.1', 0)
+    port = runner.addresses[0][1]
+
+    async with RPCClient('127.0.0.1', port) as conn:
+        request = RPCRequest('AudioLibrary.GetArtists')
+        async with conn.stream(request, 'artists', window=10) as artists:
+            received = [artist async for artist in artists]
+        assert received == ARTISTS
+
+        with pytest.raises(RPCRequestError):
+            async for _ in conn.stream(RPCRequest('AudioLibrary.GetSongs')):
+                pass
+
+    await server.close()
+
+
+@pytest.mark.parametrize('framing', ['json', 'line', 'length'])
+@async_test
+async def test_Stream_Tcp(framing):
+    server = make_server()
+    tcp = await server.start_tcp('127.0.0.1', 0, framing=framing)
+    port = tcp.sockets[0].getsockname()[1]
+
+    async with RPCClient('127.0.0.1', port, method='tcp',
+                         framing=framing) as conn:
+        request = RPCRequest('AudioLibrary.GetArtists')
+        async with conn.stream(request, 'artists', window=10) as artists:
+            received = [artist async for artist in artists]
+        assert received == ARTISTS
+
+        async with conn.stream(request, 'artists', window=1) as artists:
+            async for artist in artists:
+                assert artist == ARTISTS[0]
+                break
+
+    await server.close()
+
+
+@async_test
+async def test_Stream_MethodOverride(tmp_path):
+    path = str(tmp_path / 'jsonrpc.sock')
+    server = make_server()
+    await server.start_unix(path)
+
+    async with RPCClient(path, method='tcp') as conn:
+        request = RPCRequest('AudioLibrary.GetArtists')
+        async with conn.stream(request, 'artists', method='unix') as artists:
+            received = [artist async for artist in artists]
+        assert received == ARTISTS
+
+        with pytest.raises(RPCMessageError):
+            conn.stream(request, method='udp')
+
+    await server.close()
+
+
+@async_test
+async def test_Stream_Ws():
+    server = make_server()
+    runner = await server.start_ws('127.0.0.1', 0)
+    port = runner.addresses[0][1]
+
+    async with RPCClient('127.0.0.1', port, method='ws') as conn:
+        request = RPCRequest('AudioLibrary.GetArtists')
+        async with conn.stream(request, 'artists') as artists:
+            received = [artist async for artist in artists]
+        assert received == ARTISTS
+
+    await server.close()